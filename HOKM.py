@@ -1,23 +1,60 @@
 import os
 import logging
-from enum import Enum
-from typing import Dict, List, Tuple, Optional
+from abc import ABC, abstractmethod
+from enum import Enum, IntEnum
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple, Optional
 from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from contextlib import asynccontextmanager, contextmanager
+from bisect import bisect_left, insort
 from datetime import datetime
+from collections import Counter, OrderedDict
+from contextvars import Context, ContextVar
+from array import array
 import random
 import asyncio
+import time
+import base64
+import fcntl
+import hashlib
+import json
+import queue
+import secrets
+import signal
+import struct
+import subprocess
+import sys
+import threading
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+# شروع بارگذاری ماژول؛ مبدا گزارش زمان مراحل راه‌اندازی
+BOOT_STARTED = time.perf_counter()
+
+import httpx
+from telegram import (
+    Bot,
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
     filters
 )
 
 # ==================== تنظیمات ====================
+# «python HOKM.py export-history مسیر» فقط فایل آرشیو را می‌خواند؛ توکن، پایگاه داده
+# و وضعیت مشترک برایش لازم نیست
+EXPORT_ONLY = __name__ == "__main__" and sys.argv[1:2] == ["export-history"]
+
 # در رندر از Environment Variables استفاده می‌کنیم
 TOKEN = os.environ.get("TOKEN") or os.environ.get("TELEGRAM_BOT_TOKEN")
 
@@ -30,7 +67,7 @@ if not TOKEN:
     except ImportError:
         pass
 
-if not TOKEN:
+if not TOKEN and not EXPORT_ONLY:
     print("❌ توکن یافت نشد!")
     print("در رندر: Environment Variable با نام TOKEN ایجاد کن")
     print("مثال: Key: TOKEN, Value: توکن_ربات_شما")
@@ -39,9 +76,99 @@ if not TOKEN:
 # در رندر از PORT استفاده می‌کنیم
 PORT = int(os.environ.get("PORT", 10000))
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # در رندر خودکار تنظیم می‌شود
+# تلگرام این مقدار را در سرآیند X-Telegram-Bot-Api-Secret-Token هر آپدیت می‌فرستد؛
+# پیش‌فرض از توکن ساخته می‌شود تا بین راه‌اندازی‌ها و کارگرها ثابت بماند
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{TOKEN}".encode()).hexdigest()
+# getWebhookInfo توکن مخفی را برنمی‌گرداند؛ اثر آن در مسیر باعث می‌شود با تغییر توکن، webhook دوباره تنظیم شود
+WEBHOOK_PATH = f"/{TOKEN}/{hashlib.sha256(WEBHOOK_SECRET.encode()).hexdigest()[:8]}"
+# سرور HTTP داخلی: مهلت خواندن کل هر درخواست، حداکثر حجم بدنه و حداکثر اتصال هم‌زمان
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+HTTP_MAX_BODY = int(os.environ.get("HTTP_MAX_BODY", 256 * 1024))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 256))
+# /metrics فقط با سرآیند «Authorization: Bearer <METRICS_TOKEN>» (خالی = غیرفعال)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# آدرس Bot API (خالی = api.telegram.org)؛ برای سرور Bot API محلی یا تست‌ها
+BOT_API_URL = os.environ.get("BOT_API_URL", "")
+# ایندکس آرشیو و جدول ربات چند ثانیه بعد از بالا آمدن ربات بارگذاری می‌شوند (شروع سرد سریع‌تر)
+BOOT_WARMUP_DELAY = float(os.environ.get("BOOT_WARMUP_DELAY", 5))
+
+# کلاینت HTTP درخواست‌های Bot API؛ getUpdates استخر اتصال جداگانه خودش را دارد
+BOT_API_POOL_SIZE = int(os.environ.get("BOT_API_POOL_SIZE", 16))
+GET_UPDATES_POOL_SIZE = int(os.environ.get("GET_UPDATES_POOL_SIZE", 1))
+BOT_API_CONNECT_TIMEOUT = float(os.environ.get("BOT_API_CONNECT_TIMEOUT", 5.0))
+BOT_API_READ_TIMEOUT = float(os.environ.get("BOT_API_READ_TIMEOUT", 5.0))
+BOT_API_WRITE_TIMEOUT = float(os.environ.get("BOT_API_WRITE_TIMEOUT", 5.0))
+BOT_API_POOL_TIMEOUT = float(os.environ.get("BOT_API_POOL_TIMEOUT", 5.0))  # انتظار برای اتصال آزاد
+BOT_API_KEEPALIVE = float(os.environ.get("BOT_API_KEEPALIVE", 30.0))  # عمر اتصال بیکار (ثانیه)
+BOT_API_HTTP2 = os.environ.get("BOT_API_HTTP2", "") == "1"  # نیاز به python-telegram-bot[http2]
+
+# حداکثر تعداد آپدیت‌هایی که هم‌زمان پردازش می‌شوند
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 64))
+
+# پاکسازی بازی‌های رهاشده (بر حسب ثانیه)
+GAME_TTL_WAITING = int(os.environ.get("GAME_TTL_WAITING", 30 * 60))
+GAME_TTL_PLAYING = int(os.environ.get("GAME_TTL_PLAYING", 60 * 60))
+GAME_TTL_FINISHED = int(os.environ.get("GAME_TTL_FINISHED", 15 * 60))
+MAX_GAMES = int(os.environ.get("MAX_GAMES", 50000))  # سقف کل بازی‌های داخل حافظه
+REAPER_INTERVAL = int(os.environ.get("REAPER_INTERVAL", 60))
+
+# محدودیت ارسال ویرایش‌ها (تلگرام حدود ۳۰ پیام در ثانیه و حدود ۱ پیام در ثانیه در هر چت)
+EDIT_CHAT_RATE = float(os.environ.get("EDIT_CHAT_RATE", 1.0))
+EDIT_CHAT_BURST = int(os.environ.get("EDIT_CHAT_BURST", 3))
+EDIT_GLOBAL_RATE = float(os.environ.get("EDIT_GLOBAL_RATE", 25.0))
+EDIT_GLOBAL_BURST = int(os.environ.get("EDIT_GLOBAL_BURST", 25))
+
+# کنترل کلیک‌ها: سطل توکن هر کاربر (کلیک در ثانیه، ۰ = بدون محدودیت)
+CLICK_RATE = float(os.environ.get("CLICK_RATE", 3.0))
+CLICK_BURST = int(os.environ.get("CLICK_BURST", 6))
+
+# جدول حل‌شده بازی برای حریف ربات
+BOT_TABLE_PATH = os.environ.get("BOT_TABLE_PATH", "ttt_solved.bin")
+
+# اجرای چند پردازه‌ای: WORKERS پردازه کارگر پشت یک توزیع‌کننده که بر اساس chat_id تقسیم می‌کند
+WORKERS = int(os.environ.get("WORKERS", 1))
+WORKER_INDEX = os.environ.get("WORKER_INDEX")  # فقط در پردازه‌های کارگر تنظیم می‌شود
+# وضعیت مشترک بازی‌ها: "" (فقط همین پردازه)، "memory" یا "sqlite:مسیر"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "")
+# حداکثر انتظار برای قفل نوشتن SQLite مشترک؛ کوتاه، چون پرس‌وجوها روی event loop اجرا می‌شوند
+STATE_BACKEND_TIMEOUT = float(os.environ.get("STATE_BACKEND_TIMEOUT", 0.25))
+
+# ذخیره‌سازی دائمی (خالی = فقط حافظه)
+GAME_DB_PATH = os.environ.get("GAME_DB_PATH", "")
+STORE_FLUSH_INTERVAL = float(os.environ.get("STORE_FLUSH_INTERVAL", 0.5))
+STORE_BATCH_SIZE = int(os.environ.get("STORE_BATCH_SIZE", 1000))
+
+# امتیاز Elo
+ELO_K = float(os.environ.get("ELO_K", 32))
+ELO_INITIAL_RATING = float(os.environ.get("ELO_INITIAL_RATING", 1000))
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 10))
+
+# آرشیو بازی‌های تمام‌شده (خالی = بدون آرشیو)
+HISTORY_PATH = os.environ.get("HISTORY_PATH", "")
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 5))
+
+# صف /quickmatch: زمان انتظار (ثانیه) و پهنای بازه امتیاز هر صف (۰ = یک صف برای همه)
+QUICKMATCH_TIMEOUT = int(os.environ.get("QUICKMATCH_TIMEOUT", 120))
+QUICKMATCH_BUCKET = int(os.environ.get("QUICKMATCH_BUCKET", 200))
 
-print(f"✅ توکن خوانده شد")
-print(f"🔧 پورت: {PORT}")
+# پروفایل زمان اجرا: شناسه‌های ادمین (جدا با کاما) و محل فایل‌های خروجی
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip()}
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))  # فاصله نمونه‌برداری پشته (ثانیه CPU)
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", 300))
+PROFILE_ON_BOOT = int(os.environ.get("PROFILE_ON_BOOT", 0))  # ضبط خودکار از زمان راه‌اندازی (ثانیه، ۰ = خاموش)
+
+# حالت اینلاین: مدت کش نتایج در سرور تلگرام (ثانیه) و اندازه کارت‌های پیش‌فرض
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))
+INLINE_PRESET_SIZES = tuple(int(size) for size in os.environ.get("INLINE_PRESET_SIZES", "3,4,5").split(","))
+
+# پیام لابی گروه‌ها (/lobby)
+LOBBY_DEBOUNCE = float(os.environ.get("LOBBY_DEBOUNCE", 2.0))  # پنجره تجمیع تغییرات پیش از ویرایش (ثانیه)
+LOBBY_MAX_GAMES = int(os.environ.get("LOBBY_MAX_GAMES", 10))  # سقف دکمه‌های پیوستن هر لابی
+
+if not EXPORT_ONLY:
+    print(f"✅ توکن خوانده شد")
+    print(f"🔧 پورت: {PORT}")
 
 # تنظیمات لاگ
 logging.basicConfig(
@@ -65,7 +192,298 @@ class GameStatus(Enum):
     DRAW = "مساوی!"
     CANCELLED = "لغو شد"
 
-@dataclass
+# ==================== بیت‌بورد ====================
+# هر خانه یک بیت است: اندیس = row * size + col
+BOARD_SIZE = 3
+BOARD_CELLS = BOARD_SIZE * BOARD_SIZE
+FULL_BOARD = (1 << BOARD_CELLS) - 1
+
+# ۸ خط برنده به صورت ماسک از پیش محاسبه‌شده
+WIN_MASKS: Tuple[int, ...] = (
+    0b000000111, 0b000111000, 0b111000000,  # سطرها
+    0b001001001, 0b010010010, 0b100100100,  # ستون‌ها
+    0b100010001, 0b001010100,               # قطرها
+)
+
+def has_line(stones: int) -> bool:
+    """آیا این مجموعه مهره یک خط کامل دارد؟ (صفحه ۳×۳)"""
+    for mask in WIN_MASKS:
+        if stones & mask == mask:
+            return True
+    return False
+
+# صفحه‌های بزرگ‌تر: N×N با K مهره در یک ردیف
+MIN_BOARD_SIZE = 3
+MAX_BOARD_SIZE = 8  # سقف دکمه‌های هر ردیف کیبورد اینلاین
+
+def default_win_length(size: int) -> int:
+    return 3 if size == 3 else 4 if size <= 5 else 5
+
+@lru_cache(maxsize=None)
+def line_masks(size: int, win_length: int) -> Tuple[int, ...]:
+    """همه پنجره‌های K خانه‌ای (افقی، عمودی و دو قطر)"""
+    masks = []
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row = row + d_row * (win_length - 1)
+                end_col = col + d_col * (win_length - 1)
+                if not (0 <= end_row < size and 0 <= end_col < size):
+                    continue
+                mask = 0
+                for i in range(win_length):
+                    mask |= 1 << ((row + d_row * i) * size + col + d_col * i)
+                masks.append(mask)
+    return tuple(masks)
+
+@lru_cache(maxsize=None)
+def cell_lines(size: int, win_length: int) -> Tuple[Tuple[int, ...], ...]:
+    """برای هر خانه فقط پنجره‌هایی که از آن می‌گذرند (حداکثر ۴K ماسک)"""
+    masks = line_masks(size, win_length)
+    return tuple(
+        tuple(mask for mask in masks if mask >> cell & 1)
+        for cell in range(size * size)
+    )
+
+# ==================== callback_data ====================
+# قالب: base64url( نسخه | عمل | بایت پایین آرگومان | شناسه بازی ۶ بایتی | ادامه آرگومان varint )
+# سه بایت اول دقیقا ۴ کاراکتر و شناسه دقیقا ۸ کاراکتر می‌شود، پس شناسه بازی
+# بدون رمزگشایی از رشته خوانده می‌شود. طول معمول ۱۲ کاراکتر است (سقف تلگرام ۶۴ بایت).
+CALLBACK_VERSION = 1
+GAME_ID_BYTES = 6
+GAME_ID_CHARS = 8
+EMPTY_GAME_ID = "A" * GAME_ID_CHARS
+
+class CallbackAction(IntEnum):
+    NEW = 1
+    JOIN = 2
+    MOVE = 3
+    DELETE = 4
+    NONE = 5
+    HISTORY = 6
+    INLINE = 7
+    LOBBY = 8
+
+def new_game_id() -> str:
+    """شناسه کوتاه تصادفی (۸ کاراکتر base64url)"""
+    return base64.urlsafe_b64encode(secrets.token_bytes(GAME_ID_BYTES)).decode()
+
+def inline_game_id(inline_message_id: str) -> str:
+    """شناسه ثابت بازی یک کارت اینلاین؛ همه پردازه‌ها بدون هماهنگی به یک شناسه می‌رسند"""
+    digest = hashlib.blake2b(inline_message_id.encode(), digest_size=GAME_ID_BYTES).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+def _pack_header(action: CallbackAction, low: int) -> str:
+    return base64.urlsafe_b64encode(bytes((CALLBACK_VERSION, action, low))).decode()
+
+# همه سرآیندهای ممکن از پیش ساخته می‌شوند تا رمزگشایی فقط یک جستجوی dict باشد
+_CALLBACK_HEADERS: Dict[str, Tuple[CallbackAction, int]] = {
+    _pack_header(action, low): (action, low)
+    for action in CallbackAction
+    for low in range(256)
+}
+_CALLBACK_HEADER_CHARS = {value: key for key, value in _CALLBACK_HEADERS.items()}
+
+def encode_callback(action: CallbackAction, game_id: str = "", arg: int = 0) -> str:
+    data = _CALLBACK_HEADER_CHARS[action, arg & 0xFF] + (game_id or EMPTY_GAME_ID)
+    arg >>= 8
+    if arg:
+        raw = bytearray()
+        while arg > 0x7F:
+            raw.append((arg & 0x7F) | 0x80)
+            arg >>= 7
+        raw.append(arg)
+        data += base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+    return data
+
+def decode_callback(data: str) -> Optional[Tuple[CallbackAction, str, int]]:
+    """برگرداندن (عمل، شناسه بازی، آرگومان) یا None برای داده نامعتبر/قدیمی"""
+    header = _CALLBACK_HEADERS.get(data[:4])
+    if header is None or len(data) < 4 + GAME_ID_CHARS:
+        return None
+    action, arg = header
+    game_id = data[4:4 + GAME_ID_CHARS]
+    if game_id == EMPTY_GAME_ID:
+        game_id = ""
+    tail = data[4 + GAME_ID_CHARS:]
+    if tail:
+        try:
+            raw = base64.urlsafe_b64decode(tail + "=" * (-len(tail) % 4))
+        except ValueError:
+            return None
+        shift = 8
+        for b in raw:
+            arg |= (b & 0x7F) << shift
+            shift += 7
+    return action, game_id, arg
+
+# ==================== رندر ====================
+# متن دکمه‌های صفحه فقط به چینش مهره‌ها بستگی دارد و بین بازی‌ها مشترک است،
+# پس در کش LRU نگه داشته می‌شود. کیبورد و متن هر بازی شناسه خودش را دارد؛
+# آخرین نسخه آنها روی خود بازی می‌ماند و تا تغییر state_version دوباره ساخته
+# نمی‌شود. مسیر عادی هر وضعیت را یک بار رندر می‌کند، پس hit بیشتر از رندرهای
+# دوباره می‌آید (مثل پیام نهایی بازی هنگام پاکسازی).
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 4096))
+# hit/miss کش کیبورد و متن هر بازی
+game_render_counters: Counter = Counter()
+# هر کیبورد چند کیلوبایت است؛ فقط RENDER_CACHE_SIZE بازی با آخرین رندر آن را نگه می‌دارند
+_rendered_games: "OrderedDict[str, TicTacToeGame]" = OrderedDict()
+
+def _remember_render(game: "TicTacToeGame"):
+    _rendered_games[game.game_id] = game
+    _rendered_games.move_to_end(game.game_id)
+    if len(_rendered_games) > RENDER_CACHE_SIZE:
+        _, oldest = _rendered_games.popitem(last=False)
+        oldest._keyboard = oldest._text = None
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def board_labels(x_bits: int, o_bits: int, playing: bool, size: int = BOARD_SIZE) -> Tuple[Tuple[str, ...], ...]:
+    """متن دکمه‌های صفحه؛ بین همه بازی‌هایی با چینش یکسان مشترک است"""
+    labels = []
+    for row in range(size):
+        row_labels = []
+        for col in range(size):
+            bit = 1 << (row * size + col)
+            if x_bits & bit:
+                row_labels.append(GameSymbol.X.value)
+            elif o_bits & bit:
+                row_labels.append(GameSymbol.O.value)
+            else:
+                row_labels.append("▫️" if playing else GameSymbol.EMPTY.value)
+        labels.append(tuple(row_labels))
+    return tuple(labels)
+
+def render_keyboard(game_id: str, x_bits: int, o_bits: int, status: GameStatus,
+                    size: int = BOARD_SIZE) -> InlineKeyboardMarkup:
+    playing = status == GameStatus.PLAYING
+    occupied = x_bits | o_bits
+    disabled = encode_callback(CallbackAction.NONE, game_id)
+    keyboard = []
+    for row, row_labels in enumerate(board_labels(x_bits, o_bits, playing, size)):
+        row_buttons = []
+        for col, button_text in enumerate(row_labels):
+            cell = row * size + col
+            if playing and not occupied & (1 << cell):
+                callback_data = encode_callback(CallbackAction.MOVE, game_id, cell)
+            else:
+                callback_data = disabled
+            
+            row_buttons.append(
+                InlineKeyboardButton(button_text, callback_data=callback_data)
+            )
+        keyboard.append(row_buttons)
+    
+    # دکمه‌های کنترلی
+    control_row = []
+    
+    if status == GameStatus.WAITING:
+        control_row.append(
+            InlineKeyboardButton("🎮 پیوستن به بازی", callback_data=encode_callback(CallbackAction.JOIN, game_id))
+        )
+    
+    control_row.append(
+        InlineKeyboardButton("🔄 بازی جدید", callback_data=encode_callback(CallbackAction.NEW, game_id))
+    )
+    
+    control_row.append(
+        InlineKeyboardButton("❌ حذف بازی", callback_data=encode_callback(CallbackAction.DELETE, game_id))
+    )
+    
+    keyboard.append(control_row)
+    
+    return InlineKeyboardMarkup(keyboard)
+
+def render_info_text(status: GameStatus, player1: str, player2: str,
+                     turn: str, turn_symbol: str, move_count: int,
+                     size: int = BOARD_SIZE, win_length: int = BOARD_SIZE) -> str:
+    text = f"🎮 بازی دوز (Tic Tac Toe)\n"
+    if size != BOARD_SIZE or win_length != BOARD_SIZE:
+        text += f"📐 صفحه {size}×{size} - {win_length} در یک ردیف\n"
+    text += "\n"
+    
+    if status == GameStatus.WAITING:
+        text += f"⏳ در انتظار بازیکن دوم...\n\n"
+        text += f"👤 بازیکن ۱ (❌): {player1}\n"
+        text += f"👤 بازیکن ۲ (⭕): منتظر پیوستن...\n"
+        text += f"\nبرای پیوستن روی دکمه '🎮 پیوستن به بازی' کلیک کنید."
+    
+    elif status == GameStatus.PLAYING:
+        text += f"🎯 نوبت: {turn} ({turn_symbol})\n\n"
+        text += f"👤 {player1} : ❌\n"
+        text += f"👤 {player2} : ⭕\n"
+        text += f"\n📍 حرکت: {move_count}/{size * size}"
+    
+    elif status in [GameStatus.X_WON, GameStatus.O_WON, GameStatus.DRAW]:
+        winner_text = ""
+        if status == GameStatus.X_WON:
+            winner_text = f"🎉 برنده: {player1} (❌)"
+        elif status == GameStatus.O_WON:
+            winner_text = f"🎉 برنده: {player2} (⭕)"
+        else:
+            winner_text = "🤝 بازی مساوی شد!"
+        
+        text += f"{winner_text}\n\n"
+        text += f"👤 {player1} : ❌\n"
+        text += f"👤 {player2} : ⭕\n"
+        text += f"\n🔄 برای بازی جدید، روی دکمه پایین کلیک کنید."
+    
+    return text
+
+def render_inline_card(size: int, win_length: int) -> str:
+    text = f"🎮 بازی دوز (Tic Tac Toe)\n"
+    text += f"📐 صفحه {size}×{size} - {win_length} در یک ردیف\n\n"
+    text += "👥 اولین نفری که دکمه را بزند ❌ و نفر دوم ⭕ بازی می‌کند."
+    return text
+
+@lru_cache(maxsize=128)
+def inline_results(board: Optional[Tuple[int, int]]) -> Tuple[InlineQueryResultArticle, ...]:
+    """کارت‌های بازی یک درخواست اینلاین (None = کارت‌های پیش‌فرض)
+    
+    کارت‌ها به کاربر بستگی ندارند، پس برای هر صفحه فقط یک بار ساخته می‌شوند.
+    """
+    if board is None:
+        boards = [(size, default_win_length(size)) for size in INLINE_PRESET_SIZES]
+    else:
+        boards = [board]
+    return tuple(
+        InlineQueryResultArticle(
+            id=f"{size}x{win_length}",
+            title=f"🎮 بازی دوز {size}×{size}",
+            description=f"{win_length} در یک ردیف - دو نفر اولی که دکمه را بزنند بازی می‌کنند",
+            input_message_content=InputTextMessageContent(render_inline_card(size, win_length)),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    "🎮 بازی می‌کنم",
+                    callback_data=encode_callback(CallbackAction.INLINE, arg=size << 4 | win_length)
+                )
+            ]]),
+        )
+        for size, win_length in boards
+    )
+
+def render_cache_stats() -> Dict[str, Dict[str, float]]:
+    """شمارنده‌های hit/miss کش‌های رندر"""
+    stats = {}
+    for name, fn in (("labels", board_labels), ("inline", inline_results)):
+        info = fn.cache_info()
+        total = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / total if total else 0.0,
+        }
+    for name in ("keyboard", "text"):
+        hits, misses = game_render_counters[f"{name}_hits"], game_render_counters[f"{name}_misses"]
+        stats[name] = {
+            "hits": hits,
+            "misses": misses,
+            "size": len(_rendered_games),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+    return stats
+
+@dataclass(slots=True)
 class Player:
     user_id: int
     username: str = ""
@@ -78,36 +496,54 @@ class Player:
             return f"@{self.username}"
         return self.first_name or f"User_{self.user_id}"
 
-@dataclass
+@dataclass(slots=True)
 class TicTacToeGame:
     game_id: str
     chat_id: int
     message_id: int = 0
-    board: List[List[GameSymbol]] = field(default_factory=lambda: [
-        [GameSymbol.EMPTY, GameSymbol.EMPTY, GameSymbol.EMPTY],
-        [GameSymbol.EMPTY, GameSymbol.EMPTY, GameSymbol.EMPTY],
-        [GameSymbol.EMPTY, GameSymbol.EMPTY, GameSymbol.EMPTY]
-    ])
+    # مهره‌های هر طرف به صورت عدد size×size بیتی
+    x_bits: int = 0
+    o_bits: int = 0
     player1: Optional[Player] = None
     player2: Optional[Player] = None
     current_turn: Optional[Player] = None
     status: GameStatus = GameStatus.WAITING
     created_at: datetime = field(default_factory=datetime.now)
     moves: List[Tuple[int, int, int]] = field(default_factory=list)
+    last_activity: float = field(default_factory=time.monotonic)
+    # سطح سختی در بازی با ربات (None = بازی دو نفره)
+    bot_level: Optional[str] = None
+    size: int = BOARD_SIZE
+    win_length: int = BOARD_SIZE
+    # نسخه وضعیت در backend مشترک (برای compare-and-set)
+    version: int = 0
+    # کپی پیام بازی در چت بازیکن دوم (بازی‌های /quickmatch بین دو چت)
+    mirror_chat_id: int = 0
+    mirror_message_id: int = 0
+    # پیام بازی‌هایی که با حالت اینلاین (@ربات در هر چتی) شروع شده‌اند؛ chat_id این بازی‌ها ۰ است
+    inline_message_id: str = ""
+    # با هر تغییر نمایش بازی (پیوستن، شروع، حرکت) زیاد می‌شود؛ کلید کش رندر
+    state_version: int = field(default=0, compare=False)
+    # (state_version، مقدار) آخرین کیبورد و متن ساخته‌شده
+    _keyboard: Optional[Tuple[int, InlineKeyboardMarkup]] = field(default=None, init=False, repr=False, compare=False)
+    _text: Optional[Tuple[int, str]] = field(default=None, init=False, repr=False, compare=False)
     
     def add_player(self, player: Player) -> bool:
         if not self.player1:
             self.player1 = player
             self.player1.symbol = GameSymbol.X
+            self.state_version += 1
             return True
         elif not self.player2 and player.user_id != self.player1.user_id:
             self.player2 = player
             self.player2.symbol = GameSymbol.O
+            self.state_version += 1
             return True
         return False
     
     def start_game(self):
         if self.player1 and self.player2:
+            self.state_version += 1
             self.status = GameStatus.PLAYING
             self.current_turn = random.choice([self.player1, self.player2])
             return True
@@ -120,18 +556,29 @@ class TicTacToeGame:
         if player.user_id != self.current_turn.user_id:
             return False
         
-        if not (0 <= row < 3 and 0 <= col < 3):
+        if not (0 <= row < self.size and 0 <= col < self.size):
             return False
         
-        if self.board[row][col] != GameSymbol.EMPTY:
+        cell = row * self.size + col
+        bit = 1 << cell
+        if (self.x_bits | self.o_bits) & bit:
             return False
         
-        self.board[row][col] = player.symbol
+        if player.symbol == GameSymbol.X:
+            self.x_bits |= bit
+            stones = self.x_bits
+        elif player.symbol == GameSymbol.O:
+            self.o_bits |= bit
+            stones = self.o_bits
+        else:
+            # بازیکنی که با add_player ثبت نشده علامت ندارد
+            return False
         self.moves.append((row, col, player.user_id))
+        self.state_version += 1
         
-        winner = self.check_winner()
-        if winner:
-            self.status = GameStatus.X_WON if winner == GameSymbol.X else GameStatus.O_WON
+        # فقط خط‌هایی که از آخرین حرکت می‌گذرند ممکن است تازه کامل شده باشند
+        if self._completes_line(stones, cell):
+            self.status = GameStatus.X_WON if player.symbol == GameSymbol.X else GameStatus.O_WON
         elif self.is_board_full():
             self.status = GameStatus.DRAW
         else:
@@ -139,136 +586,2329 @@ class TicTacToeGame:
         
         return True
     
+    def _completes_line(self, stones: int, cell: int) -> bool:
+        for mask in cell_lines(self.size, self.win_length)[cell]:
+            if stones & mask == mask:
+                return True
+        return False
+    
     def check_winner(self) -> Optional[GameSymbol]:
-        # بررسی سطرها
-        for row in range(3):
-            if self.board[row][0] == self.board[row][1] == self.board[row][2] != GameSymbol.EMPTY:
-                return self.board[row][0]
-        
-        # بررسی ستون‌ها
-        for col in range(3):
-            if self.board[0][col] == self.board[1][col] == self.board[2][col] != GameSymbol.EMPTY:
-                return self.board[0][col]
-        
-        # بررسی قطر اصلی
-        if self.board[0][0] == self.board[1][1] == self.board[2][2] != GameSymbol.EMPTY:
-            return self.board[0][0]
-        
-        # بررسی قطر فرعی
-        if self.board[0][2] == self.board[1][1] == self.board[2][0] != GameSymbol.EMPTY:
-            return self.board[0][2]
-        
+        for mask in line_masks(self.size, self.win_length):
+            if self.x_bits & mask == mask:
+                return GameSymbol.X
+            if self.o_bits & mask == mask:
+                return GameSymbol.O
         return None
     
     def is_board_full(self) -> bool:
-        for row in range(3):
-            for col in range(3):
-                if self.board[row][col] == GameSymbol.EMPTY:
-                    return False
-        return True
+        return (self.x_bits | self.o_bits) == (1 << self.size * self.size) - 1
     
     def get_board_keyboard(self) -> InlineKeyboardMarkup:
-        keyboard = []
-        for row in range(3):
-            row_buttons = []
-            for col in range(3):
-                symbol = self.board[row][col]
-                if self.status == GameStatus.PLAYING and symbol == GameSymbol.EMPTY:
-                    button_text = "▫️"
-                    callback_data = f"move_{self.game_id}_{row}_{col}"
-                else:
-                    button_text = symbol.value
-                    callback_data = f"none_{self.game_id}"
-                
-                row_buttons.append(
-                    InlineKeyboardButton(button_text, callback_data=callback_data)
-                )
-            keyboard.append(row_buttons)
-        
-        # دکمه‌های کنترلی
-        control_row = []
-        
-        if self.status == GameStatus.WAITING:
-            control_row.append(
-                InlineKeyboardButton("🎮 پیوستن به بازی", callback_data=f"join_{self.game_id}")
-            )
-        
-        control_row.append(
-            InlineKeyboardButton("🔄 بازی جدید", callback_data=f"new_{self.game_id}")
+        if self._keyboard is not None and self._keyboard[0] == self.state_version:
+            game_render_counters["keyboard_hits"] += 1
+            return self._keyboard[1]
+        game_render_counters["keyboard_misses"] += 1
+        keyboard = render_keyboard(self.game_id, self.x_bits, self.o_bits, self.status, self.size)
+        self._keyboard = (self.state_version, keyboard)
+        _remember_render(self)
+        return keyboard
+    
+    def get_game_info_text(self) -> str:
+        if self._text is not None and self._text[0] == self.state_version:
+            game_render_counters["text_hits"] += 1
+            return self._text[1]
+        game_render_counters["text_misses"] += 1
+        turn = self.current_turn
+        text = render_info_text(
+            self.status,
+            self.player1.display_name if self.player1 else "?",
+            self.player2.display_name if self.player2 else "?",
+            turn.display_name if turn else "?",
+            turn.symbol.value if turn else "",
+            len(self.moves),
+            self.size,
+            self.win_length
         )
+        self._text = (self.state_version, text)
+        _remember_render(self)
+        return text
+
+# ==================== جدول امتیازات ====================
+# امتیازها با هر نتیجه به‌روز می‌شوند و فهرست مرتب هر جدول همیشه آماده است؛
+# رتبه با bisect و top-K با برش فهرست، بدون مرور تاریخچه بازی‌ها.
+
+GLOBAL_LEADERBOARD = 0  # chat_id جدول کل ربات
+
+@dataclass(slots=True)
+class PlayerStats:
+    user_id: int
+    name: str
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+    rating: float = ELO_INITIAL_RATING
+    
+    @property
+    def games(self) -> int:
+        return self.wins + self.losses + self.draws
+
+def result_deltas(player1: Player, player2: Player, score1: float,
+                  rating1: float, rating2: float) -> Tuple[PlayerStats, PlayerStats]:
+    """تغییرات آمار دو بازیکن برای یک نتیجه با امتیازهای فعلی آنها (rating = تغییر امتیاز)"""
+    d1 = PlayerStats(player1.user_id, player1.display_name, rating=0.0)
+    d2 = PlayerStats(player2.user_id, player2.display_name, rating=0.0)
+    if score1 == 1.0:
+        d1.wins = d2.losses = 1
+    elif score1 == 0.0:
+        d1.losses = d2.wins = 1
+    else:
+        d1.draws = d2.draws = 1
+    
+    expected1 = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+    d1.rating = ELO_K * (score1 - expected1)
+    d2.rating = -d1.rating
+    return d1, d2
+
+RankKey = Tuple[float, int]
+
+class SortedKeys:
+    """فهرست مرتب تکه‌تکه: درج و حذف با هزینه اندازه یک تکه، نه کل فهرست
+    
+    بازیکنان تازه همه امتیاز یکسان دارند؛ در یک list ساده هر جابه‌جایی
+    از میان همه آنها عبور می‌کند.
+    """
+    LOAD = 512
+    
+    def __init__(self):
+        self._lists: List[List[RankKey]] = []
+        self._maxes: List[RankKey] = []
+        self._len = 0
+    
+    def __len__(self) -> int:
+        return self._len
+    
+    def __iter__(self):
+        for sub in self._lists:
+            yield from sub
+    
+    def add(self, key: RankKey):
+        self._len += 1
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            return
+        k = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        sub = self._lists[k]
+        insort(sub, key)
+        self._maxes[k] = sub[-1]
+        if len(sub) > 2 * self.LOAD:
+            self._lists[k:k + 1] = [sub[:self.LOAD], sub[self.LOAD:]]
+            self._maxes[k:k + 1] = [sub[self.LOAD - 1], sub[-1]]
+    
+    def remove(self, key: RankKey):
+        k = bisect_left(self._maxes, key)
+        sub = self._lists[k]
+        del sub[bisect_left(sub, key)]
+        self._len -= 1
+        if sub:
+            self._maxes[k] = sub[-1]
+        else:
+            del self._lists[k]
+            del self._maxes[k]
+    
+    def index(self, key: RankKey) -> int:
+        k = bisect_left(self._maxes, key)
+        before = sum(len(sub) for sub in self._lists[:k])
+        if k == len(self._lists):
+            return before
+        return before + bisect_left(self._lists[k], key)
+    
+    def head(self, n: int) -> List[RankKey]:
+        result: List[RankKey] = []
+        for sub in self._lists:
+            if len(result) >= n:
+                break
+            result.extend(sub[:n - len(result)])
+        return result
+
+class Leaderboard:
+    """امتیازات یک چت (یا کل ربات) به ترتیب (-rating, user_id)"""
+    
+    def __init__(self):
+        self.players: Dict[int, PlayerStats] = {}
+        self._order = SortedKeys()
+    
+    def __len__(self) -> int:
+        return len(self.players)
+    
+    def get(self, user_id: int) -> Optional[PlayerStats]:
+        return self.players.get(user_id)
+    
+    def add(self, stats: PlayerStats):
+        old = self.players.get(stats.user_id)
+        if old is not None:
+            self._order.remove((-old.rating, old.user_id))
+        self.players[stats.user_id] = stats
+        self._order.add((-stats.rating, stats.user_id))
+    
+    def _player(self, player: Player) -> PlayerStats:
+        stats = self.players.get(player.user_id)
+        if stats is None:
+            stats = PlayerStats(player.user_id, player.display_name)
+            self.add(stats)
+        stats.name = player.display_name
+        return stats
+    
+    def record_result(self, player1: Player, player2: Player, score1: float) -> Tuple[PlayerStats, PlayerStats]:
+        """ثبت نتیجه؛ score1 برای بازیکن اول ۱ (برد)، ۰ (باخت) یا ۰.۵ (مساوی)
         
-        control_row.append(
-            InlineKeyboardButton("❌ حذف بازی", callback_data=f"delete_{self.game_id}")
+        تغییرات هر بازیکن برگردانده می‌شود (rating = تغییر امتیاز) تا ذخیره‌سازی
+        آنها را جمع کند و نتایج کارگرهای هم‌زمان روی هم نوشته نشوند.
+        """
+        s1, s2 = self._player(player1), self._player(player2)
+        d1, d2 = result_deltas(player1, player2, score1, s1.rating, s2.rating)
+        for stats, delta in ((s1, d1), (s2, d2)):
+            self._order.remove((-stats.rating, stats.user_id))
+            stats.wins += delta.wins
+            stats.losses += delta.losses
+            stats.draws += delta.draws
+            stats.rating += delta.rating
+            self._order.add((-stats.rating, stats.user_id))
+        return d1, d2
+    
+    def rank(self, user_id: int) -> Optional[int]:
+        stats = self.players.get(user_id)
+        if stats is None:
+            return None
+        return self._order.index((-stats.rating, user_id)) + 1
+    
+    def top(self, k: int = LEADERBOARD_SIZE) -> List[PlayerStats]:
+        return [self.players[user_id] for _, user_id in self._order.head(k)]
+
+class Leaderboards:
+    """جدول هر چت و جدول کل در حافظه همین پردازه؛ بازی با ربات امتیازی ندارد
+    
+    با چند کارگر، backend مشترک SQLiteLeaderboards را جایگزین می‌کند.
+    """
+    
+    SCORES = {GameStatus.X_WON: 1.0, GameStatus.O_WON: 0.0, GameStatus.DRAW: 0.5}
+    # جدول‌های مشترک در فایل خودشان ذخیره می‌شوند و به GameStore نمی‌روند
+    SHARED = False
+    
+    def __init__(self):
+        self.boards: Dict[int, Leaderboard] = {}
+    
+    def board(self, chat_id: int) -> Leaderboard:
+        board = self.boards.get(chat_id)
+        if board is None:
+            board = self.boards[chat_id] = Leaderboard()
+        return board
+    
+    def get(self, chat_id: int) -> Optional[Leaderboard]:
+        """جدول یک چت برای خواندن؛ برخلاف board جدول خالی نمی‌سازد"""
+        return self.boards.get(chat_id)
+    
+    def record(self, game: TicTacToeGame) -> List[Tuple[int, PlayerStats]]:
+        """ثبت نتیجه بازی تمام‌شده؛ تغییرات آمار هر جدول را برای ذخیره برمی‌گرداند"""
+        score1 = self.SCORES.get(game.status)
+        if score1 is None or game.bot_level or not game.player2:
+            return []
+        # بازی بین دو چت و بازی اینلاین (بدون چت مشخص) فقط در جدول کل حساب می‌شوند
+        if game.mirror_chat_id or game.inline_message_id:
+            chats = (GLOBAL_LEADERBOARD,)
+        else:
+            chats = (game.chat_id, GLOBAL_LEADERBOARD)
+        return self._record(chats, game.player1, game.player2, score1)
+    
+    def _record(self, chats: Tuple[int, ...], player1: Player, player2: Player,
+                score1: float) -> List[Tuple[int, PlayerStats]]:
+        updated = []
+        for chat_id in chats:
+            for delta in self.board(chat_id).record_result(player1, player2, score1):
+                updated.append((chat_id, delta))
+        return updated
+    
+    def load(self, rows: List[Tuple[int, PlayerStats]]):
+        for chat_id, stats in rows:
+            self.board(chat_id).add(stats)
+
+# ==================== ذخیره‌سازی ====================
+
+class GameStore:
+    """رابط ذخیره‌سازی بازی‌ها؛ این پیاده‌سازی پیش‌فرض چیزی ذخیره نمی‌کند"""
+    
+    def start(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def load(self) -> List[TicTacToeGame]:
+        return []
+    
+    def record_game(self, game: TicTacToeGame):
+        """ثبت تصویر کامل بازی (ایجاد، پیوستن، پایان)"""
+    
+    def record_move(self, game: TicTacToeGame, row: int, col: int, user_id: int):
+        """افزودن یک حرکت به لاگ حرکات"""
+    
+    def record_delete(self, game_id: str):
+        pass
+    
+    def record_stats(self, chat_id: int, delta: PlayerStats):
+        """افزودن تغییرات آمار یک بازیکن (rating = تغییر امتیاز) به جدول یک چت"""
+    
+    def load_stats(self) -> List[Tuple[int, PlayerStats]]:
+        return []
+
+class SQLiteGameStore(GameStore):
+    """ذخیره در SQLite با نوشتن دسته‌ای در پس‌زمینه
+    
+    هندلرها فقط رویداد را در صف می‌گذارند و یک thread جداگانه هر
+    flush_interval ثانیه رویدادها را در یک تراکنش می‌نویسد.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            p1_id INTEGER, p1_username TEXT, p1_first_name TEXT,
+            p2_id INTEGER, p2_username TEXT, p2_first_name TEXT,
+            turn_id INTEGER,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            x_bits INTEGER NOT NULL,
+            o_bits INTEGER NOT NULL,
+            moves BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS moves (
+            game_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            cell INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (game_id, seq)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS player_stats (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            draws INTEGER NOT NULL,
+            rating REAL NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID;
+    """
+    # همه کارگرها در یک فایل می‌نویسند؛ آمار به صورت افزایشی جمع می‌شود نه جایگزین
+    ADD_STATS = (
+        "INSERT INTO player_stats VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (chat_id, user_id) DO UPDATE SET name = excluded.name, "
+        "wins = wins + excluded.wins, losses = losses + excluded.losses, "
+        "draws = draws + excluded.draws, rating = rating + ?"
+    )
+    # ستون‌هایی که بعد از نسخه اول به جدول games اضافه شده‌اند (به همین ترتیب)
+    MIGRATIONS = (
+        ("bot_level", "TEXT"),
+        ("size", "INTEGER"),
+        ("win_length", "INTEGER"),
+        ("mirror_chat_id", "INTEGER"),
+        ("mirror_message_id", "INTEGER"),
+        ("inline_message_id", "TEXT"),
+    )
+    MOVES_COLUMN = 14
+    COLUMNS = 15 + len(MIGRATIONS)
+    INSERT_GAME = "INSERT OR REPLACE INTO games VALUES ({})".format(", ".join("?" * COLUMNS))
+    
+    def __init__(self, path: str, flush_interval: float = STORE_FLUSH_INTERVAL,
+                 batch_size: int = STORE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.SimpleQueue[Tuple[str, tuple]]" = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(games)")}
+        for name, sql_type in self.MIGRATIONS:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE games ADD COLUMN {name} {sql_type}")
+        conn.commit()
+        conn.close()
+    
+    def _connect(self) -> "sqlite3.Connection":
+        import sqlite3  # فقط وقتی ذخیره‌سازی فعال است بارگذاری می‌شود
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    # ---------- مسیر داغ: فقط صف ----------
+    
+    def record_game(self, game: TicTacToeGame):
+        self._queue.put(("game", self._game_row(game)))
+    
+    def record_move(self, game: TicTacToeGame, row: int, col: int, user_id: int):
+        seq = len(game.moves) - 1
+        self._queue.put(("move", (game.game_id, seq, row * game.size + col, user_id)))
+    
+    def record_delete(self, game_id: str):
+        self._queue.put(("delete", (game_id,)))
+    
+    def record_stats(self, chat_id: int, delta: PlayerStats):
+        self._queue.put(("stats", self.stats_args(chat_id, delta)))
+    
+    @staticmethod
+    def stats_args(chat_id: int, delta: PlayerStats) -> tuple:
+        """پارامترهای ADD_STATS؛ ردیف تازه از امتیاز اولیه شروع می‌شود"""
+        return (
+            chat_id, delta.user_id, delta.name, delta.wins, delta.losses, delta.draws,
+            ELO_INITIAL_RATING + delta.rating, delta.rating
         )
-        
-        keyboard.append(control_row)
-        
-        return InlineKeyboardMarkup(keyboard)
     
-    def get_game_info_text(self) -> str:
-        text = f"🎮 بازی دوز (Tic Tac Toe)\n\n"
-        
-        if self.status == GameStatus.WAITING:
-            text += f"⏳ در انتظار بازیکن دوم...\n\n"
-            text += f"👤 بازیکن ۱ (❌): {self.player1.display_name if self.player1 else '?'}\n"
-            text += f"👤 بازیکن ۲ (⭕): منتظر پیوستن...\n"
-            text += f"\nبرای پیوستن روی دکمه '🎮 پیوستن به بازی' کلیک کنید."
-        
-        elif self.status == GameStatus.PLAYING:
-            text += f"🎯 نوبت: {self.current_turn.display_name} ({self.current_turn.symbol.value})\n\n"
-            text += f"👤 {self.player1.display_name if self.player1 else '?'} : ❌\n"
-            text += f"👤 {self.player2.display_name if self.player2 else '?'} : ⭕\n"
-            text += f"\n📍 حرکت: {len(self.moves)}/9"
-        
-        elif self.status in [GameStatus.X_WON, GameStatus.O_WON, GameStatus.DRAW]:
-            winner_text = ""
-            if self.status == GameStatus.X_WON:
-                winner_text = f"🎉 برنده: {self.player1.display_name if self.player1 else '?'} (❌)"
-            elif self.status == GameStatus.O_WON:
-                winner_text = f"🎉 برنده: {self.player2.display_name if self.player2 else '?'} (⭕)"
+    # ---------- نوشتن در پس‌زمینه ----------
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="game-store", daemon=True)
+            self._thread.start()
+    
+    def close(self):
+        """نوشتن رویدادهای باقی‌مانده و توقف thread"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        else:
+            self.flush()
+    
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stopping.wait(self.flush_interval):
+                self._flush(conn)
+            self._flush(conn)
+        finally:
+            conn.close()
+    
+    def flush(self):
+        conn = self._connect()
+        try:
+            self._flush(conn)
+        finally:
+            conn.close()
+    
+    def _flush(self, conn: "sqlite3.Connection"):
+        import sqlite3
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            try:
+                with conn:
+                    for kind, args in batch:
+                        if kind == "move":
+                            conn.execute("INSERT OR REPLACE INTO moves VALUES (?, ?, ?, ?)", args)
+                        elif kind == "stats":
+                            conn.execute(self.ADD_STATS, args)
+                        elif kind == "game":
+                            conn.execute(self.INSERT_GAME, args)
+                            # حرکات قبل از این تصویر دیگر لازم نیستند
+                            conn.execute(
+                                "DELETE FROM moves WHERE game_id = ? AND seq < ?",
+                                (args[0], len(args[self.MOVES_COLUMN]))
+                            )
+                        else:
+                            conn.execute("DELETE FROM games WHERE game_id = ?", args)
+                            conn.execute("DELETE FROM moves WHERE game_id = ?", args)
+            except sqlite3.Error as e:
+                logger.error(f"خطا در ذخیره بازی‌ها ({len(batch)} رویداد از دست رفت): {e}")
+    
+    # ---------- بازیابی ----------
+    
+    def load(self) -> List[TicTacToeGame]:
+        """بازسازی بازی‌ها از آخرین تصویر و اجرای دوباره حرکات بعد از آن"""
+        conn = self._connect()
+        try:
+            games = {}
+            for row in conn.execute("SELECT * FROM games ORDER BY created_at"):
+                game = self._game_from_row(row)
+                games[game.game_id] = game
+            for game_id, seq, cell, user_id in conn.execute(
+                "SELECT game_id, seq, cell, user_id FROM moves ORDER BY game_id, seq"
+            ):
+                game = games.get(game_id)
+                if game is None or seq < len(game.moves):
+                    continue
+                player = game.player1 if game.player1.user_id == user_id else game.player2
+                row, col = divmod(cell, game.size)
+                game.make_move(player, row, col)
+        finally:
+            conn.close()
+        return list(games.values())
+    
+    def load_stats(self) -> List[Tuple[int, PlayerStats]]:
+        conn = self._connect()
+        try:
+            return [
+                (chat_id, PlayerStats(user_id, name, wins, losses, draws, rating))
+                for chat_id, user_id, name, wins, losses, draws, rating
+                in conn.execute("SELECT * FROM player_stats")
+            ]
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _game_row(game: TicTacToeGame) -> tuple:
+        p1, p2 = game.player1, game.player2
+        p2_id = p2.user_id if p2 else None
+        # هر حرکت یک بایت: اندیس خانه (حداکثر ۶۳) + بیت بالا برای بازیکن دوم
+        moves = bytes(
+            (row * game.size + col) | (0x80 if user_id == p2_id else 0)
+            for row, col, user_id in game.moves
+        )
+        return (
+            game.game_id, game.chat_id, game.message_id,
+            p1.user_id if p1 else None, p1.username if p1 else None, p1.first_name if p1 else None,
+            p2_id, p2.username if p2 else None, p2.first_name if p2 else None,
+            game.current_turn.user_id if game.current_turn else None,
+            game.status.name, game.created_at.timestamp(),
+            game.x_bits, game.o_bits, moves,
+            game.bot_level, game.size, game.win_length,
+            game.mirror_chat_id, game.mirror_message_id,
+            game.inline_message_id,
+        )
+    
+    @staticmethod
+    def _game_from_row(row: tuple) -> TicTacToeGame:
+        (game_id, chat_id, message_id, p1_id, p1_username, p1_first_name,
+         p2_id, p2_username, p2_first_name, turn_id, status, created_at,
+         x_bits, o_bits, moves, bot_level, size, win_length,
+         mirror_chat_id, mirror_message_id, inline_message_id) = row
+        p1 = Player(p1_id, p1_username, p1_first_name, GameSymbol.X) if p1_id is not None else None
+        p2 = Player(p2_id, p2_username, p2_first_name, GameSymbol.O) if p2_id is not None else None
+        game = TicTacToeGame(
+            game_id=game_id,
+            chat_id=chat_id,
+            message_id=message_id,
+            x_bits=x_bits,
+            o_bits=o_bits,
+            player1=p1,
+            player2=p2,
+            status=GameStatus[status],
+            created_at=datetime.fromtimestamp(created_at),
+            bot_level=bot_level,
+            # ردیف‌های قبل از اضافه شدن ستون‌ها صفحه ۳×۳ بوده‌اند
+            size=size or BOARD_SIZE,
+            win_length=win_length or BOARD_SIZE,
+            mirror_chat_id=mirror_chat_id or 0,
+            mirror_message_id=mirror_message_id or 0,
+            inline_message_id=inline_message_id or "",
+        )
+        if turn_id is not None:
+            game.current_turn = p1 if p1 and p1.user_id == turn_id else p2
+        for b in moves:
+            row_, col = divmod(b & 0x7F, game.size)
+            game.moves.append((row_, col, p2_id if b & 0x80 else p1_id))
+        return game
+
+# ==================== آرشیو بازی‌ها ====================
+# فایل فقط‌افزودنی: MAGIC و بعد رکوردها پشت سر هم. هر رکورد یک سرآیند ثابت،
+# نام دو بازیکن و هر حرکت یک بایت (اندیس خانه + بیت بالا برای بازیکن دوم).
+# هر رکورد با یک write روی فایل O_APPEND نوشته می‌شود و نیمه‌کاره نمی‌ماند،
+# مگر در قطع ناگهانی که هنگام باز کردن دوباره از انتهای فایل بریده می‌شود.
+
+ARCHIVE_MAGIC = b"TTH1"
+# طول کل رکورد، زمان پایان، شناسه بازی، چت، دو بازیکن، وضعیت، اندازه، طول ردیف، تعداد حرکت، طول دو نام
+ARCHIVE_HEADER = struct.Struct("<HI6sqqqBBBBBB")
+ARCHIVE_NAME_BYTES = 32
+_ARCHIVE_STATUSES = list(GameStatus)
+
+def _archive_name(player: Optional[Player]) -> bytes:
+    name = (player.display_name if player else "").encode()[:ARCHIVE_NAME_BYTES]
+    # بریدن وسط یک کاراکتر چندبایتی
+    return name.decode(errors="ignore").encode()
+
+def _archive_id(game_id: str) -> bytes:
+    # شناسه‌های قدیمی (قبل از قالب ۸ کاراکتری) با صفر ذخیره می‌شوند
+    try:
+        raw = base64.urlsafe_b64decode(game_id)
+    except ValueError:
+        raw = b""
+    return raw if len(raw) == GAME_ID_BYTES else bytes(GAME_ID_BYTES)
+
+class GameArchive:
+    """آرشیو فقط‌افزودنی بازی‌های تمام‌شده با ایندکس آفست رکوردهای هر بازیکن
+    
+    چند کارگر می‌توانند در یک فایل بنویسند؛ user_page پیش از هر صفحه رکوردهای
+    تازه انتهای فایل را (از هر پردازه‌ای) ایندکس می‌کند. open و user_page فایل را
+    می‌خوانند و باید در thread صدا زده شوند؛ append فقط یک write است و تا باز شدن
+    فایل رکوردها را در حافظه نگه می‌دارد.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        # user_id -> آفست رکوردها به ترتیب ثبت (۸ بایت برای هر بازی)
+        self.user_index: Dict[int, array] = {}
+        self.records = 0
+        # انتهای آخرین رکورد ایندکس‌شده
+        self._end = 0
+        # ساخت و به‌روزرسانی ایندکس
+        self._lock = threading.Lock()
+        # رکوردهای رسیده پیش از باز شدن فایل
+        self._pending: List[bytes] = []
+        self._pending_lock = threading.Lock()
+    
+    def open(self) -> int:
+        """باز کردن فایل و ایندکس رکوردهای تازه؛ تعداد رکوردها را برمی‌گرداند"""
+        with self._lock:
+            if self._fd is None:
+                self._open()
             else:
-                winner_text = "🤝 بازی مساوی شد!"
-            
-            text += f"{winner_text}\n\n"
-            text += f"👤 {self.player1.display_name if self.player1 else '?'} : ❌\n"
-            text += f"👤 {self.player2.display_name if self.player2 else '?'} : ⭕\n"
-            text += f"\n🔄 برای بازی جدید، روی دکمه پایین کلیک کنید."
+                self._end = self._scan(self._end)
+            return self.records
+    
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            with self._flock(fd):
+                if os.fstat(fd).st_size == 0:
+                    os.write(fd, ARCHIVE_MAGIC)
+                elif os.pread(fd, len(ARCHIVE_MAGIC), 0) != ARCHIVE_MAGIC:
+                    raise ValueError(f"{self.path} فایل آرشیو بازی نیست")
+            end = self._scan(len(ARCHIVE_MAGIC))
+            # نویسنده‌ها هنگام write قفل دارند، پس رکورد ناقص زیر قفل حتما از یک crash مانده است
+            with self._flock(fd):
+                end = self._scan(end)
+                if end < os.fstat(fd).st_size:
+                    logger.warning(f"رکورد ناقص انتهای آرشیو حذف شد ({self.path})")
+                    os.ftruncate(fd, end)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._end = end
+        with self._pending_lock:
+            self._fd = fd
+            pending, self._pending = self._pending, []
+        for record in pending:
+            self._write(record)
+    
+    @staticmethod
+    @contextmanager
+    def _flock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    
+    def _scan(self, offset: int) -> int:
+        """خواندن تکه‌های ۱ مگابایتی از offset و ایندکس رکوردهای کامل؛ انتهای آخرین رکورد کامل را برمی‌گرداند"""
+        buf, pos = b"", 0
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while chunk := f.read(1 << 20):
+                buf, pos = buf[pos:] + chunk, 0
+                while len(buf) - pos >= ARCHIVE_HEADER.size:
+                    length, _, _, _, p1_id, p2_id, *_ = ARCHIVE_HEADER.unpack_from(buf, pos)
+                    if len(buf) - pos < length:
+                        break
+                    self._index(offset, p1_id, p2_id)
+                    offset += length
+                    pos += length
+        return offset
+    
+    def _index(self, offset: int, *user_ids: int):
+        self.records += 1
+        for user_id in user_ids:
+            if user_id != BOT_USER_ID:
+                self.user_index.setdefault(user_id, array("Q")).append(offset)
+    
+    def close(self):
+        if self._pending:
+            self.open()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+    
+    @staticmethod
+    def encode(game: TicTacToeGame) -> bytes:
+        p1, p2 = game.player1, game.player2
+        p2_id = p2.user_id if p2 else BOT_USER_ID
+        name1, name2 = _archive_name(p1), _archive_name(p2)
+        moves = bytes(
+            (row * game.size + col) | (0x80 if user_id == p2_id else 0)
+            for row, col, user_id in game.moves
+        )
+        header = ARCHIVE_HEADER.pack(
+            ARCHIVE_HEADER.size + len(name1) + len(name2) + len(moves),
+            int(time.time()),
+            _archive_id(game.game_id),
+            game.chat_id, p1.user_id, p2_id,
+            _ARCHIVE_STATUSES.index(game.status), game.size, game.win_length, len(moves),
+            len(name1), len(name2),
+        )
+        return header + name1 + name2 + moves
+    
+    @staticmethod
+    def decode(data: bytes) -> dict:
+        (length, finished_at, raw_id, chat_id, p1_id, p2_id,
+         status, size, win_length, move_count, n1, n2) = ARCHIVE_HEADER.unpack_from(data)
+        pos = ARCHIVE_HEADER.size
+        name1 = data[pos:pos + n1].decode()
+        name2 = data[pos + n1:pos + n1 + n2].decode()
+        moves = data[pos + n1 + n2:length]
+        return {
+            "game_id": base64.urlsafe_b64encode(raw_id).decode(),
+            "chat_id": chat_id,
+            "finished_at": finished_at,
+            "status": _ARCHIVE_STATUSES[status].name,
+            "size": size,
+            "win_length": win_length,
+            "players": [{"id": p1_id, "name": name1}, {"id": p2_id, "name": name2}],
+            "moves": [(b & 0x7F, p2_id if b & 0x80 else p1_id) for b in moves],
+        }
+    
+    def append(self, game: TicTacToeGame):
+        record = self.encode(game)
+        with self._pending_lock:
+            if self._fd is None:
+                self._pending.append(record)
+                return
+        # ایندکس در اسکن بعدی ساخته می‌شود، مثل رکوردهای کارگرهای دیگر
+        self._write(record)
+    
+    def _write(self, record: bytes):
+        with self._flock(self._fd):
+            os.write(self._fd, record)
+    
+    def read(self, offset: int) -> dict:
+        if self._fd is None:
+            self.open()
+        (length,) = struct.unpack("<H", os.pread(self._fd, 2, offset))
+        return self.decode(os.pread(self._fd, length, offset))
+    
+    def user_page(self, user_id: int, cursor: int = 0,
+                  limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], int]:
+        """بازی‌های بازیکن از جدید به قدیم، قبل از آفست cursor (۰ = از آخر)
         
-        return text
+        آفست اولین رکورد صفحه بعد (یا ۰ اگر صفحه‌ای نمانده) هم برگردانده می‌شود.
+        """
+        self.open()
+        with self._lock:
+            offsets = self.user_index.get(user_id, ())
+            end = bisect_left(offsets, cursor) if cursor else len(offsets)
+            start = max(0, end - limit)
+            selected = offsets[start:end]
+            next_cursor = offsets[start] if start else 0
+        return [self.read(offset) for offset in reversed(selected)], next_cursor
+    
+    def iter_records(self) -> Iterator[dict]:
+        """خواندن جریانی همه رکوردها بدون بارگذاری کل فایل"""
+        with open(self.path, "rb") as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                return
+            while True:
+                head = f.read(2)
+                if len(head) < 2:
+                    return
+                (length,) = struct.unpack("<H", head)
+                body = f.read(length - 2)
+                if len(body) < length - 2:
+                    return
+                yield self.decode(head + body)
+    
+    def export(self, out) -> int:
+        """نوشتن همه رکوردها به صورت JSONL در یک فایل متنی باز؛ تعداد رکوردها را برمی‌گرداند"""
+        count = 0
+        for record in self.iter_records():
+            out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            out.write("\n")
+            count += 1
+        return count
+
+def export_history(path: str) -> int:
+    """خروجی JSONL آرشیو؛ با پسوند .gz فشرده می‌شود"""
+    archive = GameArchive(HISTORY_PATH)
+    import gzip
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as out:
+        return archive.export(out)
+
+# ==================== وضعیت مشترک بین پردازه‌ها ====================
+
+def game_to_state(game: TicTacToeGame) -> bytes:
+    row = list(SQLiteGameStore._game_row(game))
+    row[SQLiteGameStore.MOVES_COLUMN] = row[SQLiteGameStore.MOVES_COLUMN].hex()
+    return json.dumps(row, separators=(",", ":")).encode()
+
+def game_from_state(blob: bytes) -> TicTacToeGame:
+    row = json.loads(blob)
+    # وضعیت‌های نوشته‌شده قبل از ستون‌های جدید
+    row += [None] * (SQLiteGameStore.COLUMNS - len(row))
+    row[SQLiteGameStore.MOVES_COLUMN] = bytes.fromhex(row[SQLiteGameStore.MOVES_COLUMN])
+    return SQLiteGameStore._game_from_row(tuple(row))
+
+class GameStateBackend(ABC):
+    """رابط وضعیت مشترک؛ هر تغییر فقط اگر نسخه عوض نشده باشد ثبت می‌شود"""
+    
+    @abstractmethod
+    def get(self, game_id: str) -> Optional[Tuple[int, bytes]]:
+        ...
+    
+    @abstractmethod
+    def compare_and_set(self, game_id: str, expected_version: int, state: bytes) -> bool:
+        """expected_version = 0 یعنی بازی نباید از قبل وجود داشته باشد"""
+    
+    @abstractmethod
+    def delete(self, game_id: str):
+        ...
+    
+    @abstractmethod
+    def delete_if_version(self, game_id: str, expected_version: int) -> bool:
+        """حذف فقط اگر از expected_version تغییری نکرده باشد"""
+    
+    @abstractmethod
+    def set_player_game(self, user_id: int, game_id: str):
+        """آخرین بازی بازیکن، تا هر کارگری بازی او را پیدا کند (/cancel)"""
+    
+    @abstractmethod
+    def player_game(self, user_id: int) -> Optional[str]:
+        ...
+    
+    def leaderboards(self) -> Leaderboards:
+        """جدول‌های امتیاز مشترک؛ backend داخل حافظه فقط در یک پردازه است"""
+        return Leaderboards()
+
+class InMemoryStateBackend(GameStateBackend):
+    def __init__(self):
+        self._states: Dict[str, Tuple[int, bytes]] = {}
+        self._player_games: Dict[int, str] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, game_id: str) -> Optional[Tuple[int, bytes]]:
+        return self._states.get(game_id)
+    
+    def compare_and_set(self, game_id: str, expected_version: int, state: bytes) -> bool:
+        with self._lock:
+            current = self._states.get(game_id)
+            if (current[0] if current else 0) != expected_version:
+                return False
+            self._states[game_id] = (expected_version + 1, state)
+            return True
+    
+    def delete(self, game_id: str):
+        with self._lock:
+            self._states.pop(game_id, None)
+    
+    def delete_if_version(self, game_id: str, expected_version: int) -> bool:
+        with self._lock:
+            current = self._states.get(game_id)
+            if current is None or current[0] != expected_version:
+                return False
+            del self._states[game_id]
+            return True
+    
+    def set_player_game(self, user_id: int, game_id: str):
+        self._player_games[user_id] = game_id
+    
+    def player_game(self, user_id: int) -> Optional[str]:
+        return self._player_games.get(user_id)
+
+class SQLiteStateBackend(GameStateBackend):
+    """وضعیت مشترک در یک فایل SQLite که همه پردازه‌های کارگر باز می‌کنند
+    
+    پرس‌وجوها هم‌زمان (sync) روی event loop اجرا می‌شوند؛ هر کدام یک دستور کوتاه
+    روی یک ردیف است. در حالت WAL خواندن منتظر نویسنده‌ها نمی‌ماند و هر نوشتن حداکثر
+    timeout ثانیه برای قفل صبر می‌کند و بعد خطای database is locked می‌دهد؛ پس توقف
+    loop در هر کلیک به حدود دو برابر timeout (حرکت و ثبت امتیاز پایان بازی) محدود است.
+    """
+    
+    def __init__(self, path: str, timeout: float = STATE_BACKEND_TIMEOUT):
+        self.path = path
+        import sqlite3
+        # قفل طولانی کل کارگر را متوقف می‌کند؛ بعد از timeout خطای database is locked به هندلر می‌رسد
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS game_state ("
+            "game_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        # یک ردیف برای هر بازیکن؛ بازی حذف‌شده را خواننده نادیده می‌گیرد
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS player_games (user_id INTEGER PRIMARY KEY, game_id TEXT NOT NULL)"
+        )
+    
+    def get(self, game_id: str) -> Optional[Tuple[int, bytes]]:
+        return self._conn.execute(
+            "SELECT version, state FROM game_state WHERE game_id = ?", (game_id,)
+        ).fetchone()
+    
+    def compare_and_set(self, game_id: str, expected_version: int, state: bytes) -> bool:
+        # هر دستور در SQLite اتمیک است؛ شرط نسخه در خود دستور بررسی می‌شود
+        if expected_version == 0:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO game_state VALUES (?, 1, ?)", (game_id, state)
+            )
+        else:
+            cursor = self._conn.execute(
+                "UPDATE game_state SET version = version + 1, state = ? "
+                "WHERE game_id = ? AND version = ?",
+                (state, game_id, expected_version)
+            )
+        return cursor.rowcount == 1
+    
+    def delete(self, game_id: str):
+        self._conn.execute("DELETE FROM game_state WHERE game_id = ?", (game_id,))
+    
+    def delete_if_version(self, game_id: str, expected_version: int) -> bool:
+        cursor = self._conn.execute(
+            "DELETE FROM game_state WHERE game_id = ? AND version = ?", (game_id, expected_version)
+        )
+        return cursor.rowcount == 1
+    
+    def set_player_game(self, user_id: int, game_id: str):
+        self._conn.execute("INSERT OR REPLACE INTO player_games VALUES (?, ?)", (user_id, game_id))
+    
+    def player_game(self, user_id: int) -> Optional[str]:
+        row = self._conn.execute("SELECT game_id FROM player_games WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+    
+    def leaderboards(self) -> "SQLiteLeaderboards":
+        return SQLiteLeaderboards(self._conn)
+
+class SQLiteLeaderboard:
+    """یک جدول امتیازات در SQLite مشترک با همان رابط خواندن Leaderboard
+    
+    رتبه با شمردن بازیکنان بالاتر روی ایندکس (chat_id, rating) حساب می‌شود.
+    """
+    
+    COLUMNS = "user_id, name, wins, losses, draws, rating"
+    
+    def __init__(self, conn: "sqlite3.Connection", chat_id: int):
+        self._conn = conn
+        self.chat_id = chat_id
+    
+    def __len__(self) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM player_stats WHERE chat_id = ?", (self.chat_id,)
+        ).fetchone()[0]
+    
+    def get(self, user_id: int) -> Optional[PlayerStats]:
+        row = self._conn.execute(
+            f"SELECT {self.COLUMNS} FROM player_stats WHERE chat_id = ? AND user_id = ?",
+            (self.chat_id, user_id)
+        ).fetchone()
+        return PlayerStats(*row) if row else None
+    
+    def rank(self, user_id: int) -> Optional[int]:
+        stats = self.get(user_id)
+        if stats is None:
+            return None
+        # همان ترتیب (-rating, user_id) جدول داخل حافظه
+        (above,) = self._conn.execute(
+            "SELECT COUNT(*) FROM player_stats WHERE chat_id = ? "
+            "AND (rating > ? OR rating = ? AND user_id < ?)",
+            (self.chat_id, stats.rating, stats.rating, user_id)
+        ).fetchone()
+        return above + 1
+    
+    def top(self, k: int = LEADERBOARD_SIZE) -> List[PlayerStats]:
+        return [
+            PlayerStats(*row) for row in self._conn.execute(
+                f"SELECT {self.COLUMNS} FROM player_stats WHERE chat_id = ? "
+                "ORDER BY rating DESC, user_id LIMIT ?",
+                (self.chat_id, k)
+            )
+        ]
+
+class SQLiteLeaderboards(Leaderboards):
+    """جدول‌های امتیاز در فایل وضعیت مشترک، تا همه کارگرها یک جدول ببینند
+    
+    امتیاز دو بازیکن در همان تراکنشی خوانده می‌شود که تغییرات Elo نوشته می‌شود،
+    پس نتیجه هم‌زمان در کارگر دیگر روی امتیاز کهنه حساب نمی‌شود.
+    """
+    
+    SHARED = True
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS player_stats (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            draws INTEGER NOT NULL,
+            rating REAL NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS player_stats_rank ON player_stats (chat_id, rating DESC, user_id);
+    """
+    
+    def __init__(self, conn: "sqlite3.Connection"):
+        super().__init__()
+        self._conn = conn
+        conn.executescript(self.SCHEMA)
+    
+    def board(self, chat_id: int) -> SQLiteLeaderboard:
+        return SQLiteLeaderboard(self._conn, chat_id)
+    
+    def get(self, chat_id: int) -> Optional[SQLiteLeaderboard]:
+        return self.board(chat_id)
+    
+    def _record(self, chats: Tuple[int, ...], player1: Player, player2: Player,
+                score1: float) -> List[Tuple[int, PlayerStats]]:
+        import sqlite3
+        updated = []
+        try:
+            # IMMEDIATE: قفل نوشتن پیش از خواندن امتیازها گرفته می‌شود
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for chat_id in chats:
+                    board = self.board(chat_id)
+                    s1, s2 = board.get(player1.user_id), board.get(player2.user_id)
+                    deltas = result_deltas(
+                        player1, player2, score1,
+                        s1.rating if s1 else ELO_INITIAL_RATING, s2.rating if s2 else ELO_INITIAL_RATING
+                    )
+                    for delta in deltas:
+                        self._conn.execute(SQLiteGameStore.ADD_STATS, SQLiteGameStore.stats_args(chat_id, delta))
+                        updated.append((chat_id, delta))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # حرکت آخر ثبت شده؛ فقط امتیاز این بازی از دست می‌رود
+            logger.error(f"ثبت امتیاز بازی ممکن نشد: {e}")
+            return []
+        return updated
+    
+    def load(self, rows: List[Tuple[int, PlayerStats]]):
+        """آمار ذخیره‌شده GAME_DB_PATH فقط برای بازیکنانی که هنوز در جدول مشترک نیستند"""
+        self._conn.execute("BEGIN")
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO player_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (chat_id, stats.user_id, stats.name, stats.wins, stats.losses, stats.draws, stats.rating)
+                for chat_id, stats in rows
+            ]
+        )
+        self._conn.execute("COMMIT")
+
+def create_state_backend(spec: str) -> Optional[GameStateBackend]:
+    if not spec:
+        return None
+    if spec == "memory":
+        return InMemoryStateBackend()
+    if spec.startswith("sqlite:"):
+        return SQLiteStateBackend(spec[len("sqlite:"):])
+    raise ValueError(f"STATE_BACKEND نامعتبر: {spec}")
 
 # ==================== مدیریت بازی‌ها ====================
 
 class GameManager:
-    def __init__(self):
-        self.games: Dict[str, TicTacToeGame] = {}
+    # وضعیت‌هایی که در ایندکس هر چت نگه داشته می‌شوند
+    ACTIVE_STATUSES = (GameStatus.WAITING, GameStatus.PLAYING)
+    
+    def __init__(self, ttls: Optional[Dict[GameStatus, int]] = None, max_games: int = MAX_GAMES,
+                 store: Optional[GameStore] = None, backend: Optional[GameStateBackend] = None,
+                 archive: Optional[GameArchive] = None):
+        # ترتیب games ترتیب آخرین فعالیت است (قدیمی‌ترین در ابتدا)
+        self.games: "OrderedDict[str, TicTacToeGame]" = OrderedDict()
         self.user_games: Dict[int, str] = {}
+        # ایندکس ثانویه: chat_id -> بازی‌های فعال به ترتیب created_at
+        self.chat_games: Dict[int, Dict[str, TicTacToeGame]] = {}
+        # بازی لغوشده همان لحظه حذف می‌شود و TTL ندارد؛ کوتاه‌ترین TTL مرز توقف پیمایش reap است
+        self.ttls: Dict[GameStatus, int] = ttls or {
+            GameStatus.WAITING: GAME_TTL_WAITING,
+            GameStatus.PLAYING: GAME_TTL_PLAYING,
+            GameStatus.X_WON: GAME_TTL_FINISHED,
+            GameStatus.O_WON: GAME_TTL_FINISHED,
+            GameStatus.DRAW: GAME_TTL_FINISHED,
+        }
+        self.max_games = max_games
+        # قفل هر بازی؛ با اولین درخواست ساخته و با خروج آخرین منتظر حذف می‌شود
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Counter = Counter()
+        # شمارنده‌های حذف: نام وضعیت برای انقضا، "cap" برای سقف حافظه
+        self.reaper_stats: Counter = Counter()
+        # بازی‌هایی که حذف شده‌اند ولی پیامشان هنوز به‌روزرسانی نشده
+        self.expired: List[TicTacToeGame] = []
+        self.store = store or GameStore()
+        # با backend مشترک، games فقط کش محلی است و منبع اصلی backend است
+        self.backend = backend
+        self.conflicts = 0
+        # با backend مشترک جدول‌ها هم مشترک‌اند و هر نتیجه با امتیاز فعلی همه کارگرها حساب می‌شود
+        self.leaderboards = backend.leaderboards() if backend is not None else Leaderboards()
+        self.archive = archive
+        # با هر تغییر فهرست بازی‌های فعال یک چت صدا زده می‌شود (پیام لابی)
+        self.on_chat_change: Optional[Callable[[int], None]] = None
+    
+    def load(self) -> int:
+        """بازگردانی بازی‌ها و جدول امتیازات ذخیره‌شده هنگام راه‌اندازی"""
+        self.leaderboards.load(self.store.load_stats())
+        games = self.store.load()
+        for game in games:
+            if self.backend is not None and not self._commit(game):
+                # نسخه backend مشترک جدیدتر است
+                self.sync(game.game_id)
+                continue
+            self.games[game.game_id] = game
+            for player in (game.player1, game.player2):
+                if player:
+                    self.user_games[player.user_id] = game.game_id
+            if game.status in self.ACTIVE_STATUSES:
+                self._index(game)
+        self._enforce_cap()
+        return len(games)
     
-    def create_game(self, chat_id: int, player1: Player) -> TicTacToeGame:
-        game_id = f"ttt_{chat_id}_{int(datetime.now().timestamp())}"
-        game = TicTacToeGame(game_id=game_id, chat_id=chat_id, player1=player1)
+    def create_game(self, chat_id: int, player1: Player, size: int = BOARD_SIZE,
+                    win_length: Optional[int] = None, game_id: Optional[str] = None,
+                    inline_message_id: str = "") -> Optional[TicTacToeGame]:
+        """ساخت بازی با شناسه تصادفی، یا با game_id داده‌شده (None اگر آن شناسه از قبل وجود دارد)"""
+        fixed_id = game_id
+        while True:
+            game_id = fixed_id or new_game_id()
+            if game_id in self.games:
+                if fixed_id:
+                    return None
+                continue
+            game = TicTacToeGame(
+                game_id=game_id,
+                chat_id=chat_id,
+                size=size,
+                win_length=win_length or default_win_length(size),
+                inline_message_id=inline_message_id
+            )
+            game.add_player(player1)
+            if self._commit(game):
+                break
+            if fixed_id:
+                # پردازه دیگری زودتر همین بازی را ساخته
+                return None
         self.games[game_id] = game
-        self.user_games[player1.user_id] = game_id
+        self._set_player_game(player1.user_id, game_id)
+        self._index(game)
+        self.store.record_game(game)
+        self._enforce_cap()
         return game
     
     def get_game(self, game_id: str) -> Optional[TicTacToeGame]:
+        if self.backend is not None:
+            return self.sync(game_id)
         return self.games.get(game_id)
     
+    def join_game(self, game: TicTacToeGame, player: Player) -> bool:
+        if not game.add_player(player):
+            return False
+        game.start_game()
+        if not self._commit(game):
+            return False
+        if player.user_id != BOT_USER_ID:
+            self._set_player_game(player.user_id, game.game_id)
+        self._refresh_index(game)
+        self._chat_changed(game)
+        self.touch(game)
+        self.store.record_game(game)
+        return True
+    
+    def make_move(self, game: TicTacToeGame, player: Player, row: int, col: int) -> bool:
+        if not game.make_move(player, row, col):
+            return False
+        if not self._commit(game):
+            # پردازه دیگری زودتر همین بازی را تغییر داده
+            return False
+        self.store.record_move(game, row, col, player.user_id)
+        if game.status not in self.ACTIVE_STATUSES:
+            # تصویر نهایی؛ لاگ حرکات این بازی فشرده می‌شود
+            self.store.record_game(game)
+            # فقط حرکتی که بازی را تمام کرده به اینجا می‌رسد؛ نتیجه یک بار ثبت می‌شود
+            deltas = self.leaderboards.record(game)
+            if not self.leaderboards.SHARED:
+                for chat_id, delta in deltas:
+                    self.store.record_stats(chat_id, delta)
+            if self.archive is not None:
+                self.archive.append(game)
+        self._refresh_index(game)
+        self.touch(game)
+        return True
+    
+    def set_message_id(self, game: TicTacToeGame, message_id: int,
+                       mirror: Optional[Tuple[int, int]] = None):
+        """ثبت پیام بازی؛ mirror = (chat_id, message_id) کپی پیام در چت بازیکن دوم"""
+        while True:
+            game.message_id = message_id
+            if mirror is not None:
+                game.mirror_chat_id, game.mirror_message_id = mirror
+            if self._commit(game):
+                break
+            game = self.sync(game.game_id)
+            if game is None:
+                return
+        self.store.record_game(game)
+    
     def delete_game(self, game_id: str):
+        if self.backend is not None:
+            self.backend.delete(game_id)
         game = self.games.get(game_id)
         if game:
-            if game.player1:
-                self.user_games.pop(game.player1.user_id, None)
-            if game.player2:
-                self.user_games.pop(game.player2.user_id, None)
-            del self.games[game_id]
+            self._forget(game)
+            self.store.record_delete(game_id)
+    
+    def sync(self, game_id: str) -> Optional[TicTacToeGame]:
+        """به‌روزرسانی کش محلی از backend مشترک"""
+        state = self.backend.get(game_id)
+        local = self.games.get(game_id)
+        if state is None:
+            if local is not None:
+                self._forget(local)
+            return None
+        version, blob = state
+        if local is not None and local.version == version:
+            return local
+        game = game_from_state(blob)
+        game.version = version
+        self.games[game_id] = game
+        self.touch(game)
+        for player in (game.player1, game.player2):
+            if player and player.user_id != BOT_USER_ID:
+                self.user_games[player.user_id] = game_id
+        if game.status in self.ACTIVE_STATUSES:
+            self._index(game)
+        else:
+            self._unindex(game)
+        return game
+    
+    def _commit(self, game: TicTacToeGame) -> bool:
+        """ثبت اتمیک وضعیت در backend؛ در صورت تداخل کش محلی تازه می‌شود"""
+        if self.backend is None:
+            return True
+        if self.backend.compare_and_set(game.game_id, game.version, game_to_state(game)):
+            game.version += 1
+            return True
+        self.conflicts += 1
+        if game.version:
+            self.sync(game.game_id)
+        return False
+    
+    def _forget(self, game: TicTacToeGame):
+        for player in (game.player1, game.player2):
+            if player and self.user_games.get(player.user_id) == game.game_id:
+                del self.user_games[player.user_id]
+        self._unindex(game)
+        self.games.pop(game.game_id, None)
+    
+    def _set_player_game(self, user_id: int, game_id: str):
+        self.user_games[user_id] = game_id
+        if self.backend is not None:
+            self.backend.set_player_game(user_id, game_id)
     
     def get_player_game(self, user_id: int) -> Optional[TicTacToeGame]:
-        game_id = self.user_games.get(user_id)
-        if game_id:
-            return self.get_game(game_id)
+        if self.backend is None:
+            game_id = self.user_games.get(user_id)
+            return self.get_game(game_id) if game_id else None
+        # بازی ممکن است در کارگر دیگری ساخته شده باشد
+        game_id = self.backend.player_game(user_id)
+        game = self.sync(game_id) if game_id else None
+        if game and user_id in (player.user_id for player in (game.player1, game.player2) if player):
+            return game
+        return None
+    
+    @asynccontextmanager
+    async def lock(self, game_id: str):
+        """سریال‌کردن کلیک‌های یک بازی (هر شناسه‌ای، حتی بازی‌ای که در کش محلی نیست)
+        
+        قفل تا وقتی کسی صاحب یا منتظر آن است نگه داشته می‌شود، پس حافظه فقط به
+        کلیک‌های در جریان بستگی دارد.
+        """
+        lock = self.locks.get(game_id)
+        if lock is None:
+            lock = self.locks[game_id] = asyncio.Lock()
+        self._lock_users[game_id] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[game_id] -= 1
+            if not self._lock_users[game_id]:
+                del self._lock_users[game_id]
+                del self.locks[game_id]
+    
+    def touch(self, game: TicTacToeGame):
+        """ثبت فعالیت و انتقال بازی به انتهای صف LRU"""
+        game.last_activity = time.monotonic()
+        if game.game_id in self.games:
+            self.games.move_to_end(game.game_id)
+    
+    def reap(self, now: Optional[float] = None) -> List[TicTacToeGame]:
+        """حذف بازی‌های منقضی و بازی‌های مازاد بر سقف؛ بازی‌های حذف‌شده را برمی‌گرداند"""
+        now = time.monotonic() if now is None else now
+        min_ttl = min(self.ttls.values())
+        stale = []
+        for game in self.games.values():
+            idle = now - game.last_activity
+            # بقیه بازی‌ها فعالیت جدیدتری دارند
+            if idle <= min_ttl:
+                break
+            if idle > self.ttls.get(game.status, min_ttl):
+                stale.append(game)
+        for game in stale:
+            self._evict(game, game.status.name)
+        self._enforce_cap()
+        expired, self.expired = self.expired, []
+        return expired
+    
+    def _enforce_cap(self):
+        while len(self.games) > self.max_games:
+            oldest = next(iter(self.games.values()))
+            if self.backend is not None:
+                # فقط کش محلی پر شده؛ نسخه مشترک ممکن است در کارگر دیگری در حال بازی باشد
+                self._forget(oldest)
+                self.reaper_stats["cap_uncached"] += 1
+            else:
+                self._evict(oldest, "cap")
+    
+    def _evict(self, game: TicTacToeGame, reason: str):
+        if self.backend is not None:
+            # idle بودن کپی محلی یعنی بازی از آخرین همگام‌سازی همین پردازه تغییر نکرده؛
+            # اگر نسخه مشترک جلوتر باشد پردازه دیگری بازی را ادامه داده و فقط کش دور ریخته می‌شود
+            if not self.backend.delete_if_version(game.game_id, game.version):
+                self._forget(game)
+                self.reaper_stats["stale_cache"] += 1
+                return
+            self._forget(game)
+            self.store.record_delete(game.game_id)
+        else:
+            self.delete_game(game.game_id)
+        self.reaper_stats[reason] += 1
+        self.expired.append(game)
+    
+    def get_chat_games(self, chat_id: int) -> List[TicTacToeGame]:
+        """بازی‌های در انتظار و در حال اجرای یک چت، به ترتیب ایجاد"""
+        return list(self.chat_games.get(chat_id, {}).values())
+    
+    def _index(self, game: TicTacToeGame):
+        self.chat_games.setdefault(game.chat_id, {})[game.game_id] = game
+        self._chat_changed(game)
+    
+    def _unindex(self, game: TicTacToeGame):
+        chat = self.chat_games.get(game.chat_id)
+        if chat is None or chat.pop(game.game_id, None) is None:
+            return
+        if not chat:
+            del self.chat_games[game.chat_id]
+        self._chat_changed(game)
+    
+    def _chat_changed(self, game: TicTacToeGame):
+        if self.on_chat_change is not None:
+            self.on_chat_change(game.chat_id)
+    
+    def _refresh_index(self, game: TicTacToeGame):
+        if game.status not in self.ACTIVE_STATUSES:
+            self._unindex(game)
+
+game_manager = GameManager(
+    store=SQLiteGameStore(GAME_DB_PATH) if GAME_DB_PATH and not EXPORT_ONLY else None,
+    backend=None if EXPORT_ONLY else create_state_backend(STATE_BACKEND),
+    archive=GameArchive(HISTORY_PATH) if HISTORY_PATH else None
+)
+
+# ==================== حریف ربات ====================
+# بهترین حرکت همه وضعیت‌های قابل دسترس (حدود ۵.۵ هزار) یک بار با minimax
+# حساب و در یک جدول ۳^۹ بایتی ذخیره می‌شود؛ هر حرکت ربات یک جستجوی O(1) است.
+BOT_USER_ID = 0
+BOT_LEVELS = {
+    "easy": 0.5,    # احتمال حرکت تصادفی
+    "medium": 0.2,
+    "hard": 0.0,
+}
+DEFAULT_BOT_LEVEL = "medium"
+
+# نمایش سه‌تایی هر بیت‌بورد ۹ بیتی: اندیس وضعیت = T[mine] + 2 * T[theirs]
+_TERNARY = tuple(
+    sum(3 ** i for i in range(BOARD_CELLS) if bits >> i & 1)
+    for bits in range(1 << BOARD_CELLS)
+)
+
+class SolvedTable:
+    MAGIC = b"TTT1"
+    NO_MOVE = 0xFF
+    
+    def __init__(self, moves: bytes):
+        self.moves = moves
+    
+    @staticmethod
+    def index(mine: int, theirs: int) -> int:
+        return _TERNARY[mine] + 2 * _TERNARY[theirs]
+    
+    @classmethod
+    def solve(cls) -> "SolvedTable":
+        """حل کامل بازی با negamax؛ امتیاز از دید کسی که نوبت اوست"""
+        moves = bytearray([cls.NO_MOVE]) * (3 ** BOARD_CELLS)
+        scores: Dict[Tuple[int, int], int] = {}
+        
+        def negamax(mine: int, theirs: int) -> int:
+            key = (mine, theirs)
+            if key in scores:
+                return scores[key]
+            occupied = mine | theirs
+            if has_line(theirs):
+                # باخت زودتر بدتر است
+                score = -(1 + BOARD_CELLS - bin(occupied).count("1"))
+            elif occupied == FULL_BOARD:
+                score = 0
+            else:
+                score, best = -100, cls.NO_MOVE
+                for cell in range(BOARD_CELLS):
+                    bit = 1 << cell
+                    if occupied & bit:
+                        continue
+                    value = -negamax(theirs, mine | bit)
+                    if value > score:
+                        score, best = value, cell
+                moves[cls.index(mine, theirs)] = best
+            scores[key] = score
+            return score
+        
+        negamax(0, 0)
+        return cls(bytes(moves))
+    
+    @classmethod
+    def load(cls, path: str) -> "SolvedTable":
+        """خواندن جدول از فایل؛ اگر نبود یا خراب بود، حل و ذخیره می‌شود"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if data[:4] == cls.MAGIC and len(data) == 4 + 3 ** BOARD_CELLS:
+                return cls(data[4:])
+        except OSError:
+            pass
+        table = cls.solve()
+        try:
+            with open(path, "wb") as f:
+                f.write(cls.MAGIC + table.moves)
+        except OSError as e:
+            logger.warning(f"ذخیره جدول ربات ممکن نشد: {e}")
+        return table
+    
+    def best_move(self, mine: int, theirs: int) -> int:
+        return self.moves[self.index(mine, theirs)]
+    
+    def choose(self, mine: int, theirs: int, mistake_rate: float = 0.0) -> int:
+        if mistake_rate and random.random() < mistake_rate:
+            occupied = mine | theirs
+            return random.choice([c for c in range(BOARD_CELLS) if not occupied & (1 << c)])
+        return self.best_move(mine, theirs)
+
+_solved_table: Optional[SolvedTable] = None
+
+def get_solved_table() -> SolvedTable:
+    global _solved_table
+    if _solved_table is None:
+        _solved_table = SolvedTable.load(BOT_TABLE_PATH)
+    return _solved_table
+
+def create_bot_game(chat_id: int, player: Player, level: str) -> TicTacToeGame:
+    """بازی تک‌نفره؛ ربات بازیکن دوم است و در صورت نوبت، حرکت اول را می‌زند"""
+    game = game_manager.create_game(chat_id, player)
+    game.bot_level = level
+    game_manager.join_game(game, Player(user_id=BOT_USER_ID, first_name="🤖 ربات"))
+    play_bot_turn(game)
+    return game
+
+def play_bot_turn(game: TicTacToeGame) -> bool:
+    if game.bot_level is None or game.status != GameStatus.PLAYING:
+        return False
+    bot = game.current_turn
+    if bot.user_id != BOT_USER_ID:
+        return False
+    mine, theirs = (game.x_bits, game.o_bits) if bot.symbol == GameSymbol.X else (game.o_bits, game.x_bits)
+    cell = get_solved_table().choose(mine, theirs, BOT_LEVELS[game.bot_level])
+    row, col = divmod(cell, BOARD_SIZE)
+    return game_manager.make_move(game, bot, row, col)
+
+# ==================== صف ویرایش پیام‌ها ====================
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def delay(self, now: float) -> float:
+        """چند ثانیه تا آزاد شدن یک توکن باقی مانده (۰ یعنی همین حالا)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def consume(self):
+        self.tokens -= 1
+    
+    def pause(self, seconds: float):
+        """خالی کردن سطل تا seconds ثانیه دیگر (برای RetryAfter)"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+    
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+@dataclass(slots=True)
+class PendingEdit:
+    chat_id: Optional[int]
+    message_id: Optional[int]
+    inline_message_id: Optional[str]
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+    enqueued_at: float
+    not_before: float = 0.0
+    attempts: int = 0
+
+class EditScheduler:
+    """صف ویرایش پیام‌ها با محدودیت نرخ برای هر چت و کل ربات
+    
+    ویرایش‌های پشت سر هم یک پیام در آخرین وضعیت ادغام می‌شوند و
+    ویرایشی که محتوای پیام را تغییر نمی‌دهد اصلا ارسال نمی‌شود.
+    """
+    
+    MAX_ATTEMPTS = 5
+    SENT_HISTORY = 10000  # تعداد پیام‌هایی که آخرین محتوایشان نگه داشته می‌شود
+    
+    def __init__(self, chat_rate: float = EDIT_CHAT_RATE, chat_burst: int = EDIT_CHAT_BURST,
+                 global_rate: float = EDIT_GLOBAL_RATE, global_burst: int = EDIT_GLOBAL_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_buckets: Dict[object, TokenBucket] = {}
+        self._pending: "OrderedDict[object, PendingEdit]" = OrderedDict()
+        self._in_flight: set = set()
+        self._last_sent: "OrderedDict[object, tuple]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self.counters: Counter = Counter()
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+    
+    @staticmethod
+    def _key(chat_id, message_id, inline_message_id):
+        return inline_message_id or (chat_id, message_id)
+    
+    def note_sent(self, chat_id: Optional[int], message_id: Optional[int], text: str,
+                  reply_markup: Optional[InlineKeyboardMarkup] = None,
+                  inline_message_id: Optional[str] = None):
+        """ثبت محتوای پیامی که مستقیم ارسال شده تا ویرایش بی‌اثر بعدی حذف شود"""
+        self._remember(self._key(chat_id, message_id, inline_message_id), (text, reply_markup))
+    
+    def submit(self, chat_id: Optional[int], message_id: Optional[int], text: str,
+               reply_markup: Optional[InlineKeyboardMarkup] = None,
+               inline_message_id: Optional[str] = None):
+        key = self._key(chat_id, message_id, inline_message_id)
+        content = (text, reply_markup)
+        self.counters["submitted"] += 1
+        pending = self._pending.get(key)
+        if content == self._last_sent.get(key) and key not in self._in_flight:
+            # پیام همین حالا همین محتوا را دارد
+            self.counters["skipped_unchanged"] += 1
+            if pending is not None:
+                del self._pending[key]
+            return
+        # ویرایش از صف فرستاده می‌شود ولی جزو بودجه همین آپدیت است
+        count_api_call("editMessageText")
+        if pending is not None:
+            self.counters["coalesced"] += 1
+            pending.text, pending.reply_markup = content
+            return
+        self._pending[key] = PendingEdit(
+            chat_id, message_id, inline_message_id, text, reply_markup, time.monotonic()
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    def stats(self) -> Dict[str, float]:
+        sent = self.counters["sent"]
+        return {
+            **self.counters,
+            "queue_depth": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "latency_avg": self.latency_sum / sent if sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+    
+    def start(self, bot):
+        if self._task is None:
+            self._running = True
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(bot))
+    
+    async def stop(self):
+        if self._task is not None:
+            # wait_for در پایتون 3.11 ممکن است cancel هم‌زمان با بیدار شدن را بی‌اثر کند؛ پرچم حلقه را می‌بندد
+            self._running = False
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self, bot):
+        while self._running:
+            self._wakeup.clear()
+            wait = self._dispatch(bot, time.monotonic())
+            if wait is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _dispatch(self, bot, now: float) -> Optional[float]:
+        """ارسال هر ویرایشی که سطل‌هایش اجازه می‌دهند؛ زمان انتظار تا نوبت بعدی را برمی‌گرداند"""
+        next_wait = None
+        for key, edit in list(self._pending.items()):
+            if key in self._in_flight:
+                continue
+            wait = edit.not_before - now
+            if wait <= 0:
+                bucket = self._chat_bucket(edit.chat_id or key)
+                wait = bucket.delay(now) or self._global.delay(now)
+                if wait == 0:
+                    bucket.consume()
+                    self._global.consume()
+                    del self._pending[key]
+                    self._in_flight.add(key)
+                    asyncio.create_task(self._send(bot, key, edit))
+                    continue
+            next_wait = wait if next_wait is None else min(next_wait, wait)
+        if len(self._chat_buckets) > self.SENT_HISTORY:
+            self._prune_buckets()
+        return next_wait
+    
+    def _chat_bucket(self, chat_key) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+    
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_key, bucket in list(self._chat_buckets.items()):
+            bucket.delay(now)
+            if bucket.full:
+                del self._chat_buckets[chat_key]
+    
+    def _remember(self, key, content: tuple):
+        self._last_sent[key] = content
+        self._last_sent.move_to_end(key)
+        if len(self._last_sent) > self.SENT_HISTORY:
+            self._last_sent.popitem(last=False)
+    
+    async def _send(self, bot, key, edit: PendingEdit):
+        try:
+            await bot.edit_message_text(
+                edit.text,
+                chat_id=edit.chat_id,
+                message_id=edit.message_id,
+                inline_message_id=edit.inline_message_id,
+                reply_markup=edit.reply_markup
+            )
+            self._sent(key, edit)
+        except RetryAfter as e:
+            self.counters["retry_after"] += 1
+            self._chat_bucket(edit.chat_id or key).pause(e.retry_after * (1 + 0.5 * edit.attempts))
+            self._retry(key, edit, 0.0)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self.counters["not_modified"] += 1
+                self._sent(key, edit)
+            else:
+                # پیام حذف شده یا دیگر قابل ویرایش نیست
+                self.counters["failed"] += 1
+                logger.debug(f"ویرایش پیام ممکن نشد: {e}")
+        except NetworkError as e:
+            self._retry(key, edit, 2 ** edit.attempts)
+            logger.debug(f"خطای شبکه در ویرایش پیام: {e}")
+        except TelegramError as e:
+            # مثلا Forbidden وقتی ربات از چت حذف شده؛ تلاش دوباره فایده‌ای ندارد
+            self.counters["failed"] += 1
+            logger.debug(f"ویرایش پیام ممکن نشد: {e}")
+        finally:
+            self._in_flight.discard(key)
+            self._wakeup.set()
+    
+    def _sent(self, key, edit: PendingEdit):
+        self._remember(key, (edit.text, edit.reply_markup))
+        latency = time.monotonic() - edit.enqueued_at
+        self.counters["sent"] += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+    
+    def _retry(self, key, edit: PendingEdit, backoff: float):
+        edit.attempts += 1
+        if key in self._pending:
+            # نسخه جدیدتری از همین پیام در صف است
+            return
+        if edit.attempts > self.MAX_ATTEMPTS:
+            self.counters["failed"] += 1
+            return
+        edit.not_before = time.monotonic() + backoff
+        self._pending[key] = edit
+
+edit_scheduler = EditScheduler()
+
+def submit_game_edit(game: TicTacToeGame, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """ویرایش پیام بازی و کپی آن در چت بازیکن دوم (بازی‌های /quickmatch)"""
+    if game.message_id:
+        edit_scheduler.submit(game.chat_id, game.message_id, text, reply_markup)
+    if game.mirror_message_id:
+        edit_scheduler.submit(game.mirror_chat_id, game.mirror_message_id, text, reply_markup)
+    if game.inline_message_id:
+        edit_scheduler.submit(None, None, text, reply_markup, inline_message_id=game.inline_message_id)
+
+def submit_query_edit(query, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """ویرایش پیامی که دکمه‌اش زده شده؛ پیام اینلاین chat_id و message_id ندارد"""
+    if query.inline_message_id:
+        edit_scheduler.submit(None, None, text, reply_markup, inline_message_id=query.inline_message_id)
+    else:
+        edit_scheduler.submit(query.message.chat_id, query.message.message_id, text, reply_markup)
+
+# ==================== پیام لابی ====================
+
+class Lobby:
+    """یک پیام ثابت (سنجاق‌شده) در هر چت با فهرست بازی‌های در انتظار و دکمه پیوستن
+    
+    تغییر بازی‌های چت فقط آن را علامت می‌زند؛ LOBBY_DEBOUNCE ثانیه پس از اولین
+    تغییر همه چت‌های علامت‌خورده یک‌جا رندر می‌شوند و فقط اگر متن یا دکمه‌ها
+    واقعا عوض شده باشند ویرایش به صف ویرایش پیام‌ها می‌رود.
+    """
+    
+    def __init__(self, manager: "GameManager", scheduler: EditScheduler,
+                 debounce: float = LOBBY_DEBOUNCE, max_games: int = LOBBY_MAX_GAMES):
+        self.manager = manager
+        self.scheduler = scheduler
+        self.debounce = debounce
+        self.max_games = max_games
+        # chat_id -> شناسه پیام لابی
+        self.messages: Dict[int, int] = {}
+        self._rendered: Dict[int, tuple] = {}
+        self._dirty: set = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.counters: Counter = Counter()
+    
+    def __len__(self) -> int:
+        return len(self.messages)
+    
+    def render(self, chat_id: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        games = self.manager.get_chat_games(chat_id)
+        waiting = [game for game in games if game.status == GameStatus.WAITING]
+        text = (
+            "🏠 لابی بازی دوز\n\n"
+            f"⏳ در انتظار حریف: {len(waiting)}\n"
+            f"🎯 در حال بازی: {len(games) - len(waiting)}\n\n"
+        )
+        if waiting:
+            text += "برای پیوستن روی یکی از بازی‌ها بزنید."
+            if len(waiting) > self.max_games:
+                text += f"\n(و {len(waiting) - self.max_games} بازی دیگر)"
+        else:
+            text += "📭 بازی در انتظاری نیست. با /newgame یک بازی بسازید."
+        keyboard = [
+            [InlineKeyboardButton(
+                f"➕ {game.player1.display_name} | {game.size}×{game.size}",
+                callback_data=encode_callback(CallbackAction.LOBBY, game.game_id)
+            )]
+            for game in waiting[:self.max_games]
+        ]
+        self.counters["renders"] += 1
+        return text, InlineKeyboardMarkup(keyboard) if keyboard else None
+    
+    def open(self, chat_id: int, message_id: int, content: tuple) -> Optional[int]:
+        """ثبت پیام لابی جدید چت؛ شناسه پیام لابی قبلی (اگر بود) برگردانده می‌شود"""
+        old = self.messages.get(chat_id)
+        self.messages[chat_id] = message_id
+        self._rendered[chat_id] = content
+        return old
+    
+    def close(self, chat_id: int) -> Optional[int]:
+        self._rendered.pop(chat_id, None)
+        self._dirty.discard(chat_id)
+        return self.messages.pop(chat_id, None)
+    
+    def mark(self, chat_id: int):
+        """علامت‌گذاری تغییر بازی‌های چت؛ چت‌های بدون لابی هزینه‌ای ندارند"""
+        if chat_id not in self.messages:
+            return
+        self.counters["changes"] += 1
+        self._dirty.add(chat_id)
+        if self._flush_handle is None:
+            # زمان‌بندی بیرون از context آپدیت فعلی تا ویرایش لابی در بودجه کلیک شمرده نشود
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.debounce, self.flush, context=Context()
+            )
+    
+    def flush(self):
+        self._flush_handle = None
+        dirty, self._dirty = self._dirty, set()
+        self.counters["flushes"] += 1
+        for chat_id in dirty:
+            message_id = self.messages.get(chat_id)
+            if message_id is None:
+                continue
+            content = self.render(chat_id)
+            if content == self._rendered.get(chat_id):
+                self.counters["unchanged"] += 1
+                continue
+            self._rendered[chat_id] = content
+            self.counters["edits"] += 1
+            self.scheduler.submit(chat_id, message_id, *content)
+
+lobby = Lobby(game_manager, edit_scheduler)
+game_manager.on_chat_change = lobby.mark
+
+# ==================== کنترل کلیک‌ها ====================
+
+class ClickAdmission:
+    """پذیرش کلیک‌ها قبل از هندلرها
+    
+    کلیک تکراری (همان کاربر، همان پیام، همان داده) تا وقتی نسخه قبلی در حال
+    پردازش است رد می‌شود، و هر کاربر یک سطل توکن دارد. کلیک ردشده بدون
+    دسترسی به بازی‌ها فقط یک پاسخ خالی می‌گیرد.
+    """
+    
+    MAX_USERS = 10000  # بیش از این، سطل‌های پر (کاربران غیرفعال) دور ریخته می‌شوند
+    
+    def __init__(self, rate: float = CLICK_RATE, burst: int = CLICK_BURST, dedupe: bool = True):
+        self.rate = rate
+        self.burst = burst
+        self.dedupe = dedupe
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._in_flight: set = set()
+        self.counters: Counter = Counter()
+    
+    def admit(self, user_id: int, key: tuple) -> Optional[str]:
+        """None اگر کلیک پذیرفته شد، وگرنه دلیل رد: "duplicate" یا "rate_limited"
+        
+        کلیک پذیرفته‌شده باید بعد از پردازش با release آزاد شود.
+        """
+        if self.dedupe and key in self._in_flight:
+            self.counters["duplicate"] += 1
+            return "duplicate"
+        if self.rate:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.MAX_USERS:
+                    self._prune()
+            if bucket.delay(time.monotonic()):
+                self.counters["rate_limited"] += 1
+                return "rate_limited"
+            bucket.consume()
+        self._in_flight.add(key)
+        self.counters["admitted"] += 1
         return None
+    
+    def release(self, key: tuple):
+        self._in_flight.discard(key)
+    
+    def _prune(self):
+        now = time.monotonic()
+        for user_id, bucket in list(self._buckets.items()):
+            bucket.delay(now)
+            if bucket.full:
+                del self._buckets[user_id]
+
+click_admission = ClickAdmission()
+
+# ==================== زمان راه‌اندازی ====================
+
+class BootTimer:
+    """مدت هر مرحله راه‌اندازی، از شروع import تا اولین آپدیت پردازش‌شده"""
+    
+    def __init__(self, started: float):
+        self.started = started
+        self.last = started
+        self.phases: Dict[str, float] = {}
+        self.done = False
+    
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+    
+    def summary(self) -> str:
+        parts = " | ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+        return f"{parts} | کل {(self.last - self.started) * 1000:.0f}ms"
+    
+    def first_update(self):
+        if self.done:
+            return
+        self.done = True
+        self.mark("first_update")
+        print(f"🚀 اولین آپدیت پردازش شد: {self.summary()}")
+
+boot_timer = BootTimer(BOOT_STARTED)
 
-game_manager = GameManager()
+# ==================== متریک‌ها ====================
+# ثبت هر متریک فقط چند عمل حسابی روی dict است؛ محاسبه‌های سنگین‌تر
+# (تعداد بازی‌ها، حافظه) هنگام درخواست /metrics انجام می‌شوند.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    __slots__ = ("buckets", "total", "count")
+    
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Counter] = {}
+        self.in_flight = 0
+    
+    def observe(self, name: str, labels: Labels, value: float):
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram()
+        histogram.observe(value)
+    
+    def inc(self, name: str, labels: Labels = (), amount: int = 1):
+        self.counters.setdefault(name, Counter())[labels] += amount
+    
+    def render(self) -> str:
+        """خروجی با قالب متنی Prometheus"""
+        lines = []
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in collect_gauges().items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def process_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def collect_gauges() -> Dict[str, Dict[Labels, float]]:
+    """مقادیری که هنگام درخواست /metrics از وضعیت فعلی خوانده می‌شوند"""
+    by_status = Counter(game.status.name for game in game_manager.games.values())
+    gauges: Dict[str, Dict[Labels, float]] = {
+        "games": {(("status", status.name),): by_status[status.name] for status in GameStatus},
+        "updates_in_flight": {(): metrics.in_flight},
+        "process_resident_memory_bytes": {(): process_rss_bytes()},
+        "games_evicted": {(("reason", reason),): count for reason, count in game_manager.reaper_stats.items()},
+        "game_state_conflicts": {(): game_manager.conflicts},
+        "quickmatch_waiting": {(): len(match_queue)},
+        "quickmatch_events": {(("event", name),): value for name, value in match_queue.stats.items()},
+        "boot_phase_seconds": {(("phase", phase),): seconds for phase, seconds in boot_timer.phases.items()},
+        "click_admission": {(("result", name),): value for name, value in click_admission.counters.items()},
+        "lobby": {(("stat", "chats"),): len(lobby), **{
+            (("stat", name),): value for name, value in lobby.counters.items()
+        }},
+        "bot_api_pool": {
+            (("pool", name), ("stat", stat)): value
+            for name, request in request_pools.items()
+            for stat, value in {
+                "size": request.pool_size, "in_flight": request.in_flight, **request.pool_stats
+            }.items()
+        },
+    }
+    gauges["edit_queue"] = {
+        (("stat", name),): value for name, value in edit_scheduler.stats().items()
+    }
+    gauges["render_cache_hit_rate"] = {
+        (("cache", name),): stats["hit_rate"] for name, stats in render_cache_stats().items()
+    }
+    return gauges
+
+# درخواست‌های Bot API آپدیت در حال پردازش (به تفکیک متد)
+update_api_calls: ContextVar[Optional[Counter]] = ContextVar("update_api_calls", default=None)
+
+# حداکثر درخواست مجاز برای هر کلیک (دو ویرایش: پیام بازی و کپی آن در بازی بین دو چت)
+CALLBACK_API_BUDGET = {"answerCallbackQuery": 1, "editMessageText": 2}
+
+def count_api_call(method: str):
+    calls = update_api_calls.get()
+    if calls is not None:
+        calls[method] += 1
+
+def check_api_budget(calls: Counter):
+    for method, count in calls.items():
+        metrics.inc("callback_api_calls_total", (("method", method),), count)
+        if count > CALLBACK_API_BUDGET.get(method, 0):
+            metrics.inc("callback_api_budget_exceeded_total", (("method", method),))
+            logger.warning(f"بودجه Bot API رد شد: {method} × {count}")
+
+def timed(handler_name: str):
+    """اندازه‌گیری زمان اجرای هندلر و تعداد آپدیت‌های در حال پردازش"""
+    labels = (("handler", handler_name),)
+    
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            metrics.in_flight += 1
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                metrics.in_flight -= 1
+                metrics.observe("handler_latency_seconds", labels, time.perf_counter() - started)
+                if not boot_timer.done:
+                    boot_timer.first_update()
+        return wrapper
+    return decorator
+
+@lru_cache(maxsize=None)
+def shared_ssl_context():
+    """خواندن گواهی‌های certifi حدود ۵۰ms طول می‌کشد؛ همه کلاینت‌ها یک نسخه مشترک دارند"""
+    return httpx.create_ssl_context()
+
+# استخرهای اتصال ساخته‌شده به تفکیک نام ("api" و "updates")
+request_pools: Dict[str, "InstrumentedRequest"] = {}
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest با ثبت زمان و خطای هر متد Bot API و میزان اشغال استخر اتصال‌ها
+    
+    __init__ نسخه 20.7 (requirements.txt) گزینه‌ای برای keepalive_expiry و verify ندارد،
+    پس کلاینت از hookهای خصوصی _build_client و _client_kwargs ساخته می‌شود. اگر
+    نسخه دیگری این hookها را نداشته باشد، به جای نادیده گرفتن بی‌صدای تنظیمات خطا داده می‌شود.
+    """
+    
+    def __init__(self, pool: str = "api", connection_pool_size: int = 1,
+                 keepalive_expiry: float = 5.0, **kwargs):
+        self.pool = pool
+        self.pool_size = connection_pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.in_flight = 0
+        self.pool_stats: Counter = Counter()
+        self._client_built = False
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        if not self._client_built:
+            raise RuntimeError(
+                "HTTPXRequest._build_client صدا زده نشد؛ InstrumentedRequest با python-telegram-bot 20.7 نوشته شده است"
+            )
+        request_pools[pool] = self
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        client_kwargs = getattr(self, "_client_kwargs", None)
+        if client_kwargs is None:
+            raise RuntimeError(
+                "HTTPXRequest._client_kwargs وجود ندارد؛ InstrumentedRequest با python-telegram-bot 20.7 نوشته شده است"
+            )
+        self._client_built = True
+        kwargs = dict(client_kwargs)
+        kwargs["limits"] = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        return httpx.AsyncClient(verify=shared_ssl_context(), **kwargs)
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        method_name = url.rsplit("/", 1)[-1]
+        labels = (("method", method_name),)
+        count_api_call(method_name)
+        stats = self.pool_stats
+        stats["requests"] += 1
+        if self.in_flight >= self.pool_size:
+            # همه اتصال‌ها مشغول‌اند و این درخواست در صف استخر می‌ماند (در HTTP/2 تقریبی است)
+            stats["saturated"] += 1
+        self.in_flight += 1
+        if self.in_flight > stats["peak_in_flight"]:
+            stats["peak_in_flight"] = self.in_flight
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            if isinstance(e, TimedOut) and "pool timeout" in str(e).lower():
+                stats["pool_timeouts"] += 1
+            metrics.inc("bot_api_errors_total", labels)
+            raise
+        finally:
+            self.in_flight -= 1
+            metrics.observe("bot_api_latency_seconds", labels, time.perf_counter() - started)
+        if code >= 400:
+            metrics.inc("bot_api_errors_total", labels)
+        return code, payload
+
+@lru_cache(maxsize=None)
+def bot_api_http_version() -> str:
+    if not BOT_API_HTTP2:
+        return "1.1"
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP/2 به python-telegram-bot[http2] نیاز دارد؛ از HTTP/1.1 استفاده می‌شود")
+        return "1.1"
+    return "2"
+
+def make_request(pool: str, size: int) -> InstrumentedRequest:
+    """کلاینت Bot API با تنظیمات محیطی؛ هر استخر اتصال‌های خودش را دارد"""
+    return InstrumentedRequest(
+        pool,
+        connection_pool_size=size,
+        keepalive_expiry=BOT_API_KEEPALIVE,
+        connect_timeout=BOT_API_CONNECT_TIMEOUT,
+        read_timeout=BOT_API_READ_TIMEOUT,
+        write_timeout=BOT_API_WRITE_TIMEOUT,
+        pool_timeout=BOT_API_POOL_TIMEOUT,
+        http_version=bot_api_http_version(),
+    )
+
+def metrics_authorized(headers: Dict[str, str]) -> bool:
+    return bool(METRICS_TOKEN) and secrets.compare_digest(headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}")
+
+async def metrics_route(method: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+    if not metrics_authorized(headers):
+        return 403, "text/plain", b"forbidden"
+    return 200, "text/plain; version=0.0.4", metrics.render().encode()
+
+# ==================== پروفایل زمان اجرا ====================
+
+class RuntimeProfiler:
+    """ضبط پروفایل CPU و تخصیص حافظه برای یک بازه محدود
+    
+    حالت پیش‌فرض هر PROFILE_INTERVAL ثانیه CPU یک نمونه از پشته می‌گیرد (SIGPROF)
+    و فقط نمونه‌هایی که هنگام اجرای هندلرها گرفته شده‌اند ثبت می‌شوند؛ خروجی
+    پشته‌های فشرده (collapsed) برای flamegraph است. حالت cprofile همه فراخوانی‌های
+    بازه را دقیق ثبت می‌کند (سربار بیشتر) و فایل pstats می‌نویسد. در هر دو حالت
+    tracemalloc پرتخصیص‌ترین خطوط را گزارش می‌کند.
+    """
+    
+    TOP = 25
+    
+    def __init__(self, directory: str = PROFILE_DIR, interval: float = PROFILE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.idle_samples = 0
+        self.active = False
+        self.started = 0.0
+        self._profile = None
+        self._previous_handler = None
+    
+    def start(self, deterministic: bool = False) -> bool:
+        """شروع ضبط؛ اگر ضبط دیگری در جریان باشد False"""
+        import tracemalloc
+        if self.active:
+            return False
+        self.active = True
+        self.started = time.time()
+        self.stacks.clear()
+        self.idle_samples = 0
+        tracemalloc.start()
+        if deterministic:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+    
+    def _sample(self, signum, frame):
+        if not metrics.in_flight:
+            self.idle_samples += 1
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+    
+    def stop(self) -> Tuple[Dict[str, str], str]:
+        """پایان ضبط و نوشتن فایل‌ها؛ (مسیر فایل‌ها، خلاصه متنی) را برمی‌گرداند"""
+        import tracemalloc
+        if not self.active:
+            return {}, ""
+        self.active = False
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        paths = {}
+        lines = [f"⏱️ {time.time() - self.started:.0f} ثانیه ضبط شد"]
+        
+        if self._profile is not None:
+            import pstats
+            self._profile.disable()
+            paths["pstats"] = os.path.join(self.directory, f"profile-{stamp}.pstats")
+            self._profile.dump_stats(paths["pstats"])
+            stats = pstats.Stats(self._profile).stats
+            self._profile = None
+            top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:5]
+            lines.append("🔥 بیشترین زمان (tottime):")
+            lines += [
+                f"  {tottime * 1000:.0f}ms {func} ({os.path.basename(file)}:{line})"
+                for (file, line, func), (_, _, tottime, _, _) in top
+            ]
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+            paths["stacks"] = os.path.join(self.directory, f"stacks-{stamp}.txt")
+            with open(paths["stacks"], "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            # زمان هر تابع در بالای پشته (self time)
+            leaves: Counter = Counter()
+            for stack, count in self.stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            total = sum(leaves.values())
+            lines.append(f"🔥 {total} نمونه هنگام اجرای هندلرها ({self.idle_samples} نمونه بیرون از آنها):")
+            lines += [f"  {count * 100 / total:.1f}% {name}" for name, count in leaves.most_common(5)]
+        
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocations = snapshot.statistics("lineno")
+        paths["allocations"] = os.path.join(self.directory, f"alloc-{stamp}.txt")
+        with open(paths["allocations"], "w") as f:
+            for stat in allocations[:self.TOP]:
+                f.write(f"{stat}\n")
+        lines.append(f"🧠 حافظه تخصیص‌یافته در این بازه که هنوز آزاد نشده: {sum(stat.size for stat in allocations) / 1024:,.0f} KiB")
+        lines += [
+            f"  {stat.size / 1024:,.1f} KiB {os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}"
+            for stat in allocations[:5]
+        ]
+        return paths, "\n".join(lines)
+
+runtime_profiler = RuntimeProfiler()
+
+def game_size(game: TicTacToeGame) -> int:
+    """اندازه تقریبی یک بازی و اشیای متعلق به آن (بایت)"""
+    size = (
+        sys.getsizeof(game) + sys.getsizeof(game.game_id) + sys.getsizeof(game.created_at)
+        + sys.getsizeof(game.x_bits) + sys.getsizeof(game.o_bits)
+        + sys.getsizeof(game.moves) + sum(sys.getsizeof(move) for move in game.moves)
+    )
+    for player in (game.player1, game.player2):
+        if player is not None:
+            size += sys.getsizeof(player) + sys.getsizeof(player.username or "") + sys.getsizeof(player.first_name or "")
+    return size
+
+def games_memory_by_status(manager: "GameManager", sample: int = 1000) -> Dict[GameStatus, Tuple[int, int]]:
+    """تعداد و حافظه تقریبی بازی‌ها به تفکیک وضعیت؛ از هر وضعیت حداکثر sample بازی اندازه‌گیری می‌شود"""
+    counts: Counter = Counter()
+    measured: Dict[GameStatus, List[int]] = {}
+    for game in manager.games.values():
+        counts[game.status] += 1
+        sizes = measured.setdefault(game.status, [])
+        if len(sizes) < sample:
+            sizes.append(game_size(game))
+    return {
+        status: (count, sum(measured[status]) * count // len(measured[status]))
+        for status, count in counts.items()
+    }
+
+# ==================== صف بازی سریع ====================
+# هر بازه امتیاز یک OrderedDict به ترتیب ورود است: افزودن، حذف (لغو یا انقضا)
+# و برداشتن قدیمی‌ترین نفر همه O(1) هستند و هیچ‌وقت کل صف مرور نمی‌شود.
+
+@dataclass(slots=True)
+class QueuedPlayer:
+    player: Player
+    chat_id: int
+    rating: float
+    queued_at: float = field(default_factory=time.monotonic)
+    job: Optional[object] = None  # Job انقضا در job_queue
+
+class MatchQueue:
+    def __init__(self, bucket_width: int = QUICKMATCH_BUCKET):
+        self.bucket_width = bucket_width
+        self.buckets: Dict[int, "OrderedDict[int, QueuedPlayer]"] = {}
+        # user_id -> شماره بازه
+        self.where: Dict[int, int] = {}
+        self.stats: Counter = Counter()
+    
+    def __len__(self) -> int:
+        return len(self.where)
+    
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.where
+    
+    def bucket_of(self, rating: float) -> int:
+        return int(rating // self.bucket_width) if self.bucket_width > 0 else 0
+    
+    def match(self, entry: QueuedPlayer) -> Optional[QueuedPlayer]:
+        """حریف قدیمی‌تر از همان بازه یا بازه‌های کناری؛ در غیر این صورت entry وارد صف می‌شود"""
+        if entry.player.user_id in self.where:
+            # دو دستور پشت سر هم از یک نفر؛ با خودش جفت نمی‌شود
+            return None
+        bucket = self.bucket_of(entry.rating)
+        for key in (bucket, bucket - 1, bucket + 1):
+            waiting = self.buckets.get(key)
+            if not waiting:
+                continue
+            _, opponent = waiting.popitem(last=False)
+            if not waiting:
+                del self.buckets[key]
+            del self.where[opponent.player.user_id]
+            self.stats["matches"] += 1
+            self.stats["wait_seconds_total"] += time.monotonic() - opponent.queued_at
+            return opponent
+        self.buckets.setdefault(bucket, OrderedDict())[entry.player.user_id] = entry
+        self.where[entry.player.user_id] = bucket
+        self.stats["queued"] += 1
+        return None
+    
+    def remove(self, user_id: int) -> Optional[QueuedPlayer]:
+        bucket = self.where.pop(user_id, None)
+        if bucket is None:
+            return None
+        waiting = self.buckets[bucket]
+        entry = waiting.pop(user_id)
+        if not waiting:
+            del self.buckets[bucket]
+        return entry
+
+match_queue = MatchQueue()
 
 # ==================== دستورات ربات ====================
 
@@ -280,19 +2920,47 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "به ربات بازی دوز (Tic Tac Toe) خوش آمدید! 🎮\n\n"
         "📌 دستورات:\n"
         "/start - نمایش این راهنما\n"
-        "/newgame - شروع یک بازی جدید\n"
+        "/newgame - شروع یک بازی جدید (مثلا /newgame 5 4 برای صفحه ۵×۵)\n"
         "/tictactoe - شروع بازی دوز\n"
+        "/vsbot - بازی با ربات (easy / medium / hard)\n"
+        "/quickmatch - پیدا کردن حریف از چت‌های دیگر\n"
         "/help - راهنمای بازی\n"
         "/status - وضعیت بازی‌های فعال\n"
+        "/lobby - پیام ثابت بازی‌های در انتظار گروه (/lobby off برای حذف)\n"
+        "/leaderboard - جدول امتیازات (global برای جدول کل)\n"
+        "/mystats - آمار و رتبه شما\n"
+        "/history - تاریخچه بازی‌های شما\n"
         "/cancel - لغو بازی فعلی\n\n"
-        "🎮 برای شروع یک بازی جدید در گروه، از دستور /newgame استفاده کنید."
+        "🎮 برای شروع یک بازی جدید در گروه، از دستور /newgame استفاده کنید.\n"
+        f"💬 در هر چتی هم می‌توانید @{context.bot.username} را تایپ کنید و کارت بازی بفرستید."
     )
 
+def parse_board_args(args: List[str]) -> Optional[Tuple[int, int]]:
+    """خواندن اندازه صفحه و طول ردیف برنده از آرگومان‌ها: /newgame 5 4"""
+    try:
+        size = int(args[0]) if args else BOARD_SIZE
+        win_length = int(args[1]) if len(args) > 1 else default_win_length(size)
+    except ValueError:
+        return None
+    if not (MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE and 3 <= win_length <= size):
+        return None
+    return size, win_length
+
 async def new_game_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ایجاد یک بازی جدید"""
     chat_id = update.effective_chat.id
     user = update.effective_user
     
+    board = parse_board_args(context.args or [])
+    if board is None:
+        await update.message.reply_text(
+            f"❌ اندازه نامعتبر! مثال: /newgame 5 4\n"
+            f"اندازه صفحه بین {MIN_BOARD_SIZE} تا {MAX_BOARD_SIZE} "
+            f"و طول ردیف برنده بین ۳ و اندازه صفحه است."
+        )
+        return
+    size, win_length = board
+    
     # ایجاد بازیکن
     player = Player(
         user_id=user.id,
@@ -301,19 +2969,123 @@ async def new_game_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # ایجاد بازی
-    game = game_manager.create_game(chat_id, player)
+    game = game_manager.create_game(chat_id, player, size, win_length)
     
     # ایجاد کیبورد بازی
     keyboard = game.get_board_keyboard()
+    text = game.get_game_info_text()
     
     # ارسال پیام بازی
     message = await update.message.reply_text(
-        game.get_game_info_text(),
+        text,
         reply_markup=keyboard
     )
     
     # ذخیره آیدی پیام
-    game.message_id = message.message_id
+    game_manager.set_message_id(game, message.message_id)
+    edit_scheduler.note_sent(chat_id, message.message_id, text, keyboard)
+
+async def vsbot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """بازی تک‌نفره با ربات"""
+    level = context.args[0].lower() if context.args else DEFAULT_BOT_LEVEL
+    if level not in BOT_LEVELS:
+        await update.message.reply_text(
+            f"❌ سطح نامعتبر! سطح‌های موجود: {' / '.join(BOT_LEVELS)}"
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    user = update.effective_user
+    player = Player(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name
+    )
+    
+    game = create_bot_game(chat_id, player, level)
+    keyboard = game.get_board_keyboard()
+    text = game.get_game_info_text()
+    
+    message = await update.message.reply_text(
+        text,
+        reply_markup=keyboard
+    )
+    
+    game_manager.set_message_id(game, message.message_id)
+    edit_scheduler.note_sent(chat_id, message.message_id, text, keyboard)
+
+async def quickmatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ورود به صف بازی سریع با یک حریف از هر چتی"""
+    chat_id = update.effective_chat.id
+    user = update.effective_user
+    
+    if user.id in match_queue:
+        await update.message.reply_text("⏳ شما در صف بازی سریع هستید. برای خروج /cancel را بزنید.")
+        return
+    
+    player = Player(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name
+    )
+    board = game_manager.leaderboards.get(GLOBAL_LEADERBOARD)
+    stats = board.get(user.id) if board else None
+    entry = QueuedPlayer(player, chat_id, stats.rating if stats else ELO_INITIAL_RATING)
+    
+    opponent = match_queue.match(entry)
+    if opponent is None:
+        entry.job = context.job_queue.run_once(
+            quickmatch_timeout_job, QUICKMATCH_TIMEOUT, data=user.id, name=f"quickmatch:{user.id}"
+        )
+        # ممکن است حریف پیش از رسیدن این پیام پیدا شده باشد؛ صفحه بازی جداگانه ارسال می‌شود
+        await update.message.reply_text(
+            f"🔎 در صف بازی سریع... (حداکثر {QUICKMATCH_TIMEOUT} ثانیه)\n"
+            "به محض پیدا شدن حریف، صفحه بازی برای هر دو نفر ارسال می‌شود. لغو: /cancel"
+        )
+        return
+    
+    if opponent.job is not None:
+        opponent.job.schedule_removal()
+    
+    # نفری که زودتر آمده بازیکن اول است
+    game = game_manager.create_game(opponent.chat_id, opponent.player)
+    game_manager.join_game(game, player)
+    text = game.get_game_info_text()
+    keyboard = game.get_board_keyboard()
+    
+    # کلیک‌ها تا ثبت شناسه هر دو پیام پشت قفل بازی می‌مانند
+    async with game_manager.lock(game.game_id):
+        chats = [opponent.chat_id] if chat_id == opponent.chat_id else [opponent.chat_id, chat_id]
+        messages = await asyncio.gather(*(
+            context.bot.send_message(target, text, reply_markup=keyboard) for target in chats
+        ), return_exceptions=True)
+        sent = [message for message in messages if not isinstance(message, BaseException)]
+        if len(sent) < len(messages):
+            # بدون صفحه یکی از دو نفر بازی پیش نمی‌رود؛ بازی حذف و به نفر دیگر خبر داده می‌شود
+            failed = next(message for message in messages if isinstance(message, BaseException))
+            logger.warning(f"ارسال صفحه بازی سریع {game.game_id} ممکن نشد: {failed}")
+            game_manager.delete_game(game.game_id)
+            for message in sent:
+                edit_scheduler.submit(
+                    message.chat_id, message.message_id,
+                    "⚠️ صفحه بازی به حریف نرسید و بازی لغو شد. دوباره /quickmatch را امتحان کنید."
+                )
+            return
+        for message in messages:
+            edit_scheduler.note_sent(message.chat_id, message.message_id, text, keyboard)
+        mirror = (chat_id, messages[1].message_id) if len(messages) > 1 else None
+        game_manager.set_message_id(game, messages[0].message_id, mirror)
+
+async def quickmatch_timeout_job(context: ContextTypes.DEFAULT_TYPE):
+    """انقضای انتظار در صف بازی سریع"""
+    entry = match_queue.remove(context.job.data)
+    if entry is None:
+        return
+    match_queue.stats["expired"] += 1
+    await context.bot.send_message(
+        entry.chat_id,
+        f"⌛ {entry.player.display_name}، حریفی پیدا نشد. دوباره /quickmatch را امتحان کنید."
+    )
 
 async def tictactoe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """شروع بازی دوز"""
@@ -328,6 +3100,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• یک نفر ❌ و دیگری ⭕ بازی می‌کند\n"
         "• بازیکنان به نوبت در خانه‌های خالی کلیک می‌کنند\n"
         "• اولین کسی که ۳ علامت خود را در یک خط قرار دهد برنده است\n"
+        "• در صفحه‌های بزرگ‌تر (تا ۸×۸) تعداد لازم هنگام ساخت بازی تعیین می‌شود\n"
         "• خط می‌تواند افقی، عمودی یا مورب باشد\n"
         "• اگر همه خانه‌ها پر شوند و برنده‌ای نباشد، بازی مساوی است\n\n"
         "🔄 نحوه بازی:\n"
@@ -344,151 +3117,402 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(help_text)
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """مدیریت کلیک‌های دکمه‌ها"""
-    query = update.callback_query
-    await query.answer()
+def format_stats_line(stats: PlayerStats) -> str:
+    return f"{round(stats.rating)} امتیاز - {stats.wins} برد / {stats.losses} باخت / {stats.draws} مساوی"
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """جدول امتیازات گروه؛ /leaderboard global برای جدول کل"""
+    is_global = bool(context.args) and context.args[0].lower() == "global"
+    chat_id = GLOBAL_LEADERBOARD if is_global else update.effective_chat.id
+    board = game_manager.leaderboards.get(chat_id)
     
+    if not board:
+        await update.message.reply_text("📭 هنوز بازی تمام‌شده‌ای ثبت نشده است.")
+        return
+    
+    title = "🏆 جدول امتیازات کل" if is_global else "🏆 جدول امتیازات این گروه"
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    text = f"{title}\n\n"
+    for rank, stats in enumerate(board.top(), 1):
+        text += f"{medals.get(rank, f'{rank}.')} {stats.name}\n   {format_stats_line(stats)}\n"
+    text += f"\n👥 {len(board)} بازیکن"
+    await update.message.reply_text(text)
+
+async def mystats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """آمار و رتبه کاربر در این گروه و در کل"""
     user = update.effective_user
-    data = query.data
+    text = f"📊 آمار {user.first_name}\n"
+    found = False
+    for title, chat_id in (("این گروه", update.effective_chat.id), ("کل", GLOBAL_LEADERBOARD)):
+        board = game_manager.leaderboards.get(chat_id)
+        stats = board.get(user.id) if board else None
+        if stats is None:
+            continue
+        found = True
+        text += f"\n🏅 {title}: رتبه {board.rank(user.id)} از {len(board)}\n   {format_stats_line(stats)}\n"
     
-    # جدا کردن اطلاعات callback_data
-    parts = data.split("_")
+    if not found:
+        text += "\nهنوز بازی تمام‌شده‌ای ندارید. با /newgame شروع کنید!"
+    await update.message.reply_text(text)
+
+HISTORY_CURSOR_SHIFT = 64  # arg دکمه صفحه بعد: (cursor << 64) | user_id
+
+def render_history_page(page: List[dict], owner: int, cursor: int,
+                        first_page: bool = True) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    text = "📜 تاریخچه بازی‌های شما\n\n"
+    for record in page:
+        p1, p2 = record["players"]
+        when = datetime.fromtimestamp(record["finished_at"]).strftime("%Y-%m-%d %H:%M")
+        if record["status"] == GameStatus.X_WON.name:
+            result = f"🎉 برنده: {p1['name']}"
+        elif record["status"] == GameStatus.O_WON.name:
+            result = f"🎉 برنده: {p2['name']}"
+        else:
+            result = "🤝 مساوی"
+        cells = " ".join(str(cell + 1) for cell, _ in record["moves"])
+        text += f"🗓 {when}\n❌ {p1['name']} - ⭕ {p2['name']}\n"
+        text += f"{result} | {len(record['moves'])} حرکت\n📍 {cells}\n\n"
     
-    if parts[0] == "new" and len(parts) >= 2:
-        # بازی جدید در همان چت
-        game_id = parts[1]
-        old_game = game_manager.get_game(game_id)
-        
-        if old_game and old_game.chat_id == query.message.chat_id:
-            # ایجاد بازی جدید با همان بازیکن اول
-            player1 = Player(
-                user_id=user.id,
-                username=user.username,
-                first_name=user.first_name
-            )
-            
-            new_game = game_manager.create_game(old_game.chat_id, player1)
-            keyboard = new_game.get_board_keyboard()
-            
-            await query.edit_message_text(
-                new_game.get_game_info_text(),
-                reply_markup=keyboard
-            )
-            
-            # حذف بازی قدیمی
-            game_manager.delete_game(game_id)
+    buttons = []
+    if not first_page:
+        buttons.append(InlineKeyboardButton(
+            "🔝 جدیدترین", callback_data=encode_callback(CallbackAction.HISTORY, arg=owner)
+        ))
+    if cursor:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ قدیمی‌تر",
+            callback_data=encode_callback(CallbackAction.HISTORY, arg=(cursor << HISTORY_CURSOR_SHIFT) | owner)
+        ))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تاریخچه بازی‌های تمام‌شده کاربر، از جدید به قدیم"""
+    if game_manager.archive is None:
+        await update.message.reply_text("📭 آرشیو بازی‌ها فعال نیست.")
         return
     
-    elif parts[0] == "join" and len(parts) >= 2:
-        # پیوستن به بازی
-        game_id = parts[1]
-        game = game_manager.get_game(game_id)
-        
-        if not game:
-            await query.edit_message_text("❌ بازی یافت نشد!")
-            return
-        
-        if game.status != GameStatus.WAITING:
-            await query.answer("بازی قبلا شروع شده!", show_alert=True)
-            return
-        
-        # بررسی اینکه آیا کاربر قبلاً در بازی است
-        if user.id == game.player1.user_id:
-            await query.answer("شما در حال حاضر در این بازی هستید!", show_alert=True)
-            return
-        
-        # اضافه کردن بازیکن دوم
-        player2 = Player(
+    user = update.effective_user
+    page, cursor = await asyncio.to_thread(game_manager.archive.user_page, user.id)
+    if not page:
+        await update.message.reply_text("📭 هنوز بازی تمام‌شده‌ای ندارید. با /newgame شروع کنید!")
+        return
+    
+    text, keyboard = render_history_page(page, user.id, cursor)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+def format_games_memory() -> str:
+    report = games_memory_by_status(game_manager)
+    lines = ["🧠 حافظه تقریبی بازی‌ها:"]
+    for status in GameStatus:
+        count, size = report.get(status, (0, 0))
+        if count:
+            lines.append(f"  {status.name}: {count} بازی ≈ {size / 1024:,.1f} KiB")
+    total = sum(size for _, size in report.values())
+    lines.append(f"  کل: {total / 1024:,.1f} KiB | RSS پردازه: {process_rss_bytes() / 2 ** 20:,.1f} MiB")
+    return "\n".join(lines)
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حافظه بازی‌ها به تفکیک وضعیت (فقط ادمین)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    await update.message.reply_text(format_games_memory())
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ضبط پروفایل برای چند ثانیه (فقط ادمین): /profile 30 یا /profile 30 cprofile"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    args = context.args or []
+    try:
+        seconds = max(1, min(int(args[0]) if args else 30, PROFILE_MAX_SECONDS))
+    except ValueError:
+        await update.message.reply_text("❌ مثال: /profile 30 یا /profile 30 cprofile")
+        return
+    
+    if not runtime_profiler.start(deterministic="cprofile" in args[1:]):
+        await update.message.reply_text("⏳ یک ضبط پروفایل در جریان است.")
+        return
+    context.job_queue.run_once(profile_done_job, seconds, chat_id=update.effective_chat.id)
+    await update.message.reply_text(
+        f"🔬 ضبط پروفایل برای {seconds} ثانیه شروع شد.\n\n{format_games_memory()}"
+    )
+
+async def profile_done_job(context: ContextTypes.DEFAULT_TYPE):
+    """پایان بازه پروفایل و ارسال خلاصه برای ادمین"""
+    paths, summary = runtime_profiler.stop()
+    if not paths:
+        return
+    files = "\n".join(f"📄 {name}: {path}" for name, path in paths.items())
+    logger.info(f"پروفایل ذخیره شد:\n{summary}\n{files}")
+    if context.job.chat_id is not None:
+        await context.bot.send_message(context.job.chat_id, f"{summary}\n\n{files}\n\n{format_games_memory()}")
+
+async def on_new_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """بازی جدید در همان چت"""
+    query = update.callback_query
+    user = update.effective_user
+    old_game = game_manager.get_game(game_id)
+    inline_message_id = query.inline_message_id or ""
+    
+    if old_game is None:
+        return
+    if inline_message_id:
+        same_message = old_game.inline_message_id == inline_message_id
+    else:
+        same_message = old_game.chat_id == query.message.chat_id
+    
+    if same_message:
+        # ایجاد بازی جدید با همان بازیکن اول
+        player1 = Player(
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
         
-        if game.add_player(player2):
-            game_manager.user_games[user.id] = game_id
-            game.start_game()
-            
-            # به‌روزرسانی پیام
-            keyboard = game.get_board_keyboard()
-            await query.edit_message_text(
-                game.get_game_info_text(),
-                reply_markup=keyboard
-            )
+        if old_game.bot_level:
+            new_game = create_bot_game(old_game.chat_id, player1, old_game.bot_level)
         else:
-            await query.answer("بازی تکمیل است!", show_alert=True)
-    
-    elif parts[0] == "move" and len(parts) >= 4:
-        # حرکت در بازی
-        game_id = parts[1]
-        try:
-            row = int(parts[2])
-            col = int(parts[3])
-        except:
-            return
-        
-        game = game_manager.get_game(game_id)
-        
-        if not game:
-            await query.edit_message_text("❌ بازی یافت نشد!")
-            return
-        
-        if game.status != GameStatus.PLAYING:
-            await query.answer("بازی تمام شده!", show_alert=True)
-            return
-        
-        # پیدا کردن بازیکن
-        player = None
-        if user.id == game.player1.user_id:
-            player = game.player1
-        elif game.player2 and user.id == game.player2.user_id:
-            player = game.player2
+            new_game = game_manager.create_game(
+                old_game.chat_id, player1, old_game.size, old_game.win_length,
+                inline_message_id=inline_message_id
+            )
+        keyboard = new_game.get_board_keyboard()
         
-        if not player:
-            await query.answer("شما بازیکن این بازی نیستید!", show_alert=True)
-            return
+        submit_query_edit(query, new_game.get_game_info_text(), keyboard)
+        if not inline_message_id:
+            game_manager.set_message_id(new_game, query.message.message_id)
         
-        # انجام حرکت
-        if game.make_move(player, row, col):
-            # به‌روزرسانی پیام
-            keyboard = game.get_board_keyboard()
-            await query.edit_message_text(
-                game.get_game_info_text(),
-                reply_markup=keyboard
-            )
-        else:
-            await query.answer("حرکت نامعتبر! یا نوبت شما نیست!", show_alert=True)
+        # حذف بازی قدیمی
+        game_manager.delete_game(game_id)
+
+def join_waiting_game(game: TicTacToeGame, user) -> Optional[str]:
+    """پیوستن کاربر به بازی در انتظار؛ متن هشدار یا None در صورت موفقیت"""
+    if game.status != GameStatus.WAITING:
+        return "بازی قبلا شروع شده!"
+    
+    # بررسی اینکه آیا کاربر قبلاً در بازی است
+    if user.id == game.player1.user_id:
+        return "شما در حال حاضر در این بازی هستید!"
+    
+    # اضافه کردن بازیکن دوم
+    player2 = Player(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name
+    )
+    
+    if not game_manager.join_game(game, player2):
+        return "بازی تکمیل است!"
+
+async def on_join_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """پیوستن به بازی"""
+    query = update.callback_query
+    game = game_manager.get_game(game_id)
+    
+    if not game:
+        submit_query_edit(query, "❌ بازی یافت نشد!")
+        return
     
-    elif parts[0] == "delete" and len(parts) >= 2:
-        # حذف بازی
-        game_id = parts[1]
+    alert = join_waiting_game(game, update.effective_user)
+    if alert:
+        return alert
+    # به‌روزرسانی پیام
+    submit_query_edit(query, game.get_game_info_text(), game.get_board_keyboard())
+
+async def on_lobby_join(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """پیوستن از دکمه‌های پیام لابی؛ پیام خود بازی ویرایش می‌شود و لابی با تاخیر به‌روز می‌شود"""
+    game = game_manager.get_game(game_id)
+    if not game:
+        return "این بازی دیگر وجود ندارد!"
+    
+    alert = join_waiting_game(game, update.effective_user)
+    if alert:
+        return alert
+    submit_game_edit(game, game.get_game_info_text(), game.get_board_keyboard())
+    return "✅ به بازی پیوستید! صفحه بازی در پیام همان بازی است."
+
+async def on_move(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, cell: int) -> Optional[str]:
+    """حرکت در بازی"""
+    query = update.callback_query
+    user = update.effective_user
+    game = game_manager.get_game(game_id)
+    
+    if not game:
+        submit_query_edit(query, "❌ بازی یافت نشد!")
+        return
+    
+    if game.status != GameStatus.PLAYING:
+        return "بازی تمام شده!"
+    
+    row, col = divmod(cell, game.size)
+    
+    # پیدا کردن بازیکن
+    player = None
+    if user.id == game.player1.user_id:
+        player = game.player1
+    elif game.player2 and user.id == game.player2.user_id:
+        player = game.player2
+    
+    if not player:
+        return "شما بازیکن این بازی نیستید!"
+    
+    # انجام حرکت
+    if game_manager.make_move(game, player, row, col):
+        # در بازی با ربات، جواب ربات همین‌جا زده می‌شود
+        play_bot_turn(game)
+        # به‌روزرسانی پیام (و کپی آن در بازی بین دو چت)
+        submit_game_edit(game, game.get_game_info_text(), game.get_board_keyboard())
+    else:
+        return "حرکت نامعتبر! یا نوبت شما نیست!"
+
+async def on_delete_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """حذف بازی"""
+    query = update.callback_query
+    user = update.effective_user
+    game = game_manager.get_game(game_id)
+    
+    if not game:
+        submit_query_edit(query, "❌ بازی یافت نشد!")
+        return
+    
+    # فقط سازنده بازی یا بازیکنان می‌توانند حذف کنند
+    if user.id not in [game.player1.user_id, game.player2.user_id if game.player2 else -1]:
+        return "شما مجاز به حذف این بازی نیستید!"
+    
+    game_manager.delete_game(game_id)
+    submit_game_edit(game, "🗑️ بازی حذف شد!")
+
+async def on_disabled_cell(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """کلیک روی خانه پر یا غیرفعال"""
+    return "این خانه قابل انتخاب نیست!"
+
+async def on_history(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """صفحه دیگری از تاریخچه"""
+    query = update.callback_query
+    owner, cursor = arg & ((1 << HISTORY_CURSOR_SHIFT) - 1), arg >> HISTORY_CURSOR_SHIFT
+    if update.effective_user.id != owner:
+        return "این تاریخچه مربوط به کاربر دیگری است!"
+    if game_manager.archive is None:
+        return "آرشیو بازی‌ها فعال نیست!"
+    
+    page, next_cursor = await asyncio.to_thread(game_manager.archive.user_page, owner, cursor)
+    text, keyboard = render_history_page(page, owner, next_cursor, first_page=not cursor)
+    submit_query_edit(query, text, keyboard)
+
+async def on_inline_play(update: Update, context: ContextTypes.DEFAULT_TYPE, game_id: str, arg: int) -> Optional[str]:
+    """کلیک روی کارت اینلاین: نفر اول بازی را می‌سازد و نفر دوم آن را شروع می‌کند
+    
+    کلیک نفر اول فقط پاسخ callback دارد و پیام با پیوستن نفر دوم یک بار ویرایش می‌شود.
+    """
+    query = update.callback_query
+    user = update.effective_user
+    size, win_length = arg >> 4, arg & 0xF
+    if not query.inline_message_id or not (MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE and 3 <= win_length <= size):
+        return
+    
+    player = Player(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name
+    )
+    # شناسه از خود پیام ساخته می‌شود چون کارت‌های کش‌شده شناسه بازی ندارند
+    game_id = inline_game_id(query.inline_message_id)
+    game = game_manager.get_game(game_id)
+    if game is None:
+        game = game_manager.create_game(
+            0, player, size, win_length, game_id=game_id, inline_message_id=query.inline_message_id
+        )
+        if game is not None:
+            return "✅ شما بازیکن ❌ هستید. منتظر نفر دوم بمانید..."
         game = game_manager.get_game(game_id)
-        
-        if not game:
-            await query.edit_message_text("❌ بازی یافت نشد!")
+        if game is None:
+            return "لطفا دوباره تلاش کنید!"
+    
+    if game.status != GameStatus.WAITING:
+        return "بازی قبلا شروع شده!"
+    if user.id == game.player1.user_id:
+        return "شما در حال حاضر در این بازی هستید! منتظر نفر دوم بمانید."
+    if not game_manager.join_game(game, player):
+        return "بازی تکمیل است!"
+    submit_game_edit(game, game.get_game_info_text(), game.get_board_keyboard())
+
+# جدول دیسپچ: هر عمل یک هندلر (با اندازه‌گیری زمان به تفکیک عمل)
+CALLBACK_HANDLERS = {
+    action: timed(f"callback_{action.name.lower()}")(handler)
+    for action, handler in {
+        CallbackAction.NEW: on_new_game,
+        CallbackAction.JOIN: on_join_game,
+        CallbackAction.MOVE: on_move,
+        CallbackAction.DELETE: on_delete_game,
+        CallbackAction.NONE: on_disabled_cell,
+        CallbackAction.HISTORY: on_history,
+        CallbackAction.INLINE: on_inline_play,
+        CallbackAction.LOBBY: on_lobby_join,
+    }.items()
+}
+
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """مدیریت کلیک‌های دکمه‌ها
+    
+    هندلرها نتیجه را بدون درخواست شبکه تعیین می‌کنند (متن هشدار یا None)؛
+    سپس دقیقا یک answerCallbackQuery زده می‌شود (در صورت خطا با هشدار عمومی)
+    و ویرایش پیام از صف می‌رود.
+    """
+    query = update.callback_query
+    calls = Counter()
+    token = update_api_calls.set(calls)
+    message = query.inline_message_id or (query.message.chat_id, query.message.message_id)
+    key = (update.effective_user.id, message, query.data)
+    rejected = click_admission.admit(update.effective_user.id, key)
+    answered = False
+    try:
+        if rejected:
+            # کلیک تکراری یا بیش از حد سریع؛ بدون قفل و بدون دسترسی به بازی
+            answered = True
+            await query.answer("⏳ کمی آهسته‌تر!" if rejected == "rate_limited" else None)
             return
         
-        # فقط سازنده بازی یا بازیکنان می‌توانند حذف کنند
-        if user.id not in [game.player1.user_id, game.player2.user_id if game.player2 else -1]:
-            await query.answer("شما مجاز به حذف این بازی نیستید!", show_alert=True)
-            return
+        alert = None
+        decoded = decode_callback(query.data)
+        # داده نامعتبر (دکمه‌های قدیمی یا دستکاری‌شده) فقط پاسخ خالی می‌گیرد
+        if decoded is not None:
+            action, game_id, arg = decoded
+            # آپدیت‌ها هم‌زمان پردازش می‌شوند؛ کلیک‌های یک بازی به ترتیب اجرا شوند
+            async with game_manager.lock(game_id):
+                alert = await CALLBACK_HANDLERS[action](update, context, game_id, arg)
         
-        game_manager.delete_game(game_id)
-        await query.edit_message_text("🗑️ بازی حذف شد!")
-    
-    elif parts[0] == "none":
-        # کلیک روی خانه پر یا غیرفعال
-        await query.answer("این خانه قابل انتخاب نیست!", show_alert=True)
+        answered = True
+        if alert:
+            await query.answer(alert, show_alert=True)
+        else:
+            await query.answer()
+    except Exception:
+        # بدون پاسخ، دکمه تا timeout تلگرام در حال بارگذاری می‌ماند
+        if not answered:
+            try:
+                await query.answer("⚠️ خطایی رخ داد. لطفا دوباره تلاش کنید.", show_alert=True)
+            except TelegramError:
+                pass
+        raise
+    finally:
+        if not rejected:
+            click_admission.release(key)
+        update_api_calls.reset(token)
+        check_api_budget(calls)
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """کارت‌های آماده بازی برای @ربات در هر چتی (مثلا «@ربات 5 4»)"""
+    query = update.inline_query
+    args = query.query.split()
+    # متن نیمه‌کاره یا نامعتبر همان کارت‌های پیش‌فرض را می‌گیرد تا هر حرف تایپ‌شده کارت تازه نسازد
+    board = parse_board_args(args) if args else None
+    await query.answer(inline_results(board), cache_time=INLINE_CACHE_TIME, is_personal=False)
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """نمایش وضعیت بازی‌های فعال"""
     chat_id = update.effective_chat.id
     
-    # پیدا کردن بازی‌های فعال در این چت
-    active_games = []
-    for game in game_manager.games.values():
-        if game.chat_id == chat_id and game.status in [GameStatus.WAITING, GameStatus.PLAYING]:
-            active_games.append(game)
+    # بازی‌های فعال این چت از ایندکس مدیر بازی‌ها
+    active_games = game_manager.get_chat_games(chat_id)
     
     if not active_games:
         await update.message.reply_text("📭 هیچ بازی فعالی در این گروه وجود ندارد.")
@@ -514,10 +3538,48 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(text)
 
+async def lobby_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ساخت پیام لابی این چت (و سنجاق آن)؛ /lobby off لابی را خاموش می‌کند"""
+    chat_id = update.effective_chat.id
+    
+    if context.args and context.args[0].lower() == "off":
+        message_id = lobby.close(chat_id)
+        if message_id is None:
+            await update.message.reply_text("📭 این گروه لابی فعالی ندارد.")
+            return
+        edit_scheduler.submit(chat_id, message_id, "🏠 لابی این گروه خاموش شد.")
+        try:
+            await context.bot.unpin_chat_message(chat_id, message_id)
+        except (BadRequest, Forbidden):
+            pass
+        await update.message.reply_text("✅ لابی خاموش شد.")
+        return
+    
+    text, keyboard = lobby.render(chat_id)
+    message = await update.message.reply_text(text, reply_markup=keyboard)
+    edit_scheduler.note_sent(chat_id, message.message_id, text, keyboard)
+    old_message_id = lobby.open(chat_id, message.message_id, (text, keyboard))
+    if old_message_id is not None:
+        # فقط آخرین پیام لابی به‌روز می‌شود
+        edit_scheduler.submit(chat_id, old_message_id, "🏠 لابی به پیام جدیدتر منتقل شد.")
+    try:
+        await context.bot.pin_chat_message(chat_id, message.message_id, disable_notification=True)
+    except (BadRequest, Forbidden):
+        # ربات اجازه سنجاق کردن ندارد؛ لابی بدون سنجاق هم به‌روز می‌شود
+        pass
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """لغو بازی فعلی کاربر"""
+    """لغو بازی فعلی کاربر یا خروج از صف بازی سریع"""
     user = update.effective_user
     
+    entry = match_queue.remove(user.id)
+    if entry is not None:
+        if entry.job is not None:
+            entry.job.schedule_removal()
+        await update.message.reply_text("✅ از صف بازی سریع خارج شدید.")
+        return
+    
+    # /cancel همیشه به کارگر صف می‌رسد؛ بازی از backend مشترک پیدا می‌شود
     game = game_manager.get_player_game(user.id)
     if not game:
         await update.message.reply_text("❌ شما در هیچ بازی فعالی نیستید.")
@@ -526,6 +3588,27 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     game_manager.delete_game(game.game_id)
     await update.message.reply_text("✅ بازی شما لغو شد.")
 
+async def reap_games_job(context: ContextTypes.DEFAULT_TYPE):
+    """پاکسازی دوره‌ای بازی‌های رهاشده و به‌روزرسانی پیام آنها"""
+    expired = game_manager.reap()
+    if not expired:
+        return
+    
+    for game in expired:
+        if not game.message_id and not game.inline_message_id:
+            continue
+        if game.status in GameManager.ACTIVE_STATUSES:
+            text = "⌛ این بازی به دلیل عدم فعالیت منقضی شد."
+        else:
+            # نتیجه بازی تمام‌شده حفظ می‌شود و فقط دکمه‌ها حذف می‌شوند
+            text = game.get_game_info_text()
+        submit_game_edit(game, text)
+    
+    logger.info(
+        f"🧹 {len(expired)} بازی پاکسازی شد | "
+        f"کل: {dict(game_manager.reaper_stats)} | باقی‌مانده: {len(game_manager.games)}"
+    )
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """مدیریت خطاها"""
     logger.error(f"خطا رخ داد: {context.error}")
@@ -540,50 +3623,351 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
+async def post_shutdown(application: Application):
+    """نوشتن رویدادهای ذخیره‌نشده قبل از خروج"""
+    await edit_scheduler.stop()
+    game_manager.store.close()
+    if game_manager.archive is not None:
+        game_manager.archive.close()
+
+async def ensure_webhook(bot: Bot, url: str) -> bool:
+    """تنظیم webhook فقط وقتی تلگرام آدرس دیگری دارد؛ True یعنی setWebhook فرستاده شد"""
+    info = await bot.get_webhook_info()
+    if info.url == url:
+        return False
+    await bot.set_webhook(url, secret_token=WEBHOOK_SECRET)
+    return True
+
 async def post_init(application: Application):
-    """تنظیم webhook بعد از راه‌اندازی"""
+    """راه‌اندازی صف ویرایش و تنظیم webhook"""
+    boot_timer.mark("initialize")
+    edit_scheduler.start(application.bot)
+    if PROFILE_ON_BOOT and runtime_profiler.start():
+        application.job_queue.run_once(profile_done_job, PROFILE_ON_BOOT)
+    
+    if WORKER_INDEX is not None:
+        # webhook را توزیع‌کننده تنظیم می‌کند
+        return
     if WEBHOOK_URL:
-        await application.bot.set_webhook(WEBHOOK_URL)
-        print(f"✅ Webhook تنظیم شد: {WEBHOOK_URL}")
+        if await ensure_webhook(application.bot, f"{WEBHOOK_URL}{WEBHOOK_PATH}"):
+            print(f"✅ Webhook تنظیم شد: {WEBHOOK_URL}")
+        else:
+            print(f"✅ Webhook از قبل تنظیم بود: {WEBHOOK_URL}")
+        boot_timer.mark("webhook")
     else:
         print("⚠️ Webhook URL تنظیم نشده، احتمالاً در حالت توسعه هستید")
 
+async def warm_up_job(context: ContextTypes.DEFAULT_TYPE):
+    """بارگذاری‌هایی که برای پاسخ به اولین آپدیت لازم نیستند
+    
+    هر دو در اولین استفاده هم انجام می‌شوند؛ این کار فقط هزینه را از مسیر آن آپدیت برمی‌دارد.
+    """
+    # جدول حرکات ربات
+    started = time.perf_counter()
+    get_solved_table()
+    print(f"🤖 جدول ربات در {time.perf_counter() - started:.3f} ثانیه بارگذاری شد")
+    
+    # ایندکس آرشیو بازی‌ها
+    if game_manager.archive is not None:
+        started = time.perf_counter()
+        # اسکن کامل فایل؛ تا پایانش رکوردهای تازه در حافظه می‌مانند
+        archived = await asyncio.to_thread(game_manager.archive.open)
+        print(f"📜 {archived} بازی آرشیوشده در {time.perf_counter() - started:.2f} ثانیه ایندکس شد")
+
+# ==================== سرور HTTP و اجرای چند پردازه‌ای ====================
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+HTTP_MAX_HEADERS = 100
+
+# هندلر هر مسیر: (method, body, headers) -> (status, content_type, body)؛ نام سرآیندها با حروف کوچک
+HttpRoute = Callable[[str, bytes, Dict[str, str]], Awaitable[Tuple[int, str, bytes]]]
+
+def webhook_authorized(headers: Dict[str, str]) -> bool:
+    return secrets.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), WEBHOOK_SECRET)
+
+async def serve_http(host: str, port: int, routes: Dict[str, HttpRoute]) -> asyncio.AbstractServer:
+    """سرور HTTP/1.1 حداقلی (keep-alive) برای webhook و مسیرهای داخلی
+    
+    روی پورت عمومی هم باز است، پس کل هر درخواست (از جمله انتظار اتصال بیکار) باید
+    در HTTP_READ_TIMEOUT برسد، بدنه بزرگ‌تر از HTTP_MAX_BODY بدون خواندن رد می‌شود
+    و بیش از HTTP_MAX_CONNECTIONS اتصال هم‌زمان پاسخ 503 می‌گیرد.
+    """
+    slots = asyncio.Semaphore(HTTP_MAX_CONNECTIONS)
+    
+    async def read_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """(method, target, headers, body) یا None اگر اتصال بسته شد یا بدنه رد شد"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        for _ in range(HTTP_MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("too many headers")
+        length = int(headers.get("content-length", 0))
+        if not 0 <= length <= HTTP_MAX_BODY:
+            writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return None
+        return method, target, headers, await reader.readexactly(length)
+    
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if slots.locked():
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        try:
+            async with slots:
+                await serve(reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            request = await asyncio.wait_for(read_request(reader, writer), HTTP_READ_TIMEOUT)
+            if request is None:
+                return
+            method, target, headers, body = request
+            
+            route = routes.get(target.split("?", 1)[0])
+            if route is None:
+                status, content_type, payload = 404, "text/plain", b"not found"
+            else:
+                try:
+                    status, content_type, payload = await route(method, body, headers)
+                except Exception as e:
+                    logger.error(f"خطا در پردازش درخواست HTTP: {e}")
+                    status, content_type, payload = 500, "text/plain", b"error"
+            
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                return
+    
+    return await asyncio.start_server(handle, host, port)
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+# صف /quickmatch در حافظه یک پردازه است؛ این دستورها از هر چتی به کارگر صف می‌رسند
+QUICKMATCH_COMMANDS = ("/quickmatch", "/cancel")
+QUICKMATCH_SHARD = 0
+
+def update_shard(data: dict, shards: int) -> int:
+    """شماره کارگر هر آپدیت؛ همه آپدیت‌های یک چت به یک کارگر می‌رسند
+    
+    استثنا: /quickmatch و /cancel همیشه به یک کارگر ثابت می‌روند تا بازیکنان
+    همه چت‌ها در یک صف جفت شوند. بازی ساخته‌شده در backend مشترک است و
+    کلیک‌های بعدی هر چت را کارگر همان چت پردازش می‌کند. /cancel بازی معمولی
+    را هم کارگر صف از backend مشترک (آخرین بازی هر بازیکن) پیدا و حذف می‌کند.
+    """
+    text = (data.get("message") or {}).get("text") or ""
+    if text.startswith("/") and text.split(maxsplit=1)[0].split("@", 1)[0].lower() in QUICKMATCH_COMMANDS:
+        return QUICKMATCH_SHARD
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        key = chat["id"] if chat else (value.get("from") or {}).get("id", 0)
+        return key % shards
+    return 0
+
+def worker_port(index: int) -> int:
+    return PORT + 1 + index
+
+async def run_webhook_server(application: Application, host: str, port: int):
+    """دریافت آپدیت‌ها روی WEBHOOK_PATH و متریک‌ها روی /metrics
+    
+    در پردازه کارگر آپدیت‌ها از توزیع‌کننده می‌رسند و webhook تغییر نمی‌کند.
+    """
+    stop = _stop_event()
+    
+    async def receive(method: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+        if not webhook_authorized(headers):
+            return 403, "text/plain", b"forbidden"
+        await application.update_queue.put(Update.de_json(json.loads(body), application.bot))
+        return 200, "text/plain", b""
+    
+    async with application:
+        await post_init(application)
+        await application.start()
+        server = await serve_http(host, port, {WEBHOOK_PATH: receive, "/metrics": metrics_route})
+        boot_timer.mark("listen")
+        print(f"⏱️ آماده دریافت آپدیت: {boot_timer.summary()}")
+        await stop.wait()
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        await post_shutdown(application)
+
+async def run_dispatcher():
+    """توزیع‌کننده: webhook تلگرام را می‌گیرد و بر اساس chat_id به کارگرها می‌فرستد"""
+    # همه کارگرها باید یک وضعیت مشترک ببینند
+    backend = STATE_BACKEND or "sqlite:game_state.db"
+    workers = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            env={**os.environ, "WORKER_INDEX": str(i), "STATE_BACKEND": backend}
+        )
+        for i in range(WORKERS)
+    ]
+    client = httpx.AsyncClient(timeout=10)
+    
+    async def forward(method: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+        if not webhook_authorized(headers):
+            return 403, "text/plain", b"forbidden"
+        shard = update_shard(json.loads(body), WORKERS)
+        try:
+            response = await client.post(
+                f"http://127.0.0.1:{worker_port(shard)}{WEBHOOK_PATH}",
+                content=body,
+                headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+            )
+        except httpx.HTTPError as e:
+            # تلگرام آپدیت را دوباره می‌فرستد
+            logger.error(f"ارسال آپدیت به کارگر {shard} ممکن نشد: {e}")
+            return 503, "text/plain", b""
+        return response.status_code, "text/plain", b""
+    
+    def metrics_proxy(shard: int) -> HttpRoute:
+        async def route(method: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+            if not metrics_authorized(headers):
+                return 403, "text/plain", b"forbidden"
+            response = await client.get(
+                f"http://127.0.0.1:{worker_port(shard)}/metrics",
+                headers={"Authorization": headers["authorization"]}
+            )
+            return response.status_code, "text/plain; version=0.0.4", response.content
+        return route
+    
+    # متریک هر کارگر جداگانه روی /metrics/<شماره کارگر>
+    routes = {WEBHOOK_PATH: forward}
+    routes.update({f"/metrics/{i}": metrics_proxy(i) for i in range(WORKERS)})
+    stop = _stop_event()
+    server = await serve_http("0.0.0.0", PORT, routes)
+    async with Bot(TOKEN, base_url=BOT_API_URL or "https://api.telegram.org/bot") as bot:
+        await ensure_webhook(bot, f"{WEBHOOK_URL}{WEBHOOK_PATH}")
+    print(f"🔀 توزیع‌کننده با {WORKERS} کارگر روی پورت {PORT} آماده است")
+    
+    await stop.wait()
+    server.close()
+    await server.wait_closed()
+    await client.aclose()
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait()
+
 # ==================== اجرای ربات ====================
 
-def main():
-    """تابع اصلی برای اجرای ربات"""
-    # ایجاد برنامه ربات
-    application = Application.builder().token(TOKEN).post_init(post_init).build()
+def build_application(base_url: Optional[str] = None) -> Application:
+    """ساخت برنامه ربات با همه هندلرها؛ base_url برای Bot API ساختگی در تست بار"""
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .request(make_request("api", BOT_API_POOL_SIZE))
+        .get_updates_request(make_request("updates", GET_UPDATES_POOL_SIZE))
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+    )
+    base_url = base_url or BOT_API_URL
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     
     # اضافه کردن هندلرهای دستورات
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("newgame", new_game_command))
-    application.add_handler(CommandHandler("tictactoe", tictactoe_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("status", status_command))
-    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("start", timed("start")(start_command)))
+    application.add_handler(CommandHandler("newgame", timed("newgame")(new_game_command)))
+    application.add_handler(CommandHandler("tictactoe", timed("tictactoe")(tictactoe_command)))
+    application.add_handler(CommandHandler("vsbot", timed("vsbot")(vsbot_command)))
+    application.add_handler(CommandHandler("quickmatch", timed("quickmatch")(quickmatch_command)))
+    application.add_handler(CommandHandler("help", timed("help")(help_command)))
+    application.add_handler(CommandHandler("status", timed("status")(status_command)))
+    application.add_handler(CommandHandler("lobby", timed("lobby")(lobby_command)))
+    application.add_handler(CommandHandler("cancel", timed("cancel")(cancel_command)))
+    application.add_handler(CommandHandler("leaderboard", timed("leaderboard")(leaderboard_command)))
+    application.add_handler(CommandHandler("mystats", timed("mystats")(mystats_command)))
+    application.add_handler(CommandHandler("history", timed("history")(history_command)))
+    application.add_handler(CommandHandler("profile", timed("profile")(profile_command)))
+    application.add_handler(CommandHandler("memory", timed("memory")(memory_command)))
     
     # اضافه کردن هندلر callback
     application.add_handler(CallbackQueryHandler(callback_handler))
     
+    # حالت اینلاین (باید در BotFather با /setinline فعال شده باشد)
+    application.add_handler(InlineQueryHandler(timed("inline_query")(inline_query_handler)))
+    
     # اضافه کردن هندلر خطا
     application.add_error_handler(error_handler)
     
+    # پاکسازی دوره‌ای بازی‌های رهاشده
+    application.job_queue.run_repeating(
+        reap_games_job,
+        interval=REAPER_INTERVAL,
+        first=REAPER_INTERVAL
+    )
+    application.job_queue.run_once(warm_up_job, BOOT_WARMUP_DELAY)
+    return application
+
+def main():
+    """تابع اصلی برای اجرای ربات"""
+    if WEBHOOK_URL and WORKERS > 1 and WORKER_INDEX is None:
+        # این پردازه فقط توزیع‌کننده است و کارگرها را اجرا می‌کند
+        asyncio.run(run_dispatcher())
+        return
+    
+    boot_timer.mark("import")
+    application = build_application()
+    boot_timer.mark("build")
+    
+    # بازگردانی بازی‌های ذخیره‌شده
+    if GAME_DB_PATH:
+        started = time.perf_counter()
+        restored = game_manager.load()
+        game_manager.store.start()
+        print(f"💾 {restored} بازی در {time.perf_counter() - started:.2f} ثانیه بازیابی شد")
+        boot_timer.mark("restore")
+    
     print("🤖 ربات بازی دوز (Tic Tac Toe) در حال راه‌اندازی...")
     
-    if WEBHOOK_URL:
+    if WORKER_INDEX is not None:
+        # پردازه کارگر پشت توزیع‌کننده
+        print(f"👷 کارگر {WORKER_INDEX} روی پورت {worker_port(int(WORKER_INDEX))}")
+        asyncio.run(run_webhook_server(application, "127.0.0.1", worker_port(int(WORKER_INDEX))))
+    elif WEBHOOK_URL:
         # اجرا با webhook (برای رندر)
-        print("🌐 حالت Webhook فعال است")
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=TOKEN,
-            webhook_url=f"{WEBHOOK_URL}/{TOKEN}"
-        )
+        print("🌐 حالت Webhook فعال است (متریک‌ها روی /metrics)")
+        asyncio.run(run_webhook_server(application, "0.0.0.0", PORT))
     else:
         # اجرا با polling (برای توسعه)
         print("🔄 حالت Polling فعال است")
         application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["export-history"]:
+        # HISTORY_PATH=game_history.bin python HOKM.py export-history games.jsonl.gz
+        if not HISTORY_PATH:
+            sys.exit("❌ HISTORY_PATH تنظیم نشده است")
+        path = sys.argv[2] if len(sys.argv) > 2 else "game_history.jsonl.gz"
+        print(f"📜 {export_history(path)} بازی در {path} نوشته شد")
+    else:
+        main()
@@ -0,0 +1,1119 @@
+"""بنچمارک‌های ربات دوز
+
+اجرا:
+    python benchmarks.py            # همه بنچمارک‌ها
+    python benchmarks.py engine     # فقط یک بنچمارک
+"""
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ماژول اصلی بدون توکن اجرا نمی‌شود؛ برای بنچمارک یک توکن ساختگی کافی است
+os.environ.setdefault("TOKEN", "123456:BENCHMARK")
+
+import HOKM
+from HOKM import GameStatus, GameSymbol, Player, TicTacToeGame
+
+# یک بازی کامل که با برد ❌ تمام می‌شود (سطر، ستون)
+SAMPLE_MOVES = [(1, 1), (0, 0), (0, 2), (2, 0), (1, 0), (1, 2), (2, 1), (0, 1), (2, 2)]
+
+
+def _timeit(fn: Callable[[], None], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _measure_memory(factory: Callable[[], object], count: int) -> float:
+    """میانگین حافظه هر شیء بر حسب بایت"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory() for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return total / count
+
+
+# ==================== موتور بازی ====================
+
+class _LegacyGame:
+    """پیاده‌سازی قبلی (لیست دوبعدی از GameSymbol) برای مقایسه"""
+
+    def __init__(self, player1: Player, player2: Player):
+        self.board = [[GameSymbol.EMPTY] * 3 for _ in range(3)]
+        self.player1 = player1
+        self.player2 = player2
+        self.current_turn = player1
+        self.status = GameStatus.PLAYING
+        self.moves: List[Tuple[int, int, int]] = []
+
+    def make_move(self, player: Player, row: int, col: int) -> bool:
+        if self.status != GameStatus.PLAYING or player.user_id != self.current_turn.user_id:
+            return False
+        if not (0 <= row < 3 and 0 <= col < 3) or self.board[row][col] != GameSymbol.EMPTY:
+            return False
+        self.board[row][col] = player.symbol
+        self.moves.append((row, col, player.user_id))
+        winner = self.check_winner()
+        if winner:
+            self.status = GameStatus.X_WON if winner == GameSymbol.X else GameStatus.O_WON
+        elif self.is_board_full():
+            self.status = GameStatus.DRAW
+        else:
+            self.current_turn = self.player2 if self.current_turn is self.player1 else self.player1
+        return True
+
+    def check_winner(self) -> Optional[GameSymbol]:
+        b = self.board
+        for i in range(3):
+            if b[i][0] == b[i][1] == b[i][2] != GameSymbol.EMPTY:
+                return b[i][0]
+            if b[0][i] == b[1][i] == b[2][i] != GameSymbol.EMPTY:
+                return b[0][i]
+        if b[0][0] == b[1][1] == b[2][2] != GameSymbol.EMPTY:
+            return b[0][0]
+        if b[0][2] == b[1][1] == b[2][0] != GameSymbol.EMPTY:
+            return b[0][2]
+        return None
+
+    def is_board_full(self) -> bool:
+        return all(cell != GameSymbol.EMPTY for row in self.board for cell in row)
+
+
+def _players() -> Tuple[Player, Player]:
+    return (
+        Player(user_id=1, first_name="x", symbol=GameSymbol.X),
+        Player(user_id=2, first_name="o", symbol=GameSymbol.O),
+    )
+
+
+def _new_bitboard_game() -> TicTacToeGame:
+    p1, p2 = _players()
+    game = TicTacToeGame(game_id="bench", chat_id=1, player1=p1, player2=p2)
+    game.status = GameStatus.PLAYING
+    game.current_turn = p1
+    return game
+
+
+def _new_legacy_game() -> _LegacyGame:
+    return _LegacyGame(*_players())
+
+
+def _play_games(factory: Callable[[], object], games: int) -> Callable[[], None]:
+    def run():
+        for _ in range(games):
+            game = factory()
+            for row, col in SAMPLE_MOVES:
+                game.make_move(game.current_turn, row, col)
+    return run
+
+
+def bench_engine():
+    games = 20_000
+    moves = games * len(SAMPLE_MOVES)
+    results = {}
+    for name, factory in (("legacy", _new_legacy_game), ("bitboard", _new_bitboard_game)):
+        elapsed = _timeit(_play_games(factory, games))
+        memory = _measure_memory(factory, 10_000)
+        results[name] = (elapsed / moves * 1e9, memory)
+        print(f"  {name:<9} {results[name][0]:8.0f} ns/move   {memory:7.0f} B/game")
+    speedup = results["legacy"][0] / results["bitboard"][0]
+    print(f"  speedup   x{speedup:.2f}")
+
+
+# ==================== ایندکس چت‌ها ====================
+
+def _populate(manager: "HOKM.GameManager", games: int, chats: int):
+    """ساخت بازی و تقسیم آنها بین چت‌ها"""
+    for i in range(games):
+        p1, p2 = _players()
+        p1.user_id, p2.user_id = 2 * i + 1, 2 * i + 2
+        game = manager.create_game(i % chats, p1)
+        if i % 3 == 0:
+            manager.join_game(game, p2)
+
+
+def bench_chat_index():
+    games, chats = 100_000, 10_000
+    manager = HOKM.GameManager()
+    _populate(manager, games, chats)
+    queries = list(range(0, chats, chats // 200))
+
+    def scan():
+        for chat_id in queries:
+            [g for g in manager.games.values()
+             if g.chat_id == chat_id and g.status in (GameStatus.WAITING, GameStatus.PLAYING)]
+
+    def indexed():
+        for chat_id in queries:
+            manager.get_chat_games(chat_id)
+
+    scan_t = _timeit(scan, repeat=3) / len(queries)
+    index_t = _timeit(indexed) / len(queries)
+    print(f"  {games} games / {chats} chats")
+    print(f"  full scan {scan_t * 1e6:10.1f} us/status")
+    print(f"  indexed   {index_t * 1e6:10.1f} us/status   (x{scan_t / index_t:.0f})")
+
+
+# ==================== ذخیره‌سازی ====================
+
+def _fill_store(store: "HOKM.SQLiteGameStore", games: int):
+    """یک‌سوم در انتظار، یک‌سوم در حال بازی (با لاگ حرکت)، یک‌سوم تمام‌شده"""
+    for i in range(games):
+        p1, p2 = _players()
+        p1.user_id, p2.user_id = 2 * i + 1, 2 * i + 2
+        game = TicTacToeGame(game_id=f"bench_{i}", chat_id=i % 10_000, message_id=i, player1=p1)
+        store.record_game(game)
+        if i % 3 == 0:
+            continue
+        game.player2 = p2
+        game.status = GameStatus.PLAYING
+        game.current_turn = p1
+        store.record_game(game)
+        moves = SAMPLE_MOVES[:4] if i % 3 == 1 else SAMPLE_MOVES
+        for row, col in moves:
+            player = game.current_turn
+            game.make_move(player, row, col)
+            store.record_move(game, row, col, player.user_id)
+        if game.status != GameStatus.PLAYING:
+            store.record_game(game)
+
+
+def bench_store():
+    games = 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "games.db")
+        store = HOKM.SQLiteGameStore(path)
+        _fill_store(store, games)
+        events = store._queue.qsize()
+        game = _new_bitboard_game()
+        game.moves.append((0, 0, 1))
+        enqueue = _timeit(lambda: [store.record_move(game, 0, 0, 1) for _ in range(100_000)], repeat=1)
+        start = time.perf_counter()
+        store.close()
+        flush = time.perf_counter() - start
+        events += 100_000
+        print(f"  record    {enqueue / 100_000 * 1e9:8.0f} ns/move   (hot path)")
+        print(f"  flush     {flush:8.2f} s          ({events / flush:,.0f} events/s)")
+
+        start = time.perf_counter()
+        manager = HOKM.GameManager(max_games=games, store=HOKM.SQLiteGameStore(path))
+        restored = manager.load()
+        boot = time.perf_counter() - start
+        playing = sum(1 for g in manager.games.values() if g.status == GameStatus.PLAYING)
+        print(f"  boot      {boot:8.2f} s          ({restored} games, {playing} playing)")
+
+
+# ==================== callback_data ====================
+
+def _legacy_parse(data: str):
+    parts = data.split("_")
+    if parts[0] == "new" and len(parts) >= 2:
+        return "new", parts[1]
+    elif parts[0] == "join" and len(parts) >= 2:
+        return "join", parts[1]
+    elif parts[0] == "move" and len(parts) >= 4:
+        return "move", parts[1], int(parts[2]), int(parts[3])
+    elif parts[0] == "delete" and len(parts) >= 2:
+        return "delete", parts[1]
+    elif parts[0] == "none":
+        return "none",
+
+
+def bench_callback_codec():
+    count = 200_000
+    game_id = HOKM.new_game_id()
+    actions = list(HOKM.CallbackAction)
+    encoded = [HOKM.encode_callback(actions[i % len(actions)], game_id, i % 9) for i in range(1000)]
+    legacy = [f"move_ttt_-100123456789_1700000000_{i % 3}_{i % 3}" for i in range(1000)]
+    table = {action: (lambda *args: None) for action in actions}
+    print(f"  max length {max(len(d) for d in encoded)} chars (legacy {len(legacy[0])})")
+
+    def run_legacy():
+        for _ in range(count // 1000):
+            for data in legacy:
+                _legacy_parse(data)
+
+    def run_codec():
+        decode = HOKM.decode_callback
+        for _ in range(count // 1000):
+            for data in encoded:
+                action, gid, arg = decode(data)
+                table[action](gid, arg)
+
+    def run_encode():
+        encode = HOKM.encode_callback
+        for i in range(count):
+            encode(HOKM.CallbackAction.MOVE, game_id, i % 9)
+
+    for name, fn in (("legacy", run_legacy), ("dispatch", run_codec), ("encode", run_encode)):
+        elapsed = _timeit(fn, repeat=3)
+        print(f"  {name:<9} {count / elapsed:12,.0f} ops/s")
+
+
+# ==================== رندر ====================
+
+def bench_render():
+    games = 2000
+    manager = HOKM.GameManager(max_games=games)
+    played = []
+    for i in range(games):
+        p1, p2 = _players()
+        game = manager.create_game(i, p1)
+        manager.join_game(game, p2)
+        game.current_turn = game.player1
+        played.append(game)
+
+    def run():
+        for game in played:
+            game.x_bits = game.o_bits = 0
+            game.status = GameStatus.PLAYING
+            game.current_turn = game.player1
+            game.moves.clear()
+            # یک رندر برای هر تغییر وضعیت، مثل مسیر واقعی بعد از هر حرکت
+            for row, col in SAMPLE_MOVES:
+                game.make_move(game.current_turn, row, col)
+                game.get_board_keyboard()
+                game.get_game_info_text()
+
+    labels = HOKM.board_labels
+    renders = games * len(SAMPLE_MOVES)
+    try:
+        HOKM.board_labels = labels.__wrapped__
+        uncached_t = _timeit(run, repeat=3)
+    finally:
+        HOKM.board_labels = labels
+    labels.cache_clear()
+    cached_t = _timeit(run, repeat=1)
+    print(f"  uncached  {uncached_t / renders * 1e6:8.1f} us/render")
+    print(f"  cached    {cached_t / renders * 1e6:8.1f} us/render   (x{uncached_t / cached_t:.1f})")
+    # رندر دوباره وضعیتی که تغییر نکرده (مثل پیام نهایی هنگام پاکسازی) از کش خود بازی
+    repeat_t = _timeit(lambda: [(game.get_board_keyboard(), game.get_game_info_text()) for game in played], repeat=3)
+    print(f"  repeat    {repeat_t / games * 1e6:8.1f} us/render   (x{uncached_t / renders / (repeat_t / games):.0f})")
+    for name, stats in HOKM.render_cache_stats().items():
+        print(f"  {name:<9} hit rate {stats['hit_rate']:6.1%}   size {stats['size']}")
+
+
+# ==================== صف ویرایش ====================
+
+class _FakeEditBot:
+    """شبیه‌سازی editMessageText با تاخیر شبکه و خطای 429 در بار زیاد"""
+
+    def __init__(self, latency: float = 0.02, chat_limit: int = 3):
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.calls = 0
+        self.flood_errors = 0
+        self._recent: Dict[int, List[float]] = {}
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.calls += 1
+        now = time.monotonic()
+        recent = [t for t in self._recent.get(chat_id, []) if now - t < 1.0]
+        recent.append(now)
+        self._recent[chat_id] = recent
+        await asyncio.sleep(self.latency)
+        if len(recent) > self.chat_limit:
+            self.flood_errors += 1
+            raise HOKM.RetryAfter(1)
+
+
+async def _click_storm(submit, chats: int, clicks: int, duration: float):
+    rng = random.Random(1)
+    for i in range(clicks):
+        chat_id = rng.randrange(chats)
+        # بیشتر کلیک‌ها وضعیت را تغییر می‌دهند، بقیه تکراری‌اند
+        state = i // 3 if rng.random() < 0.7 else 0
+        submit(chat_id, 1, f"state {chat_id} {state}")
+        await asyncio.sleep(duration / clicks)
+
+
+async def _run_edit_bench(chats: int, clicks: int, duration: float):
+    naive_bot = _FakeEditBot()
+
+    def naive_submit(chat_id, message_id, text):
+        async def edit():
+            try:
+                await naive_bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+            except HOKM.RetryAfter:
+                pass
+        asyncio.create_task(edit())
+
+    await _click_storm(naive_submit, chats, clicks, duration)
+    await asyncio.sleep(naive_bot.latency * 2)
+
+    bot = _FakeEditBot()
+    scheduler = HOKM.EditScheduler()
+    scheduler.start(bot)
+    await _click_storm(scheduler.submit, chats, clicks, duration)
+    while scheduler.stats()["queue_depth"] or scheduler.stats()["in_flight"]:
+        await asyncio.sleep(0.05)
+    await scheduler.stop()
+    return naive_bot, bot, scheduler.stats()
+
+
+def bench_edit_scheduler():
+    chats, clicks, duration = 20, 2000, 2.0
+    naive, bot, stats = asyncio.run(_run_edit_bench(chats, clicks, duration))
+    print(f"  {clicks} clicks in {duration:.0f}s over {chats} chats")
+    print(f"  direct    {naive.calls:6d} API calls   {naive.flood_errors:5d} x 429")
+    print(f"  scheduler {bot.calls:6d} API calls   {bot.flood_errors:5d} x 429")
+    print(f"  coalesced {stats['coalesced']:6d}   skipped unchanged {stats['skipped_unchanged']}")
+    print(f"  latency   avg {stats['latency_avg'] * 1000:.0f} ms   max {stats['latency_max'] * 1000:.0f} ms")
+
+
+# ==================== پردازش هم‌زمان ====================
+
+def _fake_callback(user_id: int, chat_id: int, message_id: int, data: str, rtt: float):
+    async def answer(*args, **kwargs):
+        await asyncio.sleep(rtt)
+    query = SimpleNamespace(
+        data=data,
+        answer=answer,
+        message=SimpleNamespace(chat_id=chat_id, message_id=message_id),
+        inline_message_id=None,
+    )
+    user = SimpleNamespace(id=user_id, username="", first_name=f"u{user_id}")
+    return SimpleNamespace(callback_query=query, effective_user=user)
+
+
+async def _run_concurrent(concurrency: int, games: int, clicks_per_game: int, rtt: float) -> Tuple[float, Counter]:
+    """کلیک‌ها از مسیر کامل Application (صف هم‌زمانی concurrent_updates) به Bot API ساختگی"""
+    import loadtest
+
+    manager = HOKM.game_manager = HOKM.GameManager(max_games=games)
+    HOKM.click_admission = HOKM.ClickAdmission()
+    HOKM.MAX_CONCURRENT_UPDATES = concurrency
+    api = loadtest.FakeBotAPI(HOKM.TOKEN, rtt)
+    server = await HOKM.serve_http("127.0.0.1", 0, api.routes())
+    port = server.sockets[0].getsockname()[1]
+    application = HOKM.build_application(base_url=f"http://127.0.0.1:{port}/bot")
+    test = loadtest.LoadTest(application, api, SimpleNamespace(seed=concurrency))
+    rng = random.Random(concurrency)
+    clicks = []
+    for i in range(games):
+        chat_id = -1_000_000 - i
+        p1, p2 = Player(2 * i + 1), Player(2 * i + 2)
+        game = manager.create_game(chat_id, p1)
+        manager.join_game(game, p2)
+        message = api.send_message({
+            "chat_id": str(chat_id),
+            "text": game.get_game_info_text(),
+            "reply_markup": json.dumps(game.get_board_keyboard().to_dict()),
+        })
+        manager.set_message_id(game, message["message_id"])
+        for _ in range(clicks_per_game):
+            user = rng.choice((p1, p2)).user_id
+            data = HOKM.encode_callback(HOKM.CallbackAction.MOVE, game.game_id, rng.randrange(9))
+            # دوبار کلیک پشت سر هم همان خانه
+            clicks.extend([((chat_id, message["message_id"]), user, data)] * 2)
+    rng.shuffle(clicks)
+
+    try:
+        async with application:
+            await HOKM.post_init(application)
+            start = time.perf_counter()
+            await asyncio.gather(*(test.click(*click) for click in clicks))
+            elapsed = time.perf_counter() - start
+            # ویرایش‌های در جریان تمام شوند تا سرور ساختگی وسط پاسخ بسته نشود
+            while HOKM.edit_scheduler.stats()["in_flight"]:
+                await asyncio.sleep(0.01)
+            await HOKM.post_shutdown(application)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    # هیچ حرکتی دوبار اعمال نشده باشد
+    for game in manager.games.values():
+        cells = [row * 3 + col for row, col, _ in game.moves]
+        assert len(cells) == len(set(cells)) == bin(game.x_bits | game.o_bits).count("1")
+        users = [user_id for _, _, user_id in game.moves]
+        assert all(a != b for a, b in zip(users, users[1:]))
+    return len(clicks) / elapsed, HOKM.click_admission.counters
+
+
+def bench_concurrency():
+    games, clicks, rtt = 100, 5, 0.01
+    saved = HOKM.game_manager, HOKM.click_admission, HOKM.MAX_CONCURRENT_UPDATES
+    try:
+        print(f"  {games * clicks * 2} callbacks, {rtt * 1000:.0f} ms Bot API round trip")
+        for concurrency in (1, 4, 16, 64, 256):
+            rate, admission = asyncio.run(_run_concurrent(concurrency, games, clicks, rtt))
+            rejected = admission["duplicate"] + admission["rate_limited"]
+            print(f"  concurrent_updates {concurrency:>4}  {rate:10,.0f} updates/s   rejected at admission {rejected}")
+    finally:
+        HOKM.game_manager, HOKM.click_admission, HOKM.MAX_CONCURRENT_UPDATES = saved
+
+
+# ==================== طوفان کلیک ====================
+
+async def _run_click_storm(admission, games: int, taps: int, spam: int, rtt: float) -> dict:
+    HOKM.click_admission = admission
+    manager = HOKM.game_manager = HOKM.GameManager(max_games=games)
+    bursts = []
+    for i in range(games):
+        p1, p2 = Player(2 * i + 1), Player(2 * i + 2)
+        game = manager.create_game(i, p1)
+        manager.join_game(game, p2)
+        game.message_id = 1
+        data = HOKM.encode_callback(HOKM.CallbackAction.MOVE, game.game_id, 4)
+        # بازیکن بی‌حوصله همان خانه را پشت سر هم می‌زند و یک ربات اسپم هر دکمه‌ای را
+        bursts.append([_fake_callback(game.current_turn.user_id, i, 1, data, rtt)] * taps)
+        bursts.append([
+            _fake_callback(10_000_000 + i, i, 1, HOKM.encode_callback(HOKM.CallbackAction.MOVE, game.game_id, cell), rtt)
+            for _ in range(spam // 9) for cell in range(9)
+        ])
+    # کلیک‌های هر نفر پشت سر هم می‌رسند؛ فقط ترتیب رگبارها به هم ریخته است
+    random.Random(1).shuffle(bursts)
+    updates = [update for burst in bursts for update in burst]
+
+    runs = Counter()
+    move = HOKM.CALLBACK_HANDLERS[HOKM.CallbackAction.MOVE]
+
+    async def counted(*args):
+        runs["handler"] += 1
+        return await move(*args)
+
+    HOKM.CALLBACK_HANDLERS[HOKM.CallbackAction.MOVE] = counted
+    submitted = HOKM.edit_scheduler.counters["submitted"]
+    limit = asyncio.Semaphore(64)
+
+    async def process(update):
+        async with limit:
+            await HOKM.callback_handler(update, None)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(process(u) for u in updates))
+        elapsed = time.perf_counter() - start
+    finally:
+        HOKM.CALLBACK_HANDLERS[HOKM.CallbackAction.MOVE] = move
+    assert all(len(game.moves) == 1 for game in manager.games.values())
+    return {
+        "updates": len(updates),
+        "handler": runs["handler"],
+        "edits": HOKM.edit_scheduler.counters["submitted"] - submitted,
+        "elapsed": elapsed,
+        **admission.counters,
+    }
+
+
+def bench_click_storm():
+    games, taps, spam, rtt = 200, 20, 90, 0.01
+    saved = HOKM.game_manager, HOKM.click_admission
+    try:
+        print(f"  {games} games: current player taps one cell x{taps}, a spammer taps every cell x{spam // 9}")
+        for label, admission in (
+            ("no admission", HOKM.ClickAdmission(rate=0, dedupe=False)),
+            ("dedupe only", HOKM.ClickAdmission(rate=0)),
+            ("dedupe + bucket", HOKM.ClickAdmission()),
+        ):
+            r = asyncio.run(_run_click_storm(admission, games, taps, spam, rtt))
+            print(f"  {label:<16} {r['updates']:6} updates  {r['handler']:6} handler runs  "
+                  f"{r['edits']:4} edits  {r['elapsed'] * 1000:6.0f} ms  "
+                  f"(duplicate {r.get('duplicate', 0)}, rate limited {r.get('rate_limited', 0)})")
+    finally:
+        HOKM.game_manager, HOKM.click_admission = saved
+
+
+# ==================== حریف ربات ====================
+
+def bench_bot_table():
+    start = time.perf_counter()
+    table = HOKM.SolvedTable.solve()
+    solve_t = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "solved.bin")
+        HOKM.SolvedTable.load(path)
+        load_t = _timeit(lambda: HOKM.SolvedTable.load(path), repeat=20)
+        size = os.path.getsize(path)
+    rng = random.Random(7)
+    # وضعیت‌های واقعی از بازی‌های تصادفی
+    positions = []
+    for _ in range(2000):
+        mine = theirs = 0
+        for _ in range(rng.randrange(8)):
+            free = [c for c in range(9) if not (mine | theirs) >> c & 1]
+            mine, theirs = theirs, mine | (1 << rng.choice(free))
+        positions.append((mine, theirs))
+    lookups = len(positions) * 100
+
+    def run():
+        for _ in range(100):
+            for mine, theirs in positions:
+                table.best_move(mine, theirs)
+
+    lookup_t = _timeit(run, repeat=3)
+    states = sum(1 for move in table.moves if move != table.NO_MOVE)
+    print(f"  solve     {solve_t * 1000:8.1f} ms   ({states} positions with a move)")
+    print(f"  load      {load_t * 1000:8.3f} ms   ({size} bytes)")
+    print(f"  lookup    {lookup_t / lookups * 1e9:8.0f} ns/move")
+
+
+# ==================== اندازه صفحه ====================
+
+def _random_games(size: int, count: int, rng: random.Random) -> List[List[Tuple[int, int]]]:
+    games = []
+    for _ in range(count):
+        cells = list(range(size * size))
+        rng.shuffle(cells)
+        games.append([divmod(cell, size) for cell in cells])
+    return games
+
+
+def bench_board_sizes():
+    rng = random.Random(3)
+    print(f"  {'board':<10} {'incremental':>14} {'full rescan':>14}")
+    for size in range(HOKM.MIN_BOARD_SIZE, HOKM.MAX_BOARD_SIZE + 1):
+        win_length = HOKM.default_win_length(size)
+        sequences = _random_games(size, 300, rng)
+        p1, p2 = _players()
+
+        def play(full_rescan: bool):
+            moves = 0
+            for sequence in sequences:
+                game = TicTacToeGame(game_id="bench", chat_id=1, player1=p1, player2=p2,
+                                     size=size, win_length=win_length)
+                game.status = GameStatus.PLAYING
+                game.current_turn = p1
+                for row, col in sequence:
+                    if game.status != GameStatus.PLAYING:
+                        break
+                    game.make_move(game.current_turn, row, col)
+                    if full_rescan:
+                        game.check_winner()
+                    moves += 1
+            return moves
+
+        moves = play(False)
+        incremental = _timeit(lambda: play(False), repeat=3) / moves
+        # هزینه اسکن کامل = حرکت + بررسی همه خطوط
+        rescan = _timeit(lambda: play(True), repeat=3) / moves
+        label = f"{size}x{size} k={win_length}"
+        print(f"  {label:<10} {incremental * 1e9:11.0f} ns {rescan * 1e9:11.0f} ns")
+
+
+# ==================== وضعیت مشترک چند پردازه‌ای ====================
+
+def _cas_worker(path: str, game_ids: List[str], start, results):
+    """همه کارگرها هم‌زمان روی اولین خانه خالی همان بازی کلیک می‌کنند"""
+    manager = HOKM.GameManager(backend=HOKM.SQLiteStateBackend(path))
+    attempts = applied = 0
+    start.wait()
+    begin = time.perf_counter()
+    for game_id in game_ids:
+        while True:
+            game = manager.get_game(game_id)
+            if game is None or game.status != GameStatus.PLAYING:
+                break
+            occupied = game.x_bits | game.o_bits
+            cell = next(c for c in range(game.size * game.size) if not occupied >> c & 1)
+            attempts += 1
+            if manager.make_move(game, game.current_turn, *divmod(cell, game.size)):
+                applied += 1
+    results.put((attempts, applied, time.perf_counter() - begin))
+
+
+def bench_shared_backend():
+    processes, games, size = 4, 40, 6
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        manager = HOKM.GameManager(backend=HOKM.SQLiteStateBackend(path))
+        game_ids = []
+        for i in range(games):
+            game = manager.create_game(i, Player(2 * i + 1), size, 4)
+            manager.join_game(game, Player(2 * i + 2))
+            game_ids.append(game.game_id)
+
+        start, results = ctx.Event(), ctx.Queue()
+        workers = [ctx.Process(target=_cas_worker, args=(path, game_ids, start, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        counts = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        attempts = sum(a for a, _, _ in counts)
+        applied = sum(b for _, b, _ in counts)
+        elapsed = max(t for _, _, t in counts)
+        stored_moves = 0
+        for game_id in game_ids:
+            game = manager.get_game(game_id)
+            cells = [row * size + col for row, col, _ in game.moves]
+            assert len(cells) == len(set(cells)) == bin(game.x_bits | game.o_bits).count("1")
+            users = [user_id for _, _, user_id in game.moves]
+            assert all(a != b for a, b in zip(users, users[1:]))
+            stored_moves += len(game.moves)
+        # هر حرکت موفق دقیقا یک بار در وضعیت نهایی آمده است
+        assert applied == stored_moves, (applied, stored_moves)
+        print(f"  {processes} processes racing on {games} {size}x{size} games")
+        print(f"  attempts  {attempts:6d}   applied {applied}   rejected by CAS {attempts - applied}")
+        print(f"  no double-applied moves; {attempts / elapsed:,.0f} CAS attempts/s")
+
+    # پاکسازی یا سقف حافظه کارگری که کپی قدیمی دارد نباید بازی در حال اجرای کارگر دیگر را حذف کند
+    backend = HOKM.InMemoryStateBackend()
+    playing = HOKM.GameManager(backend=backend)
+    reaper, capped = HOKM.GameManager(backend=backend), HOKM.GameManager(backend=backend, max_games=1)
+    game = playing.create_game(1, Player(1))
+    playing.join_game(game, Player(2))
+    reaper.get_game(game.game_id)
+    capped.get_game(game.game_id)
+    for row, col in SAMPLE_MOVES[:3]:
+        playing.make_move(game, game.current_turn, row, col)
+    assert not reaper.reap(time.monotonic() + HOKM.GAME_TTL_PLAYING + 1)
+    capped.create_game(2, Player(3))
+    assert playing.get_game(game.game_id) is not None
+    print(f"  stale caches keep the shared game: reaper {dict(reaper.reaper_stats)}, cap {dict(capped.reaper_stats)}")
+
+    state = HOKM.game_to_state(_new_bitboard_game())
+    backend.compare_and_set("g", 0, state)
+    count = 100_000
+    elapsed = _timeit(lambda: [backend.compare_and_set("g", backend.get("g")[0], state)
+                               for _ in range(count)], repeat=1)
+    print(f"  memory backend {count / elapsed:12,.0f} CAS/s")
+
+
+# ==================== متریک‌ها ====================
+
+def bench_metrics():
+    """هزینه ثبت متریک روی مسیر داغ و زمان ساخت خروجی /metrics"""
+    count = 200_000
+
+    async def handler():
+        return None
+
+    plain = handler
+    wrapped = HOKM.timed("bench")(handler)
+
+    async def drive(fn):
+        for _ in range(count):
+            await fn()
+
+    base_t = _timeit(lambda: asyncio.run(drive(plain)), repeat=3)
+    timed_t = _timeit(lambda: asyncio.run(drive(wrapped)), repeat=3)
+    print(f"  handler overhead {(timed_t - base_t) / count * 1e9:8.0f} ns/update")
+
+    labels = (("method", "editMessageText"),)
+    observe_t = _timeit(lambda: [HOKM.metrics.observe("bench_seconds", labels, 0.03) for _ in range(count)], repeat=3)
+    print(f"  observe          {observe_t / count * 1e9:8.0f} ns/call")
+
+    for i in range(10_000):
+        p1, p2 = _players()
+        game = HOKM.game_manager.create_game(i, p1)
+        if i % 2:
+            HOKM.game_manager.join_game(game, p2)
+    render_t = _timeit(HOKM.metrics.render, repeat=3)
+    text = HOKM.metrics.render()
+    print(f"  scrape           {render_t * 1e3:8.2f} ms   ({len(text.splitlines())} lines, 10,000 games)")
+
+
+# ==================== جدول امتیازات ====================
+
+def bench_leaderboard():
+    players, results, chats = 100_000, 300_000, 1000
+    rng = random.Random(5)
+    boards = HOKM.Leaderboards()
+    people = [Player(i + 1, None, f"u{i + 1}") for i in range(players)]
+    games = []
+    for _ in range(results):
+        p1, p2 = rng.sample(people, 2)
+        game = TicTacToeGame(game_id="", chat_id=-rng.randrange(1, chats + 1), player1=p1, player2=p2)
+        game.status = rng.choice((GameStatus.X_WON, GameStatus.O_WON, GameStatus.DRAW))
+        games.append(game)
+
+    start = time.perf_counter()
+    for game in games:
+        boards.record(game)
+    elapsed = time.perf_counter() - start
+    board = boards.board(HOKM.GLOBAL_LEADERBOARD)
+    print(f"  record     {results / elapsed:12,.0f} results/s   ({results:,} results, {len(board):,} players)")
+
+    ids = [p.user_id for p in rng.sample(people, 10_000)]
+    elapsed = _timeit(lambda: [board.rank(user_id) for user_id in ids], repeat=3)
+    print(f"  rank       {elapsed / len(ids) * 1e9:12,.0f} ns/query")
+    elapsed = _timeit(lambda: [board.top() for _ in range(10_000)], repeat=3)
+    print(f"  top-{HOKM.LEADERBOARD_SIZE:<5} {elapsed / 10_000 * 1e9:12,.0f} ns/query")
+
+    # دو کارگر نتیجه‌ها را به نوبت در یک فایل مشترک ثبت می‌کنند؛ جدول باید همان جدول یک پردازه باشد
+    shared_results = 20_000
+    reference = HOKM.Leaderboards()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        workers = [HOKM.SQLiteStateBackend(path).leaderboards() for _ in range(2)]
+        start = time.perf_counter()
+        for i, game in enumerate(games[:shared_results]):
+            workers[i % 2].record(game)
+        elapsed = time.perf_counter() - start
+        for game in games[:shared_results]:
+            reference.record(game)
+        expected = reference.board(HOKM.GLOBAL_LEADERBOARD)
+        shared = workers[1].board(HOKM.GLOBAL_LEADERBOARD)
+        assert len(shared) == len(expected)
+        assert [s.user_id for s in shared.top(100)] == [s.user_id for s in expected.top(100)]
+        for user_id in ids[:1000]:
+            got, want = shared.get(user_id), expected.get(user_id)
+            assert (got is None) == (want is None)
+            if want is not None:
+                assert abs(got.rating - want.rating) < 1e-9 and got.games == want.games
+                assert shared.rank(user_id) == expected.rank(user_id)
+        print(f"  shared     {shared_results / elapsed:12,.0f} results/s   (2 workers, one SQLite file; matches one process)")
+        elapsed = _timeit(lambda: [shared.rank(user_id) for user_id in ids[:1000]], repeat=3)
+        print(f"  rank       {elapsed / 1000 * 1e9:12,.0f} ns/query (shared)")
+        elapsed = _timeit(lambda: [shared.top() for _ in range(1000)], repeat=3)
+        print(f"  top-{HOKM.LEADERBOARD_SIZE:<5} {elapsed / 1000 * 1e9:12,.0f} ns/query (shared)")
+
+
+# ==================== آرشیو بازی‌ها ====================
+
+def bench_history():
+    games, users = 100_000, 5000
+    rng = random.Random(6)
+    finished = []
+    for _ in range(2000):
+        a, b = rng.sample(range(1, users + 1), 2)
+        game = TicTacToeGame(
+            game_id=HOKM.new_game_id(), chat_id=-rng.randrange(1, 100),
+            player1=Player(a, None, f"player{a}", GameSymbol.X), player2=Player(b, None, f"player{b}", GameSymbol.O),
+        )
+        game.status = GameStatus.PLAYING
+        game.current_turn = game.player1
+        for row, col in SAMPLE_MOVES:
+            game.make_move(game.current_turn, row, col)
+        finished.append(game)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.bin")
+        archive = HOKM.GameArchive(path)
+        archive.open()
+        start = time.perf_counter()
+        for i in range(games):
+            archive.append(finished[i % len(finished)])
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+        archive.close()
+        print(f"  append     {games / elapsed:12,.0f} games/s   {size / games:.1f} bytes/game")
+
+        reopened = HOKM.GameArchive(path)
+        start = time.perf_counter()
+        reopened.open()
+        print(f"  index      {(time.perf_counter() - start) * 1000:12.1f} ms        ({reopened.records:,} records)")
+
+        owner = finished[0].player1.user_id
+        page, cursor = reopened.user_page(owner)
+        elapsed = _timeit(lambda: reopened.user_page(owner, cursor), repeat=3)
+        print(f"  page       {elapsed * 1e6:12.1f} us")
+
+        for name, opener in (("jsonl", open), ("jsonl.gz", gzip.open)):
+            out_path = os.path.join(tmp, f"export.{name}")
+            start = time.perf_counter()
+            with opener(out_path, "wt", encoding="utf-8") as out:
+                reopened.export(out)
+            elapsed = time.perf_counter() - start
+            # حافظه جداگانه اندازه‌گیری می‌شود چون tracemalloc خروجی را چند برابر کند می‌کند
+            tracemalloc.start()
+            with opener(out_path, "wt", encoding="utf-8") as out:
+                reopened.export(out)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  export {name:<9} {games / elapsed:8,.0f} games/s   "
+                  f"{os.path.getsize(out_path) / games:6.1f} bytes/game   peak {peak / 1024:,.0f} KiB")
+        reopened.close()
+
+
+# ==================== صف بازی سریع ====================
+
+def bench_quickmatch():
+    waiting = 50_000
+    rng = random.Random(7)
+    queue = HOKM.MatchQueue(bucket_width=200)
+    # هر نفر در بازه‌ای دور از بقیه تا هیچ‌کس با هم جفت نشود و همه در صف بمانند
+    width = queue.bucket_width
+    entries = [
+        HOKM.QueuedPlayer(Player(i + 1), chat_id=i + 1, rating=3 * i * width + rng.random() * width)
+        for i in range(waiting)
+    ]
+    start = time.perf_counter()
+    for entry in entries:
+        queue.match(entry)
+    elapsed = time.perf_counter() - start
+    print(f"  enqueue    {elapsed / waiting * 1e9:8.0f} ns/player   ({len(queue):,} waiting)")
+
+    arrivals = [
+        HOKM.QueuedPlayer(Player(waiting + i + 1), chat_id=0, rating=entry.rating)
+        for i, entry in enumerate(entries)
+    ]
+    start = time.perf_counter()
+    for entry in arrivals:
+        assert queue.match(entry) is not None
+    elapsed = time.perf_counter() - start
+    print(f"  match      {elapsed / waiting * 1e9:8.0f} ns/pair     ({len(queue):,} waiting)")
+
+    for entry in entries:
+        queue.match(entry)
+    start = time.perf_counter()
+    for entry in entries:
+        queue.remove(entry.player.user_id)
+    elapsed = time.perf_counter() - start
+    print(f"  remove     {elapsed / waiting * 1e9:8.0f} ns/player")
+
+
+# ==================== حالت اینلاین ====================
+
+def bench_inline():
+    # هر حرف تایپ‌شده یک درخواست اینلاین جداست: «»، «5»، «5 »، «5 4»
+    keystrokes = ["", "5", "5 ", "5 4", "5 4x", "4", "3", "8 5"] * 5_000
+
+    def answer(text: str):
+        args = text.split()
+        return HOKM.inline_results(HOKM.parse_board_args(args) if args else None)
+
+    start = time.perf_counter()
+    for text in keystrokes:
+        HOKM.inline_results.cache_clear()
+        answer(text)
+    cold = (time.perf_counter() - start) / len(keystrokes)
+
+    HOKM.inline_results.cache_clear()
+    start = time.perf_counter()
+    for text in keystrokes:
+        answer(text)
+    cached = (time.perf_counter() - start) / len(keystrokes)
+    info = HOKM.inline_results.cache_info()
+    print(f"  build per query   {cold * 1e6:8.2f} us")
+    print(f"  cached per query  {cached * 1e6:8.2f} us   ({cold / cached:.0f}x, "
+          f"{info.misses} distinct cards for {len(keystrokes):,} queries)")
+
+
+# ==================== شروع سرد ====================
+
+def _command_update(chat_id: int, text: str) -> bytes:
+    return json.dumps({
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }).encode()
+
+
+async def _cold_start(api, env: Dict[str, str], port: int) -> Tuple[float, float, str]:
+    """اجرای HOKM.py در پردازه تازه؛ زمان تا باز شدن پورت و تا پاسخ به اولین /start"""
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, HOKM.__file__, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            break
+        except OSError:
+            await asyncio.sleep(0.002)
+    ready = time.perf_counter() - start
+
+    version = api.versions[(1, 0)]
+    body = _command_update(1, "/start")
+    writer.write(
+        f"POST {HOKM.WEBHOOK_PATH} HTTP/1.1\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {HOKM.WEBHOOK_SECRET}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    assert await api.wait_change((1, 0), version, timeout=30)
+    first_update = time.perf_counter() - start
+    writer.close()
+
+    proc.terminate()
+    output, _ = await proc.communicate()
+    summary = next(
+        (line.split(":", 1)[1].strip() for line in output.decode().splitlines() if line.startswith("🚀")), ""
+    )
+    return ready, first_update, summary
+
+
+def bench_cold_start():
+    import loadtest
+
+    async def run():
+        api = loadtest.FakeBotAPI(HOKM.TOKEN)
+        server = await HOKM.serve_http("127.0.0.1", 0, api.routes())
+        api_port = server.sockets[0].getsockname()[1]
+        # پورت آزاد برای پردازه ربات
+        probe = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = probe.sockets[0].getsockname()[1]
+        probe.close()
+        await probe.wait_closed()
+        tmp = tempfile.mkdtemp(prefix="ttt-coldstart-")
+        env = {
+            **os.environ,
+            "TOKEN": HOKM.TOKEN,
+            "PORT": str(port),
+            "WEBHOOK_URL": "https://bench.invalid",
+            "BOT_API_URL": f"http://127.0.0.1:{api_port}/bot",
+            "HISTORY_PATH": os.path.join(tmp, "history.bin"),
+            "BOT_TABLE_PATH": os.path.join(tmp, "ttt_solved.bin"),
+            "GAME_DB_PATH": "",
+            "PYTHONUNBUFFERED": "1",
+        }
+        env.pop("WORKER_INDEX", None)
+        env["WORKERS"] = "1"
+        try:
+            for label in ("webhook unset", "webhook already set", "webhook already set"):
+                calls = api.calls.copy()
+                ready, first_update, summary = await _cold_start(api, env, port)
+                print(f"  {label:<20} listening {ready * 1000:6.0f} ms   first update {first_update * 1000:6.0f} ms   "
+                      f"getWebhookInfo {api.calls['getWebhookInfo'] - calls['getWebhookInfo']} "
+                      f"setWebhook {api.calls['setWebhook'] - calls['setWebhook']}")
+                print(f"    {summary}")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def bench_http_pool():
+    # اندازه استخر هنگام import خوانده می‌شود؛ هر اندازه در پردازه جداگانه اجرا می‌شود
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest.py")
+    for pool_size in (4, 16, 64, 256):
+        proc = subprocess.run(
+            [sys.executable, script, "--games", "200", "--api-latency", "0.02",
+             "--pool-size", str(pool_size), "--json"],
+            capture_output=True, text=True,
+        )
+        report = json.loads(proc.stdout.strip().splitlines()[-1])
+        pool = report["bot_api_pools"]["api"]
+        print(f"  pool {pool_size:4}   {report['updates_per_s']:8,.1f} updates/s   "
+              f"click → edit p50 {report['click_to_edit_p50_ms']:8.1f} ms   p99 {report['click_to_edit_p99_ms']:8.1f} ms   "
+              f"peak {pool.get('peak_in_flight', 0):4}   saturated {pool.get('saturated', 0) / pool['requests']:6.1%}")
+
+
+# ==================== لابی ====================
+
+class _RecordingScheduler:
+    """صف ویرایش ساختگی که فقط ویرایش‌های درخواست‌شده را می‌شمارد"""
+
+    def __init__(self):
+        self.edits = 0
+
+    def submit(self, chat_id, message_id, text, reply_markup=None, inline_message_id=None):
+        self.edits += 1
+
+
+def _lobby_events(chats: int, games_per_chat: int, span: float) -> List[Tuple[float, int, str, int]]:
+    """(زمان، شماره بازی، رویداد، چت): ساخت، پیوستن و پایان هر بازی در بازه span ثانیه"""
+    rng = random.Random(1)
+    events = []
+    for i in range(chats * games_per_chat):
+        created = rng.uniform(0, span * 0.6)
+        joined = created + rng.uniform(0, span * 0.2)
+        finished = joined + rng.uniform(0, span * 0.2)
+        chat_id = i % chats + 1
+        events += [(created, i, "create", chat_id), (joined, i, "join", chat_id), (finished, i, "finish", chat_id)]
+    return sorted(events)
+
+
+def bench_lobby():
+    chats, games_per_chat, span = 50, 40, 3.0
+    events = _lobby_events(chats, games_per_chat, span)
+
+    async def run(debounce: float) -> Tuple["HOKM.Lobby", _RecordingScheduler]:
+        manager = HOKM.GameManager()
+        scheduler = _RecordingScheduler()
+        lobby = HOKM.Lobby(manager, scheduler, debounce=debounce)
+        manager.on_chat_change = lobby.mark
+        for chat_id in range(1, chats + 1):
+            lobby.open(chat_id, 1, lobby.render(chat_id))
+        games = {}
+        started = time.perf_counter()
+        for at, i, event, chat_id in events:
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if event == "create":
+                p1, _ = _players()
+                p1.user_id = 2 * i + 1
+                games[i] = manager.create_game(chat_id, p1)
+            elif event == "join":
+                _, p2 = _players()
+                p2.user_id = 2 * i + 2
+                manager.join_game(games[i], p2)
+            else:
+                manager.delete_game(games.pop(i).game_id)
+        await asyncio.sleep(debounce * 2)
+        return lobby, scheduler
+
+    print(f"  {chats} chats x {games_per_chat} games in {span}s ({len(events)} changes)")
+    print(f"  edit per change  {len(events):6} edits")
+    for debounce in (0.1, 0.5, 2.0):
+        lobby, scheduler = asyncio.run(run(debounce))
+        print(f"  debounce {debounce:4.1f}s    {scheduler.edits:6} edits   "
+              f"({lobby.counters['unchanged']} unchanged renders skipped, {lobby.counters['flushes']} flushes)")
+
+    manager = HOKM.GameManager()
+    lobby = HOKM.Lobby(manager, _RecordingScheduler())
+    for i in range(HOKM.LOBBY_MAX_GAMES * 2):
+        p1, _ = _players()
+        p1.user_id = i + 1
+        manager.create_game(1, p1)
+    render_t = _timeit(lambda: [lobby.render(1) for _ in range(1000)]) / 1000
+    print(f"  render {render_t * 1e6:8.1f} us/lobby ({HOKM.LOBBY_MAX_GAMES * 2} waiting games)")
+
+
+# ==================== اجرا ====================
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    "engine": bench_engine,
+    "chat_index": bench_chat_index,
+    "store": bench_store,
+    "callback_codec": bench_callback_codec,
+    "render": bench_render,
+    "edit_scheduler": bench_edit_scheduler,
+    "concurrency": bench_concurrency,
+    "click_storm": bench_click_storm,
+    "bot_table": bench_bot_table,
+    "board_sizes": bench_board_sizes,
+    "shared_backend": bench_shared_backend,
+    "metrics": bench_metrics,
+    "leaderboard": bench_leaderboard,
+    "history": bench_history,
+    "quickmatch": bench_quickmatch,
+    "inline": bench_inline,
+    "cold_start": bench_cold_start,
+    "http_pool": bench_http_pool,
+    "lobby": bench_lobby,
+}
+
+
+def main(argv: List[str]):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        print(f"▶ {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
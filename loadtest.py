@@ -0,0 +1,515 @@
+"""تست بار آفلاین با یک Bot API ساختگی
+
+ربات واقعی (Application و همه هندلرها) به یک سرور محلی وصل می‌شود که
+متدهای Bot API مورد استفاده ربات را شبیه‌سازی می‌کند؛ هزاران بازیکن
+هم‌زمان بازی می‌سازند، می‌پیوندند و تا پایان بازی می‌کنند.
+
+اجرا:
+    python loadtest.py                          # ۱۰۰۰ بازی هم‌زمان
+    python loadtest.py --games 5000 --misclick 0.2
+    python loadtest.py --telegram-limits        # با محدودیت واقعی ویرایش پیام
+    python loadtest.py --inline                 # بازی با کارت‌های حالت اینلاین
+    python loadtest.py --api-latency 0.05 --pool-size 8
+    python loadtest.py --lobby                  # نفر دوم از دکمه پیام لابی می‌پیوندد
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="تست بار ربات دوز با Bot API ساختگی")
+    parser.add_argument("--games", type=int, default=1000, help="تعداد بازی‌های هم‌زمان (دو بازیکن در هر بازی)")
+    parser.add_argument("--size", type=int, default=3, help="اندازه صفحه")
+    parser.add_argument("--misclick", type=float, default=0.1, help="احتمال کلیک حریف خارج از نوبت")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="تاخیر هر درخواست Bot API (ثانیه)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="حداکثر انتظار برای ویرایش پیام")
+    parser.add_argument("--quickmatch", action="store_true",
+                        help="بازیکنان در چت خصوصی خود /quickmatch می‌زنند و بین دو چت بازی می‌کنند")
+    parser.add_argument("--inline", action="store_true",
+                        help="بازی‌ها با کارت حالت اینلاین شروع می‌شوند (@ربات در چت)")
+    parser.add_argument("--lobby", action="store_true",
+                        help="هر چت پیام لابی دارد و نفر دوم از دکمه لابی می‌پیوندد")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="اندازه استخر اتصال Bot API (پیش‌فرض: BOT_API_POOL_SIZE)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="محدودیت‌های پیش‌فرض ویرایش پیام را حفظ کن")
+    parser.add_argument("--json", action="store_true", help="خروجی JSON برای CI")
+    return parser.parse_args(argv)
+
+
+ARGS = parse_args(sys.argv[1:]) if __name__ == "__main__" else None
+
+# تنظیمات ماژول اصلی هنگام import خوانده می‌شوند
+os.environ.setdefault("TOKEN", "123456:LOADTEST")
+# آرشیو بازی‌ها در یک فایل موقت
+os.environ.setdefault("HISTORY_PATH", os.path.join(tempfile.mkdtemp(prefix="ttt-loadtest-"), "history.bin"))
+if ARGS is not None and not ARGS.telegram_limits:
+    # Bot API ساختگی محدودیت نرخ ندارد؛ گلوگاه باید خود ربات باشد
+    os.environ.setdefault("EDIT_CHAT_RATE", "100000")
+    os.environ.setdefault("EDIT_CHAT_BURST", "100000")
+    os.environ.setdefault("EDIT_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("EDIT_GLOBAL_BURST", "1000000")
+
+if ARGS is not None and ARGS.pool_size:
+    os.environ["BOT_API_POOL_SIZE"] = str(ARGS.pool_size)
+
+import HOKM
+from telegram import Update
+
+# لاگ هر درخواست httpx خروجی CI را پر می‌کند
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+NOT_MODIFIED = "Bad Request: message is not modified: specified new message content and reply markup are exactly the same"
+
+MessageKey = Tuple[int, int]
+# پیام‌های اینلاین chat_id ندارند؛ کلیدشان (INLINE_CHAT, inline_message_id) است
+INLINE_CHAT = 0
+
+
+# ==================== Bot API ساختگی ====================
+
+class FakeBotAPI:
+    """جایگزین محلی متدهای Bot API که ربات استفاده می‌کند"""
+
+    def __init__(self, token: str, latency: float = 0.0):
+        self.token = token
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.messages: Dict[MessageKey, Tuple[str, dict]] = {}
+        self.versions: Counter = Counter()
+        self.last_message: Dict[int, int] = {}
+        self.webhook_url = ""
+        self.inline_answers: Dict[str, List[dict]] = {}
+        self._next_inline_id = 0
+        self._events: Dict[MessageKey, asyncio.Event] = {}
+        self._next_message_id: Counter = Counter()
+        self._methods = {
+            "getMe": self.get_me,
+            "setWebhook": self.set_webhook,
+            "deleteWebhook": self.ok,
+            "getWebhookInfo": self.get_webhook_info,
+            "sendMessage": self.send_message,
+            "editMessageText": self.edit_message_text,
+            "answerCallbackQuery": self.ok,
+            "pinChatMessage": self.ok,
+            "unpinChatMessage": self.ok,
+            "answerInlineQuery": self.answer_inline_query,
+        }
+
+    def routes(self) -> Dict[str, HOKM.HttpRoute]:
+        return {f"/bot{self.token}/{name}": self._route(name) for name in self._methods}
+
+    def _route(self, name: str) -> HOKM.HttpRoute:
+        handler = self._methods[name]
+
+        async def route(method: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+            self.calls[name] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            params = dict(parse_qsl(body.decode()))
+            try:
+                result = handler(params)
+            except ValueError as e:
+                self.errors[name] += 1
+                payload = {"ok": False, "error_code": 400, "description": str(e)}
+                return 400, "application/json", json.dumps(payload).encode()
+            return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
+        return route
+
+    def ok(self, params: dict):
+        return True
+
+    def get_me(self, params: dict):
+        return BOT_USER
+
+    def set_webhook(self, params: dict):
+        self.webhook_url = params["url"]
+        return True
+
+    def get_webhook_info(self, params: dict):
+        return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+
+    def send_message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        self._next_message_id[chat_id] += 1
+        message_id = self._next_message_id[chat_id]
+        self.last_message[chat_id] = message_id
+        self._store((chat_id, message_id), params)
+        # کلید (chat_id, 0) با هر پیام تازه در آن چت تغییر می‌کند
+        self._notify((chat_id, 0))
+        return self._message(chat_id, message_id, params["text"])
+
+    def edit_message_text(self, params: dict):
+        if "inline_message_id" in params:
+            key = (INLINE_CHAT, int(params["inline_message_id"]))
+        else:
+            key = (int(params["chat_id"]), int(params["message_id"]))
+        if key not in self.messages:
+            raise ValueError("Bad Request: message to edit not found")
+        markup = json.loads(params.get("reply_markup", "{}"))
+        if self.messages[key] == (params["text"], markup):
+            raise ValueError(NOT_MODIFIED)
+        self._store(key, params)
+        # ویرایش پیام اینلاین فقط true برمی‌گرداند
+        return True if key[0] == INLINE_CHAT else self._message(*key, params["text"])
+
+    def answer_inline_query(self, params: dict):
+        self.inline_answers[params["inline_query_id"]] = json.loads(params["results"])
+        return True
+
+    def send_inline(self, result: dict) -> MessageKey:
+        """کاربر یکی از نتایج اینلاین را در چت می‌فرستد (کار خود تلگرام)"""
+        self._next_inline_id += 1
+        key = (INLINE_CHAT, self._next_inline_id)
+        self._store(key, {
+            "text": result["input_message_content"]["message_text"],
+            "reply_markup": json.dumps(result["reply_markup"]),
+        })
+        return key
+
+    def _store(self, key: MessageKey, params: dict):
+        self.messages[key] = (params["text"], json.loads(params.get("reply_markup", "{}")))
+        self._notify(key)
+
+    def _notify(self, key: MessageKey):
+        self.versions[key] += 1
+        event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    @staticmethod
+    def _message(chat_id: int, message_id: int, text: str) -> dict:
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": "loadtest"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def wait_change(self, key: MessageKey, version: int, timeout: float) -> bool:
+        """انتظار تا پیام نسخه‌ای جدیدتر از version داشته باشد"""
+        deadline = time.perf_counter() + timeout
+        while self.versions[key] == version:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            event = self._events.setdefault(key, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+# ==================== بازیکن‌های شبیه‌سازی‌شده ====================
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadTest:
+    def __init__(self, application, api: FakeBotAPI, args: argparse.Namespace):
+        self.application = application
+        self.api = api
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.update_id = 0
+        self.update_latency: List[float] = []
+        self.edit_latency: List[float] = []
+        self.queue_wait: List[float] = []
+        self.counters: Counter = Counter()
+
+    async def submit(self, payload: dict):
+        """پردازش یک آپدیت از همان مسیر Application؛ زمان شامل انتظار در صف هم‌زمانی است"""
+        self.update_id += 1
+        payload["update_id"] = self.update_id
+        update = Update.de_json(payload, self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(
+            update, self.application.process_update(update)
+        )
+        self.update_latency.append(time.perf_counter() - started)
+        self.counters["updates"] += 1
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"p{user_id}"}
+
+    async def command(self, chat_id: int, user_id: int, text: str):
+        command = text.split()[0]
+        await self.submit({"message": {
+            "message_id": 0,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": "loadtest"},
+            "from": self._user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        }})
+
+    async def click(self, key: MessageKey, user_id: int, data: str):
+        chat_id, message_id = key
+        self.counters["callbacks"] += 1
+        query = {
+            "id": str(self.update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+        }
+        if chat_id == INLINE_CHAT:
+            query["inline_message_id"] = str(message_id)
+        else:
+            query["message"] = FakeBotAPI._message(chat_id, message_id, self.api.messages[key][0])
+        await self.submit({"callback_query": query})
+
+    async def inline_query(self, user_id: int, text: str) -> List[dict]:
+        query_id = f"iq{self.update_id + 1}"
+        await self.submit({"inline_query": {
+            "id": query_id,
+            "from": self._user(user_id),
+            "query": text,
+            "offset": "",
+        }})
+        return self.api.inline_answers.pop(query_id)
+
+    def buttons(self, key: MessageKey) -> Dict[HOKM.CallbackAction, List[Tuple[str, int]]]:
+        """دکمه‌های پیام فعلی به تفکیک عمل: (callback_data, arg)"""
+        found: Dict[HOKM.CallbackAction, List[Tuple[str, int]]] = {}
+        for row in self.api.messages[key][1].get("inline_keyboard", []):
+            for button in row:
+                decoded = HOKM.decode_callback(button.get("callback_data", ""))
+                if decoded is not None:
+                    action, _, arg = decoded
+                    found.setdefault(action, []).append((button["callback_data"], arg))
+        return found
+
+    async def play(self, index: int):
+        """یک بازی کامل: ساخت، پیوستن و حرکت به نوبت تا پایان"""
+        chat_id = -1_000_000 - index
+        players = (2 * index + 1, 2 * index + 2)
+
+        await self.command(chat_id, players[0], f"/newgame {self.args.size}")
+        key = (chat_id, self.api.last_message[chat_id])
+        version = self.api.versions[key]
+        join = self.buttons(key)[HOKM.CallbackAction.JOIN][0][0]
+        await self.click(key, players[1], join)
+        await self._play_moves(key, version, players)
+
+    async def play_lobby(self, index: int):
+        """بازی از طریق لابی: نفر دوم دکمه بازی را در پیام لابی (پس از ویرایش تاخیری آن) پیدا می‌کند"""
+        chat_id = -1_000_000 - index
+        players = (2 * index + 1, 2 * index + 2)
+
+        await self.command(chat_id, players[0], "/lobby")
+        lobby_key = (chat_id, self.api.last_message[chat_id])
+        lobby_version = self.api.versions[lobby_key]
+        await self.command(chat_id, players[0], f"/newgame {self.args.size}")
+        key = (chat_id, self.api.last_message[chat_id])
+        version = self.api.versions[key]
+        while HOKM.CallbackAction.LOBBY not in self.buttons(lobby_key):
+            if not await self.api.wait_change(lobby_key, lobby_version, self.args.timeout):
+                self.counters["stalled_games"] += 1
+                return
+            lobby_version = self.api.versions[lobby_key]
+        join = self.buttons(lobby_key)[HOKM.CallbackAction.LOBBY][0][0]
+        await self.click(lobby_key, players[1], join)
+        await self._play_moves(key, version, players)
+
+    async def play_inline(self, index: int):
+        """بازی اینلاین: کارت از نتایج @ربات فرستاده می‌شود و دو کلیک اول بازیکن‌ها را تعیین می‌کند"""
+        players = (2 * index + 1, 2 * index + 2)
+        results = await self.inline_query(players[0], str(self.args.size))
+        key = self.api.send_inline(results[0])
+        version = self.api.versions[key]
+        play = self.buttons(key)[HOKM.CallbackAction.INLINE][0][0]
+        await self.click(key, players[0], play)
+        await self.click(key, players[1], play)
+        await self._play_moves(key, version, players)
+
+    async def _play_moves(self, key: MessageKey, version: int, players: Tuple[int, int]):
+        """حرکت به نوبت تا پایان بازی؛ version نسخه پیام قبل از شروع بازی است"""
+        names = {f"p{user_id}": user_id for user_id in players}
+        while True:
+            if not await self.api.wait_change(key, version, self.args.timeout):
+                self.counters["stalled_games"] += 1
+                return
+            version = self.api.versions[key]
+            text = self.api.messages[key][0]
+            moves = self.buttons(key).get(HOKM.CallbackAction.MOVE)
+            if "نوبت: " not in text or not moves:
+                self.counters["finished_games"] += 1
+                return
+            turn = names[text.split("نوبت: ", 1)[1].split(" (", 1)[0]]
+
+            if self.rng.random() < self.args.misclick:
+                # حریف خارج از نوبت کلیک می‌کند؛ نباید پیام تغییر کند
+                other = players[0] if turn == players[1] else players[1]
+                await self.click(key, other, self.rng.choice(moves)[0])
+                self.counters["misclicks"] += 1
+
+            clicked = time.perf_counter()
+            await self.click(key, turn, self.rng.choice(moves)[0])
+            self.counters["moves"] += 1
+            if await self.api.wait_change(key, version, self.args.timeout):
+                self.edit_latency.append(time.perf_counter() - clicked)
+
+    async def quickmatch(self, user_id: int):
+        """بازیکن /quickmatch در چت خصوصی خودش؛ فقط در نوبت خودش کلیک می‌کند"""
+        chat_id = user_id
+        name = f"p{user_id}"
+        chat_key = (chat_id, 0)
+        seen = self.api.versions[chat_key]
+        queued = time.perf_counter()
+        await self.command(chat_id, user_id, "/quickmatch")
+
+        # انتظار برای صفحه بازی (اولین پیام دارای دکمه حرکت)
+        while True:
+            if not await self.api.wait_change(chat_key, seen, self.args.timeout):
+                self.counters["stalled_games"] += 1
+                return
+            seen = self.api.versions[chat_key]
+            # پیام «در صف» ممکن است بعد از صفحه بازی برسد
+            boards = [
+                (chat_id, message_id) for message_id in range(1, self.api.last_message[chat_id] + 1)
+                if HOKM.CallbackAction.MOVE in self.buttons((chat_id, message_id))
+            ]
+            if boards:
+                key = boards[-1]
+                break
+        self.queue_wait.append(time.perf_counter() - queued)
+
+        version = self.api.versions[key]
+        while True:
+            text = self.api.messages[key][0]
+            moves = self.buttons(key).get(HOKM.CallbackAction.MOVE)
+            if "نوبت: " not in text or not moves:
+                # هر بازی دو بار شمرده می‌شود، یک بار برای هر بازیکن
+                self.counters["finished_players"] += 1
+                return
+            clicked = time.perf_counter()
+            mine = text.split("نوبت: ", 1)[1].split(" (", 1)[0] == name
+            if mine:
+                await self.click(key, user_id, self.rng.choice(moves)[0])
+                self.counters["moves"] += 1
+            if not await self.api.wait_change(key, version, self.args.timeout):
+                self.counters["stalled_games"] += 1
+                return
+            if mine:
+                self.edit_latency.append(time.perf_counter() - clicked)
+            version = self.api.versions[key]
+
+    def report(self, elapsed: float) -> dict:
+        moves = self.counters["moves"]
+        calls = sum(self.api.calls.values())
+        return {
+            "games": self.args.games,
+            "finished_games": self.counters["finished_games"] + self.counters["finished_players"] // 2,
+            "stalled_games": self.counters["stalled_games"],
+            "updates": self.counters["updates"],
+            "moves": moves,
+            "misclicks": self.counters["misclicks"],
+            "elapsed_s": round(elapsed, 3),
+            "updates_per_s": round(self.counters["updates"] / elapsed, 1),
+            "update_p50_ms": round(_percentile(self.update_latency, 0.50) * 1000, 3),
+            "update_p99_ms": round(_percentile(self.update_latency, 0.99) * 1000, 3),
+            "click_to_edit_p50_ms": round(_percentile(self.edit_latency, 0.50) * 1000, 3),
+            "click_to_edit_p99_ms": round(_percentile(self.edit_latency, 0.99) * 1000, 3),
+            "queue_wait_p50_ms": round(_percentile(self.queue_wait, 0.50) * 1000, 3),
+            "queue_wait_p99_ms": round(_percentile(self.queue_wait, 0.99) * 1000, 3),
+            "api_calls": dict(self.api.calls),
+            "api_errors": dict(self.api.errors),
+            "api_calls_per_move": round(calls / moves, 3) if moves else 0.0,
+            "answers_per_callback": round(
+                self.api.calls["answerCallbackQuery"] / self.counters["callbacks"], 3
+            ) if self.counters["callbacks"] else 0.0,
+            "clicks_rejected": {
+                reason: count for reason, count in HOKM.click_admission.counters.items() if reason != "admitted"
+            },
+            "bot_api_pools": {
+                name: {"size": request.pool_size, **request.pool_stats}
+                for name, request in HOKM.request_pools.items()
+            },
+            "lobby_edits": HOKM.lobby.counters["edits"],
+            "budget_exceeded": sum(HOKM.metrics.counters.get("callback_api_budget_exceeded_total", {}).values()),
+            # ru_maxrss در لینوکس بر حسب کیلوبایت است
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    api = FakeBotAPI(HOKM.TOKEN, args.api_latency)
+    server = await HOKM.serve_http("127.0.0.1", 0, api.routes())
+    port = server.sockets[0].getsockname()[1]
+    application = HOKM.build_application(base_url=f"http://127.0.0.1:{port}/bot")
+    test = LoadTest(application, api, args)
+    try:
+        async with application:
+            await HOKM.post_init(application)
+            started = time.perf_counter()
+            if args.quickmatch:
+                await asyncio.gather(*(test.quickmatch(user_id) for user_id in range(1, 2 * args.games + 1)))
+            elif args.inline:
+                await asyncio.gather(*(test.play_inline(i) for i in range(args.games)))
+            elif args.lobby:
+                await asyncio.gather(*(test.play_lobby(i) for i in range(args.games)))
+            else:
+                await asyncio.gather(*(test.play(i) for i in range(args.games)))
+            elapsed = time.perf_counter() - started
+            await HOKM.post_shutdown(application)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return test.report(elapsed)
+
+
+def print_report(report: dict):
+    print(f"🎮 {report['finished_games']}/{report['games']} بازی تمام شد"
+          f" ({report['stalled_games']} گیرکرده) در {report['elapsed_s']} ثانیه")
+    print(f"  updates/s          {report['updates_per_s']:12,.1f}   ({report['updates']} آپدیت، {report['moves']} حرکت)")
+    print(f"  update latency     p50 {report['update_p50_ms']:8.2f} ms   p99 {report['update_p99_ms']:8.2f} ms")
+    print(f"  click → edit       p50 {report['click_to_edit_p50_ms']:8.2f} ms   p99 {report['click_to_edit_p99_ms']:8.2f} ms")
+    if report["queue_wait_p50_ms"]:
+        print(f"  quickmatch wait    p50 {report['queue_wait_p50_ms']:8.2f} ms   p99 {report['queue_wait_p99_ms']:8.2f} ms")
+    print(f"  Bot API calls/move {report['api_calls_per_move']:12.2f}")
+    print(f"  answers/callback   {report['answers_per_callback']:12.2f}   (بودجه رد شده: {report['budget_exceeded']})")
+    if report["lobby_edits"]:
+        print(f"  lobby edits        {report['lobby_edits']:12}")
+    if report["clicks_rejected"]:
+        print(f"  rejected clicks    {report['clicks_rejected']}")
+    for method, count in sorted(report["api_calls"].items()):
+        errors = report["api_errors"].get(method, 0)
+        print(f"    {method:<20} {count:8}" + (f"   ({errors} خطا)" if errors else ""))
+    for name, stats in sorted(report["bot_api_pools"].items()):
+        print(f"  pool {name:<13} size {stats['size']:4}   peak {stats.get('peak_in_flight', 0):6}"
+              f"   saturated {stats.get('saturated', 0):6}   timeouts {stats.get('pool_timeouts', 0)}")
+    print(f"  peak RSS           {report['peak_rss_mb']:10.1f} MB")
+
+
+def main(args: argparse.Namespace) -> int:
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 1 if report["stalled_games"] or report["budget_exceeded"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(ARGS))